@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# backfill_spp_data.py - fill gaps in the RTBM LMP, DA LMP and STLF history.
+#
+#     python3 backfill_spp_data.py [--days 1] [--feeds rtbm_lmp,da_lmp,stlf]
+#                                  [--workers 4] [--rate 2] [--dry-run]
+#
+# fetch_spp_data_batch.py only ever fetches the current interval, so anything it missed (a
+# stopped job, an outage, a file that was late) stays missing. This:
+#   * finds the missing intervals in the last --days, for all feeds, with one gap query: every
+#     5-minute interval ending with no RTBM rows or no STLF actual, and every hour ending with no
+#     DA rows, up to the latest generation_mix interval
+#   * turns each one into the SppInterval whose file holds it, and so into the same
+#     By_Interval / By_Day / STLF folder URLs the regular job uses (the fetch_* functions are
+#     shared, STLF folder quirk included); DA hours are grouped into one file per day
+#   * downloads them on a pool of --workers threads, never starting more than --rate downloads
+#     a second between them, and with only a few files waiting to be loaded at a time
+#   * loads them on the main thread in batches of about BATCH_ROWS rows, through the regular
+#     load_* functions (COPY + insert ... on conflict do nothing), committing each batch
+#
+# Each batch is committed and recorded (spp_fetch.mark_loaded) before the next, so a backfill
+# that is stopped or crashes can simply be run again: the gap query only finds what is still
+# missing. Files that fail (most often a 404 for an interval SPP never published) are counted in
+# backfill_state.json, and skipped after MAX_ATTEMPTS tries.
+#
+# Run it from the batch directory, like the other scripts; it imports fetch_spp_data_batch.py,
+# which connects to the database.
+
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+from sqlalchemy import text
+
+import fetch_spp_data_batch as fb
+import spp_fetch
+from spp_interval import SppInterval, SPP_TIMEZONE
+
+# feed -> (table, primary key) of the feeds that can be backfilled
+BACKFILL = {
+    'rtbm_lmp': ('rtbm_lmp_by_location', ['gmtinterval_end', 'settlement_location']),
+    'da_lmp': ('da_lmp_by_location', ['gmtinterval_end', 'settlement_location']),
+    'stlf': ('stlf_vs_actual', ['gmtinterval_end']),
+}
+
+STATE_FILE = 'backfill_state.json'
+MAX_ATTEMPTS = 3
+BATCH_ROWS = 50000
+
+
+def find_gaps(con, days):
+    # (feed, missing interval ending) for every gap in the last days, in one query
+    return pd.read_sql(text("""
+        with bounds as (
+            select max(gmt_mkt_interval) as end_t,
+                   max(gmt_mkt_interval) - make_interval(days => :days) as start_t
+            from generation_mix
+        )
+        , rt as (
+            select generate_series(start_t + interval '5 minutes', end_t, interval '5 minutes') as t from bounds
+        )
+        , hours as (
+            select generate_series(date_trunc('hour', start_t) + interval '1 hour', end_t, interval '1 hour') as t from bounds
+        )
+        select 'rtbm_lmp' as feed, t from rt
+        where not exists (select 1 from rtbm_lmp_by_location x where x.gmtinterval_end = rt.t)
+        union all
+        select 'stlf', t from rt
+        where not exists (select 1 from stlf_vs_actual x where x.gmtinterval_end = rt.t and x.actual is not null)
+        union all
+        select 'da_lmp', t from hours
+        where not exists (select 1 from da_lmp_by_location x where x.gmtinterval_end = hours.t)
+        order by 1, 2
+        """), con, params={'days': days})
+
+
+def work_units(gaps):
+    # [(feed, SppInterval)], one per source file, oldest first
+    units = {}
+    for feed, t in gaps.itertuples(index=False):
+        t = pd.Timestamp(t).tz_convert('UTC')
+        if feed == 'da_lmp':
+            # one file per operating day, hour ending 01:00 through 24:00 local; start from 00:30
+            day = (t.tz_convert(SPP_TIMEZONE) - pd.Timedelta(hours=1)).normalize()
+            ci = SppInterval(day + pd.Timedelta(minutes=30))
+        else:
+            # the file for the interval ending t is the "current" one 5 minutes earlier
+            ci = SppInterval(t - pd.Timedelta(minutes=5))
+        units[(feed, ci.interval_end)] = (feed, ci)
+    return [units[key] for key in sorted(units)]
+
+
+def unit_key(feed, ci):
+    return f"{feed} {ci.interval_end.isoformat()}"
+
+
+class RateLimit:
+    # at most per_second calls to wait() return per second, across threads
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'failed': {}}
+
+
+def save_state(state):
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, STATE_FILE)
+
+
+def backfill(con, days=1, feeds=BACKFILL, workers=4, rate=2.0, dry_run=False):
+    gaps = find_gaps(con, days)
+    gaps = gaps[gaps['feed'].isin(feeds)]
+    state = load_state()
+    units = [(feed, ci) for feed, ci in work_units(gaps)
+             if state['failed'].get(unit_key(feed, ci), {}).get('attempts', 0) < MAX_ATTEMPTS]
+    print(f"backfill: {len(gaps.index)} missing intervals in the last {days} days, {len(units)} files to fetch")
+    print(gaps.groupby('feed')['t'].agg(['count', 'min', 'max']).to_string())
+    if dry_run or not units:
+        return
+
+    limit = RateLimit(rate)
+
+    def fetch(feed, ci):
+        limit.wait()
+        return fb.FEEDS[feed][2](ci)
+
+    start = time.perf_counter()
+    done = failed = rows = 0
+    pending = {feed: [] for feed in feeds}     # downloaded, not yet loaded: [(ci, df)]
+
+    def flush(feed):
+        nonlocal rows
+        batch = sorted(pending[feed], key=lambda p: p[0].interval_end)
+        pending[feed] = []
+        if not batch:
+            return
+        table, primary_keys = BACKFILL[feed]
+        # files overlap (STLF); keep each row from the latest file that has it
+        df = pd.concat([df for _, df in batch], ignore_index=True).drop_duplicates(primary_keys, keep='last')
+        fb.FEEDS[feed][3](con, df)
+        con.commit()
+        for _, part in batch:
+            spp_fetch.mark_loaded(part.attrs.get('source_url'))
+        spp_fetch.save_state()
+        rows += len(df.index)
+
+    def progress():
+        elapsed = time.perf_counter() - start
+        rate_now = (done + failed) / elapsed if elapsed else 0
+        eta = (len(units) - done - failed) / rate_now if rate_now else float('nan')
+        print(f"backfill: {done + failed}/{len(units)} files ({failed} failed), {rows} rows loaded, "
+              f"{rate_now:.2f} files/s, {rows / elapsed:.0f} rows/s, about {eta / 60:.1f} minutes to go")
+
+    todo = iter(units)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # keep the pool busy, but don't let downloads run far ahead of the loads
+            while len(in_flight) < workers * 2:
+                unit = next(todo, None)
+                if unit is None:
+                    break
+                in_flight[pool.submit(fetch, *unit)] = unit
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                feed, ci = in_flight.pop(future)
+                key = unit_key(feed, ci)
+                try:
+                    df = future.result()
+                    # None: already loaded by an earlier run (see spp_fetch.loaded)
+                    if df is not None:
+                        pending[feed].append((ci, df))
+                    state['failed'].pop(key, None)
+                    done += 1
+                except Exception as e:
+                    entry = state['failed'].setdefault(key, {'attempts': 0})
+                    entry['attempts'] += 1
+                    entry['error'] = repr(e)
+                    failed += 1
+                    print(f"backfill: {key} failed (attempt {entry['attempts']}): {e!r}")
+
+            for feed in feeds:
+                if sum(len(df.index) for _, df in pending[feed]) >= BATCH_ROWS:
+                    try:
+                        flush(feed)
+                    except Exception:
+                        con.rollback()
+                        traceback.print_exc()
+                        raise
+                    save_state(state)
+                    progress()
+
+    for feed in feeds:
+        flush(feed)
+    save_state(state)
+    progress()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="fill gaps in the RTBM LMP, DA LMP and STLF history")
+    parser.add_argument('--days', type=int, default=1, help="how far back to look for gaps")
+    parser.add_argument('--feeds', default=','.join(BACKFILL), help="comma-separated feeds to backfill")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent downloads")
+    parser.add_argument('--rate', type=float, default=2.0, help="most downloads started per second")
+    parser.add_argument('--dry-run', action='store_true', help="only report the gaps")
+    args = parser.parse_args()
+
+    feeds = [feed for feed in args.feeds.split(',') if feed]
+    unknown = set(feeds) - set(BACKFILL)
+    if unknown:
+        parser.error(f"can't backfill {', '.join(sorted(unknown))}; choose from {', '.join(BACKFILL)}")
+    backfill(fb.con, days=args.days, feeds=feeds, workers=args.workers, rate=args.rate, dry_run=args.dry_run)
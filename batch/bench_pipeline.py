@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# bench_pipeline.py - benchmark the fetch and cleanup jobs against recorded SPP files.
+#
+# Replays a recorded file for each feed (GenMix2Hour, RTBM-LMP-SL, DA-LMP-SL, OP-STLF, OP-MTLF,
+# ACE, TieFlows, RTBM-BC) from a local fixture server into a throwaway database, and times, for
+# 1, 14 and 90 days of history in the tables:
+#     history       filling the tables with the history (not a measurement of the jobs, but
+#                   reported so a slow fill is not mistaken for a slow job)
+#     update        each update_* function in fetch_spp_data_batch.py: download from the fixture
+#                   server, parse, the *_loaded check and the load
+#     run_all       the whole fetch run, as cron runs it, with each file's rows deleted first so
+#                   every feed loads; once for each --load-connections (1 is the one shared
+#                   connection; more loads the feeds side by side, see run_all)
+#     insert_new    pg_insertnew of the feed's file moved one file later (all rows new)
+#     insert_dup    and the same again (all rows already there)
+#     view          reading each view created by views.sql (median of --repeat reads)
+#     trim          trim_table for each table, as cleanup_old_data_batch.py runs it
+# The history is the recorded file repeated back in time, one copy per span of the file (5 minutes
+# for RTBM, a day for DA, 2 hours for GenMix2Hour, ...). All times in the files are moved by a
+# whole number of 5-minute intervals so the newest interval is the current one: the views that
+# look back from now, and the cleanup's "older than 2 weeks", see the same rows whenever the
+# fixtures were recorded.
+#
+# The results go to bench_results/bench-<time>.json; with --compare <earlier results>, each
+# measurement is compared with the earlier one and the run exits with status 1 if any is more than
+# --threshold slower (and by more than --noise seconds), so it can gate a change:
+#     python3 bench_pipeline.py --days 1,14 --compare bench_results/bench-20261017T120000.json
+#
+# The fixtures are recorded once from SPP (the current interval, one file per feed) with
+#     python3 bench_pipeline.py --record
+# into bench_fixtures/<feed>.csv, with bench_fixtures/manifest.json saying where and when each
+# came from. Record them again when SPP changes a file format.
+#
+# The database: the server in ../dbconn.json, where a database spp_bench_<pid> is created for the
+# run and dropped at the end (the user needs CREATEDB), or --database <name>, an existing database
+# whose sppdata schema is dropped and recreated - never point that at a database you want to keep.
+# The jobs run against it unchanged: from a temporary directory with its own dbconn.json, as they
+# run from cron. What they print goes to bench.log there (--verbose to see it).
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+BATCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BATCH_DIR, 'bench_fixtures')
+RESULTS_DIR = os.path.join(BATCH_DIR, 'bench_results')
+
+# feed -> what identifies its URL, on the marketplace or on pubftp
+FIXTURES = {
+    'generation_mix': 'generation-mix-historical',
+    'ace': '/Operational_Data/ACE/',
+    'rtbm_lmp': 'rtbm-lmp-by-location',
+    'da_lmp': 'da-lmp-by-location',
+    'stlf': 'stlf-vs-actual',
+    'mtlf': 'mtlf-vs-actual',
+    'tie_flows_long': '/Operational_Data/TIE_FLOW/',
+    'rt_binding': 'rtbm-binding-constraints',
+}
+
+# feed -> the table it loads, that table's time key, and the primary key its load_* function gives it
+TABLES = {
+    'generation_mix': ('generation_mix', 'gmt_mkt_interval', ['gmt_mkt_interval']),
+    'ace': ('area_control_error', 'gmttime', ['gmttime']),
+    'rtbm_lmp': ('rtbm_lmp_by_location', 'gmtinterval_end', ['gmtinterval_end', 'settlement_location']),
+    'da_lmp': ('da_lmp_by_location', 'gmtinterval_end', ['gmtinterval_end', 'settlement_location']),
+    'stlf': ('stlf_vs_actual', 'gmtinterval_end', ['gmtinterval_end']),
+    'mtlf': ('mtlf_vs_actual', 'gmtinterval_end', ['gmtinterval_end']),
+    'tie_flows_long': ('tie_flows_long', 'gmttime', ['gmttime', 'area']),
+    'rt_binding': ('rtbm_binding_constraints', 'gmtinterval_end', ['gmtinterval_end', 'constraint_name']),
+}
+
+INTERVAL = timedelta(minutes=5)
+
+
+def fixture_path(fixtures, feed):
+    return os.path.join(fixtures, f"{feed}.csv")
+
+
+class FixtureServer:
+    # serves each feed's recorded file, whatever interval is asked for, over HTTP on 127.0.0.1;
+    # the fetch job is pointed at it with SPP_MARKETPLACE_URL and SPP_PUBFTP_URL (spp_fetch.py)
+
+    def __init__(self, fixtures):
+        content = {feed: open(fixture_path(fixtures, feed), 'rb').read() for feed in FIXTURES}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                feed = next((f for f, marker in FIXTURES.items() if marker in self.path), None)
+                if feed is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(content[feed])))
+                self.end_headers()
+                self.wfile.write(content[feed])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def shifted(parse, offset):
+    # spp_schema.parse, with every time in the file moved by offset
+    def parse_shifted(feed, file):
+        df = parse(feed, file)
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.DatetimeTZDtype):
+                df[column] = df[column] + offset
+        return df
+    return parse_shifted
+
+
+def time_offset(fixtures):
+    # whole 5-minute intervals from the newest interval in the GenMix2Hour fixture to now
+    import spp_schema
+    with open(fixture_path(fixtures, 'generation_mix'), 'rb') as f:
+        newest = spp_schema.parse('generation_mix', f)['gmt_mkt_interval'].max()
+    return max(timedelta(0), (datetime.now(timezone.utc) - newest) // INTERVAL * INTERVAL)
+
+
+def bootstrap(engine, fixtures, parse):
+    # a new sppdata schema with the two tables the fetch job reads before it loads anything:
+    # settlement_location (the locations in the RTBM fixture, without coordinates) and generation_mix
+    with engine.begin() as con:
+        con.execute(text("drop schema if exists sppdata cascade"))
+        con.execute(text("create schema sppdata"))
+        con.execute(text("set search_path to sppdata"))
+
+        if os.path.exists(fixture_path(fixtures, 'rtbm_lmp')):
+            with open(fixture_path(fixtures, 'rtbm_lmp'), 'rb') as f:
+                names = parse('rtbm_lmp', f)['settlement_location'].drop_duplicates()
+        else:
+            names = pd.Series([], dtype='object')
+        locations = pd.DataFrame({'settlement_location': names, 'est_latitude': float('nan'),
+                                  'est_longitude': float('nan'), 'inferred_location_type': 'Unknown'})
+        locations.to_sql('settlement_location', con=con, index=False)
+        con.execute(text("alter table settlement_location add constraint settlement_location_pk primary key (settlement_location)"))
+
+        with open(fixture_path(fixtures, 'generation_mix'), 'rb') as f:
+            df = parse('generation_mix', f)
+        df['inserted_time'] = pd.Timestamp.now(tz='America/Chicago')
+        df.to_sql('generation_mix', con=con, index=False)
+
+
+def file_span(con, table, key):
+    # how far the rows of table (as loaded from one file) reach, first to last plus one step
+    times = sorted(con.execute(text(f"select distinct {key} from {table}")).scalars())
+    steps = [b - a for a, b in zip(times, times[1:])]
+    return times[-1] - times[0] + (min(steps) if steps else INTERVAL)
+
+
+def add_history(con, table, key, days):
+    # replace the rows of table with copies of them reaching days back from them; returns rows added
+    import spp_partitions
+    span = file_span(con, table, key)
+    copies = math.ceil(timedelta(days=days) / span)
+    columns = [c for c in con.execute(text(f"select * from {table} limit 0")).keys()]
+    select = ', '.join(f"{c} - k * cast(:span as interval)" if c == key else f'"{c}"' for c in columns)
+
+    con.execute(text(f"create temp table bench_seed as select * from {table}"))
+    con.execute(text(f"truncate {table}"))
+    if spp_partitions.relkind(con, table) == 'p':
+        first, last = con.execute(text(f"select min({key}), max({key}) from bench_seed")).first()
+        spp_partitions.ensure_partitions(con, table, pd.date_range(pd.Timestamp(first - copies * span).floor('D'), last, freq='D'), commit=False)
+    added = con.execute(text(f"""
+        insert into {table} ({', '.join(f'"{c}"' for c in columns)})
+        select {select} from bench_seed cross join generate_series(1, :copies) k
+        on conflict do nothing"""), {'span': span, 'copies': copies}).rowcount
+    con.execute(text("drop table bench_seed"))
+    con.commit()
+    con.execute(text(f"analyze {table}"))
+    con.commit()
+    return added, span
+
+
+def run_views(con):
+    # create the views as views.sql does (without psql's backslash commands); returns their names
+    with open(os.path.join(BATCH_DIR, 'views.sql')) as f:
+        sql = '\n'.join(line for line in f.read().splitlines() if not line.startswith('\\'))
+    for statement in sql.split(';\n'):
+        if any(line.strip() and not line.strip().startswith('--') for line in statement.splitlines()):
+            con.execute(text(statement))
+    con.commit()
+    return list(con.execute(text("""
+        select table_name from information_schema.views where table_schema = 'sppdata' order by table_name""")).scalars())
+
+
+def measure(fb, con, days, repeat, log, load_connections=(1,)):
+    # one pass at days of history; returns the result rows
+    import spp_compact
+    import spp_fetch
+    import spp_metrics
+    import spp_partitions
+    results = []
+
+    def result(stage, name, seconds, rows=None):
+        results.append({'days': days, 'stage': stage, 'name': name, 'seconds': round(seconds, 4), 'rows': rows})
+        print(f"  {days:>3}d {stage:<10} {name:<36} {seconds:9.3f}s {'' if rows is None else rows}")
+
+    def forget():
+        # what the fetch job remembers between runs and within a session, so each pass starts cold
+        spp_fetch._state = {}
+        spp_fetch._pending.clear()
+        for path in (spp_fetch.STATE_FILE, 'cache'):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        for cache in (fb.pg_tables_ready, fb.pg_tables_partitioned, fb.pg_tables_compact, spp_partitions._ready, spp_compact._ids):
+            cache.clear()
+
+    forget()
+
+    # load each fixture once, then turn those rows into the history
+    frames = {}
+    with contextlib.redirect_stdout(log):
+        ci = None
+        for name, (needs_ci, _, fetch, _) in fb.FEEDS.items():
+            frames[name] = fetch(ci) if needs_ci else fetch()
+            table, _, keys = TABLES[name]
+            fb.pg_insertnew(table, keys, frames[name], con)
+            if name == 'generation_mix':
+                ci = fb.get_current_interval()
+    spans = {}
+    for name, (table, key, _) in TABLES.items():
+        start = time.perf_counter()
+        added, spans[name] = add_history(con, table, key, days)
+        result('history', table, time.perf_counter() - start, added)
+    forget()
+
+    for name in fb.FEEDS:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            fb.update_feed(name, con)
+        result('update', f"update_{name}", time.perf_counter() - start, len(frames[name].index))
+
+    for n in load_connections:
+        for name, (table, key, _) in TABLES.items():
+            con.execute(text(f"delete from {table} where {key} >= :first"), {'first': frames[name][key].min()})
+        con.commit()
+        forget()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            report = fb.run_all(con, load_connections=n)
+        result('run_all', f"load_connections={n}", time.perf_counter() - start,
+               sum(row.get('inserted', 0) for row in report.values()))
+
+    for name, (table, key, keys) in TABLES.items():
+        later = frames[name].copy()
+        later[key] = later[key] + spans[name]
+        for stage in ('insert_new', 'insert_dup'):
+            spp_metrics.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(log):
+                inserted = fb.pg_insertnew(table, keys, later, con)['inserted']
+            result(stage, table, time.perf_counter() - start, inserted)
+
+    with contextlib.redirect_stdout(log):
+        views = run_views(con)
+    for view in views:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = len(pd.read_sql(text(f"select * from {view}"), con).index)
+            times.append(time.perf_counter() - start)
+            con.commit()
+        result('view', view, sorted(times)[repeat // 2], rows)
+
+    # the cleanup job, as cron runs it; its per-table times are in the line it adds to metrics.jsonl
+    con.commit()
+    with contextlib.redirect_stdout(log):
+        runpy.run_path(os.path.join(BATCH_DIR, 'cleanup_old_data_batch.py'), run_name='bench_cleanup')
+    with open(spp_metrics.METRICS_FILE) as f:
+        record = json.loads(f.read().splitlines()[-1])
+    for table, row in record['feeds'].items():
+        removed = row.get('deleted', row.get('partitions_dropped'))
+        result('trim', table, row['trim_s'], removed)
+    return results
+
+
+def record(fixtures):
+    # download the current file for each feed into fixtures (run from a scratch directory
+    # whose ../dbconn.json is the throwaway database)
+    import spp_fetch
+    import spp_schema
+    os.makedirs(fixtures, exist_ok=True)
+    manifest = {}
+    fetch = spp_fetch.fetch
+
+    def fetch_and_keep(url, feed=None):
+        result = fetch(url, feed)
+        if result.content is not None and feed in FIXTURES:
+            with open(fixture_path(fixtures, feed), 'wb') as f:
+                f.write(result.content)
+            manifest[feed] = {'url': url, 'bytes': result.size,
+                              'recorded': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+            print(f"recorded {feed}: {result.size} bytes from {url}")
+        return result
+
+    spp_fetch.fetch = fetch_and_keep
+    # GenMix2Hour first: the fetch job needs generation_mix to find the current interval
+    fetch_and_keep(f"{spp_fetch.MARKETPLACE_URL}/generation-mix-historical?path=%2FGenMix2Hour.csv", 'generation_mix')
+    return manifest, spp_schema.parse
+
+
+def compare(results, baseline, threshold, noise):
+    # results against an earlier run; returns the rows that got slower
+    before = {(r['days'], r['stage'], r['name']): r['seconds'] for r in baseline['results']}
+    rows = []
+    for r in results:
+        was = before.get((r['days'], r['stage'], r['name']))
+        if was is None or r['stage'] == 'history':
+            continue
+        ratio = r['seconds'] / was if was else float('inf')
+        rows.append({**r, 'baseline': was, 'ratio': round(ratio, 2),
+                     'regression': ratio > 1 + threshold and r['seconds'] - was > noise})
+    df = pd.DataFrame(rows)
+    if len(df.index):
+        print(df[['days', 'stage', 'name', 'baseline', 'seconds', 'ratio', 'regression']].to_string(index=False))
+    return df[df.regression] if len(df.index) else df
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BATCH_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the fetch and cleanup jobs against recorded SPP files")
+    parser.add_argument('--days', default='1,14,90', help="days of history to run at, comma separated (default 1,14,90)")
+    parser.add_argument('--repeat', type=int, default=5, help="reads of each view; the median is reported")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory of recorded files")
+    parser.add_argument('--record', action='store_true', help="record the fixtures from SPP, and stop")
+    parser.add_argument('--database', help="use this existing database (its sppdata schema is dropped!) instead of a new one")
+    parser.add_argument('--keep', action='store_true', help="don't drop the database created for the run")
+    parser.add_argument('--output', help="results file (default bench_results/bench-<time>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare with")
+    parser.add_argument('--threshold', type=float, default=0.25, help="slower by more than this fraction is a regression")
+    parser.add_argument('--noise', type=float, default=0.05, help="and by more than this many seconds")
+    parser.add_argument('--load-connections', default='1,4',
+                        help="connections to load on, in the run_all stage, comma separated (default 1,4)")
+    parser.add_argument('--verbose', action='store_true', help="show what the jobs print")
+    args = parser.parse_args()
+
+    fixtures = os.path.abspath(args.fixtures)
+    missing = [feed for feed in FIXTURES if not os.path.exists(fixture_path(fixtures, feed))]
+    if missing and not args.record:
+        sys.exit(f"no fixtures for {', '.join(missing)} in {fixtures}; record them with --record")
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.now():%Y%m%dT%H%M%S}.json"))
+    baseline = None
+    load_connections = [int(n) for n in args.load_connections.split(',')]
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}"
+    database = args.database or f"spp_bench_{os.getpid()}"
+    if not args.database:
+        admin = create_engine(f"postgresql+psycopg2:{pg_uri}/{di['database']}", isolation_level='AUTOCOMMIT')
+        with admin.connect() as c:
+            c.execute(text(f"create database {database}"))
+    engine = create_engine(f"postgresql+psycopg2:{pg_uri}/{database}")
+
+    # the jobs read ../dbconn.json and keep their state in the working directory
+    scratch = tempfile.mkdtemp(prefix='spp_bench_')
+    os.makedirs(os.path.join(scratch, 'run'))
+    with open(os.path.join(scratch, 'dbconn.json'), 'w') as f:
+        json.dump({**di, 'database': database, 'backend': 'postgres', 'load_connections': max(load_connections)}, f)
+    os.chdir(os.path.join(scratch, 'run'))
+    os.environ['SPP_METRICS_FILE'] = os.path.join(scratch, 'run', 'metrics.jsonl')
+    os.environ.pop('SPP_METRICS_PROM_DIR', None)
+    log = sys.stdout if args.verbose else open('bench.log', 'w')
+
+    server = None
+    try:
+        import spp_schema
+        if args.record:
+            manifest, parse = record(fixtures)
+        else:
+            server = FixtureServer(fixtures)
+            os.environ['SPP_MARKETPLACE_URL'] = f"{server.url}/file-browser-api/download"
+            os.environ['SPP_PUBFTP_URL'] = f"{server.url}/pubftp"
+            offset = time_offset(fixtures)
+            spp_schema.parse = parse = shifted(spp_schema.parse, offset)
+            print(f"fixtures from {fixtures}, times moved forward {offset}; database {database}; log in {os.getcwd()}")
+        bootstrap(engine, fixtures, parse)
+
+        with contextlib.redirect_stdout(log):
+            import fetch_spp_data_batch as fb
+
+        if args.record:
+            ci = fb.get_current_interval()
+            for name, (needs_ci, _, fetch, _) in fb.FEEDS.items():
+                if name != 'generation_mix':
+                    fetch(ci) if needs_ci else fetch()
+            with open(os.path.join(fixtures, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=1)
+            print(f"recorded {len(manifest)} feeds in {fixtures}")
+            sys.exit(0 if len(manifest) == len(FIXTURES) else 1)
+
+        results = []
+        for days in [int(d) for d in args.days.split(',')]:
+            fb.con.commit()
+            bootstrap(engine, fixtures, parse)
+            results.extend(measure(fb, fb.con, days, args.repeat, log, load_connections))
+        fb.con.close()
+
+        try:
+            with open(os.path.join(fixtures, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        with engine.connect() as c:
+            server_version = c.execute(text("show server_version")).scalar()
+        report = {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+                  'postgres': server_version, 'pandas': pd.__version__, 'fixtures': manifest,
+                  'days': sorted({r['days'] for r in results}), 'repeat': args.repeat, 'results': results}
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+        df = pd.DataFrame(results)
+        print(df.pivot_table(index=['stage', 'name'], columns='days', values='seconds', sort=False).to_string())
+        print(f"results in {output}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, args.threshold, args.noise)
+            if len(regressions.index):
+                print(f"{len(regressions.index)} measurements are more than {args.threshold:.0%} slower than {args.compare}")
+                sys.exit(1)
+            print(f"no regressions against {args.compare}")
+    finally:
+        if server is not None:
+            server.close()
+        engine.dispose()
+        if not args.database and not args.keep:
+            with admin.connect() as c:
+                c.execute(text(f"drop database if exists {database} with (force)"))
+        if log is not sys.stdout:
+            log.close()
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
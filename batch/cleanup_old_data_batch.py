@@ -18,8 +18,14 @@ import json
 # read the database information from the json file
 with open('../dbconn.json', 'r') as f:
     di = json.load(f)
+
+# with "backend": "duckdb" the tables are Parquet files, trimmed a day directory at a time (see spp_storage.py)
+import spp_storage
+duckdb_backend = spp_storage.uses_duckdb(di)
+
 # create a connection string for postgresql
-pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+if not duckdb_backend:
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
 
 
 # In[5]:
@@ -36,16 +42,19 @@ import psycopg2
 from sqlalchemy import create_engine
 from sqlalchemy import text
 
-# Create an engine instance
-alchemyEngine   = create_engine(
-    f'postgresql+psycopg2:{pg_uri}', pool_recycle=3600
-).execution_options(isolation_level="AUTOCOMMIT");
+if duckdb_backend:
+    con    = spp_storage.ParquetStore(di.get('path', spp_storage.DEFAULT_PATH))
+else:
+    # Create an engine instance
+    alchemyEngine   = create_engine(
+        f'postgresql+psycopg2:{pg_uri}', pool_recycle=3600
+    ).execution_options(isolation_level="AUTOCOMMIT");
 
- # Connect to PostgreSQL server
-con    = alchemyEngine.connect();
-# con.execute (text("SET default_tablespace = u02_pgdata"))
-con.execute (text("create schema if not exists sppdata authorization current_user"))
-con.execute (text("set search_path to sppdata"))
+     # Connect to PostgreSQL server
+    con    = alchemyEngine.connect();
+    # con.execute (text("SET default_tablespace = u02_pgdata"))
+    con.execute (text("create schema if not exists sppdata authorization current_user"))
+    con.execute (text("set search_path to sppdata"))
 
 con.autocommit=True;
 # Read data from PostgreSQL database table and load into a DataFrame instance
@@ -53,13 +62,15 @@ con.autocommit=True;
 #dataFrame
 
 def pgsqldf(query): 
-    return pd.read_sql(text(query), con)
+    return spp_storage.read_sql(con, query)
 
 
 # In[6]:
 
 
 def space(): 
+    if duckdb_backend:
+        return con.space()
     return pgsqldf("""
     SELECT
       nspname || '.' || C.relname AS "relation",
@@ -85,45 +96,132 @@ print(space())
 # In[7]:
 
 
-# perform vacuum; run space again 
-con.execute (text("vacuum"))
-
-print(space())
+# no database-wide vacuum here: trim_table vacuums the tables it deleted rows from, and only those
 
 
 # In[8]:
 
 
+import time
+import spp_partitions
+import spp_compact
+import spp_metrics
+
+# Rows are deleted in batches of DELETE_BATCH, oldest first, with a DELETE_PAUSE_S pause after each,
+# so that no one statement holds its locks or writes its WAL for long while the 5-minute fetch is
+# loading. Each batch finds its rows through an index that starts with the time key (created if
+# the table has none), and is committed on its own. The rows to delete are estimated by the
+# planner, from the table's statistics, instead of counted; progress is printed every PROGRESS_S.
+# Only a table that lost rows is vacuumed.
+DELETE_BATCH = 10000
+DELETE_PAUSE_S = 0.2
+PROGRESS_S = 10
+
+def time_index(table, timekey): 
+    # make sure an index on table starts with timekey, so that each batch is an index range scan
+    found = con.execute (text("""
+        select exists (select 1 from pg_index i join pg_attribute a 
+                       on a.attrelid = i.indrelid and a.attnum = i.indkey[0]
+                       where i.indrelid = to_regclass(:t) and a.attname = :k)
+        """), {'t': table, 'k': timekey}).scalar()
+    if not found:
+        name = table.split('.')[-1]
+        print (f"{table}: no index on {timekey}; creating {name}_{timekey}_idx")
+        con.execute (text(f"create index concurrently if not exists {name}_{timekey}_idx on {table} ({timekey})"))
+
+def estimate_rows(table, timekey, cutoff): 
+    # (live rows, rows older than cutoff), from pg_stat_user_tables and the planner; no scan
+    live = con.execute (text("""
+        select n_live_tup from pg_stat_user_tables where relid = to_regclass(:t)
+        """), {'t': table}).scalar()
+    plan = con.execute (text(f"""
+        explain (format json) select 1 from {table} where {timekey} < :cutoff
+        """), {'cutoff': cutoff}).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return live, int(plan[0]['Plan']['Plan Rows'])
+
 def trim_table(table, timekey, delete_older_than): 
-    df = pgsqldf(f"""
-        select '{table}' as table, 
-        count(*) as rowcount, 
-        count(case when {timekey} < current_timestamp - interval '{delete_older_than}' then 1 else null end) as old_row_count
-        from {table}
-    """)
-    print (df)
-    con.execute (text(f"""
-        delete from {table} where {timekey} < current_timestamp - interval '{delete_older_than}' 
-        """))
-    con.execute (text(f""" 
-        vacuum (analyze) {table}
-        """))
+    # returns what was removed, for spp_metrics
+    if duckdb_backend:
+        dropped = con.drop_old_days(table.split('.')[-1], delete_older_than)
+        print (f"{table}: dropped days {', '.join(dropped) or '(none)'}")
+        return {'days_dropped': len(dropped)}
+    # compact LMP tables (see spp_compact.py) are views over the table that holds the rows
+    table = spp_compact.physical(con, table)
+    # feed_publication is only created by the fetch daemon (see spp_publication.py)
+    if spp_partitions.relkind(con, table) is None:
+        print (f"{table}: no such table")
+        return {}
+    # partitioned tables (see spp_partitions.py) lose whole days at a time: no delete, no dead rows, no vacuum
+    name = table.split('.')[-1]
+    if name in spp_partitions.PARTITIONED and spp_partitions.relkind(con, table) == 'p':
+        dropped = spp_partitions.drop_old_partitions(con, name, delete_older_than)
+        print (f"{table}: dropped partitions {', '.join(dropped) or '(none)'}")
+        return {'partitions_dropped': len(dropped)}
+
+    # one cutoff for every batch, so the last batch doesn't chase rows that have just aged past it
+    cutoff = con.execute (text("select current_timestamp - cast(:i as interval)"), {'i': delete_older_than}).scalar()
+    time_index(table, timekey)
+    live, estimated = estimate_rows(table, timekey, cutoff)
+    print (f"{table}: about {estimated} of {live} rows are older than {cutoff}")
+
+    deleted = batches = 0
+    reported = time.perf_counter()
+    while True: 
+        n = con.execute (text(f"""
+            delete from {table} where ctid = any(array(
+                select ctid from {table} where {timekey} < :cutoff order by {timekey} limit :batch))
+            """), {'cutoff': cutoff, 'batch': DELETE_BATCH}).rowcount
+        deleted += n
+        batches += 1
+        if n < DELETE_BATCH: 
+            break
+        if time.perf_counter() - reported > PROGRESS_S: 
+            print (f"{table}: deleted {deleted} of about {estimated} rows in {batches} batches")
+            reported = time.perf_counter()
+        time.sleep(DELETE_PAUSE_S)
+    print (f"{table}: deleted {deleted} rows in {batches} batches")
+
+    result = {'estimated': estimated, 'deleted': deleted, 'batches': batches}
+    if deleted: 
+        start = time.perf_counter()
+        con.execute (text(f""" 
+            vacuum (analyze) {table}
+            """))
+        result['vacuum_s'] = time.perf_counter() - start
+    return result
     
 
 
 # In[9]:
 
 
-for table, timekey in ( 
-     ['sppdata.rtbm_lmp_by_location', 'gmtinterval_end'],
-     ['sppdata.tie_flows_long', 'gmttime'],
-     ['sppdata.da_lmp_by_location', 'gmtinterval_end'],
-     ['sppdata.rtbm_binding_constraints', 'gmtinterval_end'],
-     ['sppdata.area_control_error', 'gmttime'],
-     ['sppdata.generation_mix', 'gmt_mkt_interval'],
-     ['sppdata.stlf_vs_actual', 'gmtinterval_end'],
-     ['sppdata.mtlf_vs_actual', 'gmtinterval_end']):
-    trim_table(table, timekey, '2 weeks')
+# one line per run in metrics.jsonl (see spp_metrics.py), even if a table fails part way
+report = {}
+cleanup_start = time.perf_counter()
+try:
+    for table, timekey in ( 
+         ['sppdata.rtbm_lmp_by_location', 'gmtinterval_end'],
+         ['sppdata.tie_flows_long', 'gmttime'],
+         ['sppdata.da_lmp_by_location', 'gmtinterval_end'],
+         ['sppdata.rtbm_binding_constraints', 'gmtinterval_end'],
+         ['sppdata.area_control_error', 'gmttime'],
+         ['sppdata.generation_mix', 'gmt_mkt_interval'],
+         ['sppdata.stlf_vs_actual', 'gmtinterval_end'],
+         ['sppdata.mtlf_vs_actual', 'gmtinterval_end'],
+         ['sppdata.feed_publication', 'cycle_start'],
+         ['sppdata.lmp_grid', 'gmtinterval_end']):
+        name = table.split('.')[-1]
+        start = time.perf_counter()
+        try:
+            report[name] = {'status': 'trimmed', **trim_table(table, timekey, '2 weeks')}
+        except Exception as e:
+            report[name] = {'status': f"failed: {e!r}"}
+            raise
+        finally:
+            report[name]['trim_s'] = time.perf_counter() - start
+finally:
+    spp_metrics.write_run('cleanup', report, time.perf_counter() - cleanup_start)
 
 
 # In[10]:
@@ -132,13 +230,6 @@ for table, timekey in (
 print(space())
 
 
-# In[12]:
-
-
-# perform vacuum; run space again 
-con.execute (text("vacuum"))
-
-print(space())
 
 
 
@@ -35,7 +35,7 @@
 # use Pandas dataframes as structure for ETL
 import pandas as pd 
 
-from datetime import datetime
+from datetime import datetime, timezone
 import pytz
 
 
@@ -45,6 +45,9 @@ import pytz
 # 
 
 # Read database credentials from a json file. To create the json file, edit "sample_dbconn.py" and run it; all the other programs in this repo will ready dbconn.json for credentials
+# 
+# With {"backend": "duckdb", "path": "../spp_parquet"} instead, the tables are kept in local Parquet files 
+# and queried with DuckDB, with no database server; see spp_storage.py
 
 # In[2]:
 
@@ -53,8 +56,13 @@ import json
 # read the database information from the json file
 with open('../dbconn.json', 'r') as f:
     di = json.load(f)
+
+import spp_storage
+duckdb_backend = spp_storage.uses_duckdb(di)
+
 # create a connection string for postgresql
-pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"    
+if not duckdb_backend:
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"    
 
 
 # In[9]:
@@ -71,16 +79,43 @@ from sqlalchemy import create_engine
 from sqlalchemy import text
 
 # Create an engine instance
-alchemyEngine   = create_engine(f'postgresql+psycopg2:{pg_uri}', pool_recycle=3600);
+# pool_pre_ping replaces connections that have gone away, which matters in --daemon mode
+# With "load_connections": n (n > 1) in dbconn.json, run_all loads up to n feeds at the same time, each
+# on a connection of its own (see run_all); the pool holds those and the shared connection, and no more.
+# Every connection starts in the sppdata schema (a session option, so a rollback can't undo it the
+# way it undoes a SET inside a transaction, and leave tables to be created in public).
+LOAD_CONNECTIONS = 1 if duckdb_backend else int(di.get('load_connections', 1))
+if not duckdb_backend:
+    alchemyEngine   = create_engine(f'postgresql+psycopg2:{pg_uri}', pool_recycle=3600, pool_pre_ping=True,
+                                    pool_size=LOAD_CONNECTIONS + 1, max_overflow=0,
+                                    connect_args={'options': '-c search_path=sppdata'});
 
 
 # In[10]:
 
 
-# Connect to PostgreSQL server
-con    = alchemyEngine.connect();
-con.execute (text("create schema if not exists sppdata authorization current_user"))
-con.execute (text("set search_path to sppdata"))
+# Connect to PostgreSQL server (or open the Parquet store, which stands in for the connection)
+if duckdb_backend:
+    con    = spp_storage.ParquetStore(di.get('path', spp_storage.DEFAULT_PATH))
+else:
+    con    = alchemyEngine.connect();
+    con.execute (text("create schema if not exists sppdata authorization current_user"))
+    con.commit()
+
+
+def reconnect():
+    # replace the shared connection after it has failed (used by --daemon mode)
+    global con
+    if duckdb_backend:
+        return con
+    try:
+        con.close()
+    except Exception:
+        pass
+    # the lost connection's transaction went with it
+    forget_tables()
+    con = alchemyEngine.connect()
+    return con
 
 
 # In[11]:
@@ -89,8 +124,9 @@ con.execute (text("set search_path to sppdata"))
 con.autocommit=False;
 
 # define a very simple function to run a query and reutrn a dataframe
-def pgsqldf(query): 
-    return pd.read_sql(text(query), con)
+# (on the shared connection, or on the one given: the load_* functions read back on theirs)
+def pgsqldf(query, connection=None): 
+    return spp_storage.read_sql(connection or con, query)
 
 
 # ### example dataframe to table 
@@ -110,13 +146,11 @@ con.commit();  #  if using transactions, changes need to be committed.
 
 
 # define a function to transform source data column names to a more appropriate form for working with data:
+# (feeds parsed by spp_schema already have these names; spp_schema.snake caches the renames)
+import spp_schema
+
 def standardize_columns(df): 
-    df.columns = (df.columns
-                    .str.replace('^ ', '', regex=True)
-                    .str.replace('(?<=[a-z])(?=[A-Z])', '_', regex=True)
-                    .str.replace('[_ ]+', '_', regex=True)
-                    .str.lower()
-                 )    
+    df.columns = [spp_schema.snake(c) for c in df.columns]
     
     # add an inserted time to all dataframes to track when data showed up on database
     if not 'inserted_time' in df.columns.values: 
@@ -134,30 +168,13 @@ def standardize_columns(df):
 # this only needs to bne done when the settlement location file changes; currently this is a manual process. 
 # Improvements:  
 #  * move this to the workbook that creates this file
-#  * truncate and reload instead of drop and replace, since views now depend on this file
-if False: 
-   
-    df=pd.read_csv("settlement_node_location.csv")
-
-    """":# for database operations, rename all table and field names to lowercase snake_case
-    df.rename(columns={'Settlement Location':'settlement_location',
-               'InferredLocationType':'inferred_location_type',
-               'est_Latitude':'est_latitude',
-               'est_Longitude':'est_longitude'}, inplace=True)
-    """
-
-    standardize_columns(df)
-    print(df.columns)
-
-    df.to_sql("settlement_location", con=con, if_exists='replace', index=False); 
+# DONE: truncate and reload instead of drop and replace, since views now depend on this file
+#  * spp_locations.sync compares the file with the table and inserts, updates and deletes only what
+#    changed, in one transaction; from the shell: python3 spp_locations.py [--dry-run]
+import spp_locations
 
-    con.execute(text("""alter table settlement_location 
-    add constraint settlement_location_pk 
-    primary key (settlement_location)"""
-                    )
-               )
-
-    con.commit() 
+if False: 
+    spp_locations.sync(con, "settlement_node_location.csv")
   
 
 
@@ -174,31 +191,78 @@ if False:
 # In[ ]:
 
 
-# select sample data for fun
-pd.read_sql(text("SELECT * from settlement_location order by random() limit 10"), con)
+# select sample data for fun (once there is some: a new Parquet store has no tables yet)
+pgsqldf("SELECT * from settlement_location order by random() limit 10") \
+    if spp_storage.has_table(con, 'settlement_location') else None
 
 
-# ### todo: 
-#  fix bug: if first append works but primary key fails to create, nothing else will work ever.
+# ### pg_insertnew
+# Rows are streamed with COPY into a session temp table, then merged into the target with
+# INSERT ... ON CONFLICT DO NOTHING, in one transaction. 
+# 
+# The temp table is created once per session and emptied at each commit (ON COMMIT DELETE ROWS), 
+# and the table/primary key check runs only the first time a table is loaded in a session, 
+# so steady-state loads do no catalog-changing DDL. 
+# 
+# The LMP, tie flow and binding constraint tables are partitioned by day (spp_partitions.py);
+# a load first makes sure the partitions for its days exist, creating them once a day or so.
+# 
+# DONE: fixed bug: if first append works but primary key fails to create, nothing else will work ever.
+#  * the table is created empty, and the primary key added, before any rows are loaded
 
 # In[ ]:
 
 
-def pg_insertnew(table_name, primary_keys, df, con):
-    # insert df into table_name but only if those rows aren't already there
-    
-    # make sure the target table exists, but empty (by iloc[0:0])
-    try: 
-        print ("pg_insertnew: trying append", table_name, con)
-        con.commit() # maybe it needs no outstanding transactions before a DDL?  I think that was it
-        df.to_sql(table_name, con=con, if_exists='append', index=False); 
-        try_merge=False
-    except: 
-        print ("pg_insertnew append failed, rolling back")
-        con.rollback();
-        try_merge=True
+import io
+import spp_partitions
+import spp_indexes
+import spp_metrics
+
+# run_all loads all the feeds of a run as one unit of work: one transaction, committed once at the
+# end, so readers see every feed of the interval change together (and never a table between a
+# delete and the insert that replaces it). Inside it, the commits in the load path are skipped.
+unit_of_work = False
+
+def pg_commit(con):
+    # commit, unless inside run_all's unit of work, which commits once at the end
+    if not unit_of_work:
+        con.commit()
 
-        print ("pg_insertnew making sure table has PK")
+from contextlib import contextmanager
+
+@contextmanager
+def savepoint(con):
+    # if the block fails, undo only what it did, not the unit of work so far (Postgres only; the
+    # Parquet store has no transactions)
+    if spp_storage.is_store(con):
+        yield
+        return
+    nested = con.begin_nested()
+    try:
+        yield
+    except Exception:
+        nested.rollback()
+        raise
+    # (spp_partitions.migrate, on a table's very first load, commits, which ends the savepoint)
+    if nested.is_active:
+        nested.commit()
+
+# tables already known to exist, with a primary key, in this session
+pg_tables_ready = set()
+# and of those, the ones partitioned by day
+pg_tables_partitioned = set()
+
+def forget_tables():
+    # after a rollback in the unit of work: tables, partitions and location ids created since the
+    # last commit are gone with it, so check them again before the next load
+    pg_tables_ready.clear()
+    pg_tables_partitioned.clear()
+    spp_partitions.forget()
+    spp_compact.forget_ids()
+
+def pg_prepare_table(table_name, primary_keys, df, con):
+    # make sure the target table exists, but empty (by iloc[0:0])
+    df.iloc[0:0].to_sql(table_name, con=con, if_exists='append', index=False)
 
     # make sure the target table has a primary key(s)
     con.execute(text(f"""
@@ -213,38 +277,145 @@ def pg_insertnew(table_name, primary_keys, df, con):
           ADD CONSTRAINT {table_name}_pk PRIMARY KEY ({','.join(primary_keys)});
         end if;
     end $$"""))
-    
-    con.commit();
-
-    if try_merge: 
-#        print ("trying merge")
-        print (f"pg_insertnew loading {table_name}_stg")
-        # load df to a stage table
-        df.to_sql(f"{table_name}_stg", con=con, if_exists='replace', index=False); 
-        con.commit();
-
-        # Insert new rows into permanent table
-        joinstring=''
-        for k in primary_keys: 
-            if k == primary_keys[0]: 
-                joinstring += f's.{k} = g.{k}'
-            else:
-                joinstring += f' and s.{k} = g.{k}'
 
-        print (f"pg_insertnew loading {table_name}_stg to {table_name}")
-        con.execute(text(f"""
-           insert into {table_name}
-           select s.* from {table_name}_stg s
-           left join {table_name} g
-           on {joinstring}
-           where g.{primary_keys[0]} IS NULL
-        """))
+    pg_commit(con)
+
+    # the biggest tables are partitioned by day (see spp_partitions.py); a new, still empty
+    # table is converted here, and one that already holds data waits for spp_partitions.py --migrate
+    if table_name in spp_partitions.PARTITIONED and spp_partitions.relkind(con, table_name) == 'r':
+        if con.execute(text(f"select exists (select 1 from {table_name})")).scalar():
+            print (f"pg_prepare_table {table_name}: not partitioned yet; run python3 spp_partitions.py --migrate")
+        else:
+            spp_partitions.migrate(con, table_name)
+    if spp_partitions.relkind(con, table_name) == 'p':
+        pg_tables_partitioned.add(table_name)
+
+    # and the indexes its queries need besides the primary key (see spp_indexes.py)
+    spp_indexes.ensure_indexes(con, table_name, commit=not unit_of_work)
+    pg_tables_ready.add(table_name)
 
-        con.commit();
-        con.execute (text(f"""drop table {table_name}_stg"""))
-        con.commit();    
-                     
-    return True
+
+def pg_insertnew(table_name, primary_keys, df, con):
+    # insert df into table_name but only if those rows aren't already there
+    # (rows inserted and skipped, and the time taken, are added to the feed's spp_metrics)
+    with spp_metrics.timer('insert_s'):
+        if spp_storage.is_store(con):
+            result = con.insertnew(table_name, primary_keys, df)
+        else:
+            result = _pg_insertnew(table_name, primary_keys, df, con)
+    spp_metrics.add(inserted=result['inserted'], skipped=result['skipped'])
+    return result
+
+
+def pg_upsert(table_name, primary_keys, df, con, store_delete=None, keep=None):
+    # like pg_insertnew, but a row already there is updated if its values have changed (a revised
+    # forecast, an actual filled in), with UPDATE ... WHERE (values) IS DISTINCT FROM (new values);
+    # a row that hasn't changed isn't rewritten, and leaves no dead tuple behind.
+    # The keep columns (the actuals) are never emptied: a row whose keep column is filled in, where
+    # df's is null, comes from an older file (a backfill can load one after a newer one), and is
+    # left as it is, forecast and all.
+    # (rows inserted, updated and unchanged go to spp_metrics as inserted, updated and skipped)
+    # The Parquet store can't update a row in place: there, the rows matching store_delete are
+    # deleted first, and the rest is pg_insertnew, as these loads always did.
+    if spp_storage.is_store(con):
+        if store_delete:
+            spp_storage.delete(con, table_name, store_delete)
+        return pg_insertnew(table_name, primary_keys, df, con)
+    with spp_metrics.timer('insert_s'):
+        result = _pg_insertnew(table_name, primary_keys, df, con, upsert=True, keep=keep)
+    spp_metrics.add(inserted=result['inserted'], updated=result['updated'], skipped=result['skipped'])
+    return result
+
+
+def _pg_insertnew(table_name, primary_keys, df, con, upsert=False, keep=None):
+    if table_name not in pg_tables_ready: 
+        pg_prepare_table(table_name, primary_keys, df, con)
+    if table_name in pg_tables_partitioned:
+        spp_partitions.ensure_partitions(con, table_name, df[spp_partitions.PARTITIONED[table_name]],
+                                         commit=not unit_of_work)
+
+    columns = ','.join(f'"{c}"' for c in df.columns)
+
+    con.execute(text(f"""
+        create temp table if not exists {table_name}_stg 
+        (like {table_name} including defaults) on commit delete rows
+    """))
+
+    # stream the dataframe as CSV; empty fields (NaN, None) load as NULL
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    con.connection.cursor().copy_expert(
+        f"copy pg_temp.{table_name}_stg ({columns}) from stdin with (format csv)", buf)
+
+    # compared to decide if a row has changed: everything but the key and when it was loaded
+    values = [f'"{c}"' for c in df.columns if c not in primary_keys and c != 'inserted_time']
+    if upsert and values:
+        # rows whose values changed are updated, then the rows not there yet inserted
+        # (not one INSERT ... ON CONFLICT DO UPDATE: telling its inserts from its updates needs
+        # xmax, which a partitioned table can't return)
+        keys = ' and '.join(f't.{k} = s.{k}' for k in primary_keys)
+        keep = [f'"{c}"' for c in (keep or []) if c in df.columns]
+        new = {c: f'coalesce(s.{c}, t.{c})' if c in keep else f's.{c}' for c in values}
+        if 'inserted_time' in df.columns:
+            new['"inserted_time"'] = 's."inserted_time"'
+        older = ''.join(f' and not (s.{c} is null and t.{c} is not null)' for c in keep)
+        updated = con.execute(text(f"""
+           update {table_name} as t
+           set {', '.join(f'{c} = {v}' for c, v in new.items())}
+           from pg_temp.{table_name}_stg as s
+           where {keys}
+           and ({', '.join(f't.{c}' for c in values)}) is distinct from ({', '.join(new[c] for c in values)}){older}
+        """)).rowcount
+        inserted = con.execute(text(f"""
+           insert into {table_name} ({columns})
+           select {columns} from pg_temp.{table_name}_stg
+           on conflict ({','.join(primary_keys)}) do nothing
+        """)).rowcount
+    else:
+        inserted = con.execute(text(f"""
+           insert into {table_name} ({columns})
+           select {columns} from pg_temp.{table_name}_stg
+           on conflict ({','.join(primary_keys)}) do nothing
+        """)).rowcount
+        updated = 0
+
+    if unit_of_work:
+        # the staging table is only emptied at commit
+        con.execute(text(f"delete from pg_temp.{table_name}_stg"))
+    pg_commit(con)
+
+    skipped = len(df.index) - inserted - updated
+    if upsert:
+        print (f"pg_upsert {table_name}: {len(df.index)} rows, {inserted} inserted, {updated} updated, {skipped} unchanged")
+        return {'rows': len(df.index), 'inserted': inserted, 'updated': updated, 'skipped': skipped}
+    print (f"pg_insertnew {table_name}: {len(df.index)} rows, {inserted} inserted, {skipped} skipped")
+    return {'rows': len(df.index), 'inserted': inserted, 'skipped': skipped}
+
+
+def check_upsert():
+    # load an older STLF-like file after a newer one, as a backfill can, into a scratch table, in a
+    # transaction that is rolled back: the actual (and forecast) the newer file filled in must stay.
+    # Returns True if they did.
+    global unit_of_work
+    t = pd.Timestamp('2000-01-01 00:05', tz='UTC')
+    newer = pd.DataFrame({'gmtinterval_end': [t, t + pd.Timedelta(minutes=5)], 'stlf': [101.0, 102.0],
+                          'actual': [99.0, None]})
+    older = pd.DataFrame({'gmtinterval_end': [t, t + pd.Timedelta(minutes=5)], 'stlf': [100.0, 103.0],
+                          'actual': [None, 98.0]})
+    unit_of_work = True
+    try:
+        pg_upsert('upsert_check', ['gmtinterval_end'], newer, con, keep=['actual'])
+        pg_upsert('upsert_check', ['gmtinterval_end'], older, con, keep=['actual'])
+        rows = [tuple(row) for row in con.execute(text("select stlf, actual from upsert_check order by gmtinterval_end"))]
+    finally:
+        con.rollback()
+        unit_of_work = False
+        pg_tables_ready.discard('upsert_check')
+    # the first row keeps the newer file's actual and forecast; the second gets the actual it lacked
+    ok = rows == [(101.0, 99.0), (103.0, 98.0)]
+    print(f"check_upsert: {'ok' if ok else 'FAILED'}: {rows}")
+    return ok
 
 
 # # Generation Mix
@@ -258,16 +429,70 @@ def pg_insertnew(table_name, primary_keys, df, con):
 
 # try something harder: 2 hour generation mix. 
 
-def update_generation_mix(con):
-    df=pd.read_csv("https://marketplace.spp.org/file-browser-api/download/generation-mix-historical?path=%2FGenMix2Hour.csv", 
-                   parse_dates=['GMT MKT Interval'], 
-                   infer_datetime_format = True)
-   
+# downloads go through spp_fetch, which skips sources that haven't changed since they were last loaded;
+# fetch_* returns None for those. 
+# Files that never change under the same name (per-interval RTBM and STLF, hourly MTLF, daily DA) 
+# are also kept, parsed, in the local spp_cache.
+import spp_fetch
+import spp_cache
+import spp_dashboard
+import spp_compact
+import spp_grid
+
+# LMP tables found to be in the compact layout in this session
+pg_tables_compact = set()
+
+def read_feed(feed, source_url, parse, immutable=False):
+    # parse(file) the source file, or return None if it hasn't changed since it was last loaded
+    # (how, and how long each step took, goes to spp_metrics)
+    if immutable: 
+        if spp_fetch.loaded(source_url):
+            spp_metrics.note(feed, source='already loaded')
+            return None
+        with spp_metrics.timer('cache_s', feed):
+            df = spp_cache.get(source_url)
+        if df is not None:
+            spp_metrics.note(feed, source='cache')
+            return df
+
+    with spp_metrics.timer('download_s', feed):
+        fetched = spp_fetch.fetch(source_url, feed)
+    spp_metrics.add(feed, download_bytes=fetched.size)
+    spp_metrics.note(feed, source=fetched.how)
+    if fetched.unchanged:
+        return None
+
+    with spp_metrics.timer('parse_s', feed):
+        df = parse(io.BytesIO(fetched.content))
+    if immutable: 
+        spp_cache.put(source_url, df)
+    # when SPP published it (if it says) and when it was got, for spp_publication
+    df.attrs['published'] = fetched.modified
+    df.attrs['seen'] = datetime.now(timezone.utc)
+    return df
+
+# each feed is split into a fetch step (download and parse; no database access, so it is safe to run
+# on a worker thread) and a load step (database work on the shared connection).
+# update_* runs both, one after the other, as before (see update_feed, below).
+
+def fetch_generation_mix(ci=None):
+    source_url=f"{spp_fetch.MARKETPLACE_URL}/generation-mix-historical?path=%2FGenMix2Hour.csv"
+
+    df=read_feed('generation_mix', source_url, lambda f: spp_schema.parse('generation_mix', f))
+    if df is None:
+        return None
+
     standardize_columns(df)
+    df.attrs['source_url']=source_url
+    return df
 
+def load_generation_mix(con, df):
     pg_insertnew(table_name='generation_mix', primary_keys=['gmt_mkt_interval'], df=df, con=con)
-    
-    return pgsqldf("select * from generation_mix order by gmt_mkt_interval desc limit 5")
+
+    return pgsqldf("select * from generation_mix order by gmt_mkt_interval desc limit 5", con)
+
+def update_generation_mix(con):
+    return update_feed('generation_mix', con)
 
 # update_generation_mix(con)
 
@@ -275,7 +500,7 @@ def update_generation_mix(con):
 # In[ ]:
 
 
-# test query, just because I can:
+# test query, just because I can (once generation_mix has been loaded):
 
 pgsqldf("""
     select gmt_mkt_interval, 
@@ -294,18 +519,18 @@ pgsqldf("""
     from generation_mix
     order by gmt_mkt_interval desc
     limit 10
-""")
+""") if spp_storage.has_table(con, 'generation_mix') else None
 
 
 # # RTBM LMP by Settlement Location
 # 
 # Depends on:  
 # generation_mix table, for the most recent interval. 
-# Will be stored in the ci (current interval) dataframe.
+# Will be stored in the ci (current interval) SppInterval object.
 # 
 # ### TODO
 #  * determine if file names change with DST, and what the duplicate hour in November looks like
-#  * switch to grabbing that "latest interval" file
+#  * DONE (in --daemon mode, see the RTBM latest interval poller below): switch to grabbing that "latest interval" file
 #      * on FTP at pubftp.spp.org/Markets/RTBM/LMP_By_SETTLEMENT_LOC/RTBM-LMP-SL-latestInterval.csv 
 #      * on HTTPS at https://marketplace.spp.org/file-browser-api/download/rtbm-lmp-by-location?path=%2FRTBM-LMP-SL-latestInterval.csv
 #  
@@ -315,77 +540,44 @@ pgsqldf("""
 # In[ ]:
 
 
+from spp_interval import SppInterval
+
 def get_current_interval(): 
-    retdf = pgsqldf("""
-    with c as (
-        select max(gmt_mkt_interval) at time zone 'America/Chicago' as interval_cpt
-        from generation_mix
-    )
-    , intervalmunge as (
-        select interval_cpt, 
-        '1970-01-01 00:00:00'::timestamp + (interval '5 minutes' * (floor(extract(EPOCH from interval_cpt)::numeric / 300.0) + 1)) as interval_end_cpt,
-        '1970-01-01 00:00:00'::timestamp + (interval '1 hour' * (floor(extract(EPOCH from interval_cpt)::numeric / 3600.0) + 1)) as hour_end_cpt,
-        '1970-01-01 00:00:00'::timestamp + (interval '1 hour' * (floor(extract(EPOCH from (interval_cpt + interval '5 minutes'))::numeric / 3600.0) + 1)) as pathhour_end_cpt  
-        from c
-    )
-    select 
-/*     date_part('year', interval_end_cpt)::char as rt_yyyy,
-    lpad(date_part('month', interval_end_cpt)::char, 2, '0') as rt_mm,
-    lpad(date_part('day', interval_end_cpt)::char, 2, '0') as rt_dd,
-    lpad(date_part('hour', interval_end_cpt)::char, 2, '0') as rt_hh24,
-    lpad(date_part('minute', interval_end_cpt)::char, 2, '0') as rt_mi,
-*/
-    to_char(interval_end_cpt, 'YYYY') as rt_yyyy,
-    to_char(interval_end_cpt, 'MM') as rt_mm,
-    to_char(interval_end_cpt, 'DD') as rt_dd,
-    to_char(interval_end_cpt, 'HH24') as rt_hh24,
-    to_char(interval_end_cpt, 'MI') as rt_mi,
-    
-    to_char(hour_end_cpt, 'YYYY') as da_yyyy,
-    to_char(hour_end_cpt, 'MM') as da_mm,
-    to_char(hour_end_cpt, 'DD') as da_dd,
-    to_char(hour_end_cpt, 'HH24') as da_hh24,
-    to_char(pathhour_end_cpt, 'HH24') as pathda_hh24
-    
-    from intervalmunge
-    """)
-    return retdf
+    # the most recent interval in generation_mix, and the path components derived from it; 
+    # see spp_interval.py for the arithmetic (previously done here with a SQL query)
+    return SppInterval.from_db(con)
 
-get_current_interval()
+get_current_interval() if spp_storage.has_table(con, 'generation_mix') else None
 
 
 # In[ ]:
 
 
-def update_rtbm_lmp(con):
-    # Pull out of generation_mix the most recent interval, in a format needed to get other information: 
-    ci = get_current_interval()
-    
-    rt_yyyy=ci.rt_yyyy.values[0]
-    rt_mm  =ci.rt_mm.values[0]
-    rt_dd  =ci.rt_dd.values[0]
-    rt_hh24  =ci.rt_hh24.values[0]
-    rt_mi  =ci.rt_mi.values[0]
-
-    # if this interval exists already in rtbm_lmp_by_location, skip the rest
+def rtbm_lmp_loaded(ci):
+    # True if this interval exists already in rtbm_lmp_by_location
+    # (a UTC range on gmtinterval_end, which its primary key answers; see spp_indexes.py)
     try: 
-        rtbm_db_df=pgsqldf(f"""
+        with savepoint(con):
+            rtbm_db_df=pgsqldf(f"""
         select *
         from rtbm_lmp_by_location
-        where (gmtinterval_end at time zone 'America/Chicago') = '{rt_yyyy}-{rt_mm}-{rt_dd} {rt_hh24}:{rt_mi}:00'
+        where gmtinterval_end >= '{ci.interval_end.isoformat()}'
+          and gmtinterval_end <  '{(ci.interval_end + pd.Timedelta(minutes=5)).isoformat()}'
         limit 5
         """)
-
-        assert len(rtbm_db_df.index) > 0
-
-        return rtbm_db_df
-            
+        return len(rtbm_db_df.index) > 0
     except: 
-        get_rtbm=True
+        return False
 
-    print ("updating RTBM data from current interval:", get_rtbm)
 
-    fpath=f"https://marketplace.spp.org/file-browser-api/download/rtbm-lmp-by-location?" + \
+def fetch_rtbm_lmp(ci):
+    rt_yyyy=ci.rt_yyyy
+    rt_mm  =ci.rt_mm
+    rt_dd  =ci.rt_dd
+    rt_hh24  =ci.rt_hh24
+    rt_mi  =ci.rt_mi
+
+    fpath=f"{spp_fetch.MARKETPLACE_URL}/rtbm-lmp-by-location?" + \
           f"path=%2F{rt_yyyy}%2F{rt_mm}%2FBy_Interval%2F{rt_dd}%2F" + \
           f"RTBM-LMP-SL-{rt_yyyy}{rt_mm}{rt_dd}{rt_hh24}{rt_mi}.csv"
 
@@ -393,37 +585,51 @@ def update_rtbm_lmp(con):
 
     print (f"reading {fpath}")
 
-    dfnew=pd.read_csv(fpath, parse_dates=['GMTIntervalEnd'], 
-                   infer_datetime_format = True)
-
-    """
-    dfnew.rename(columns={'Interval':'interval', 'GMTIntervalEnd':'gmt_interval_end', 'Settlement Location':'settlement_location',
-                   'Pnode':'pnode', 'LMP':'lmp', 'MLC':'mlc', 'MCC':'mcc', 'MEC':'mec'}, inplace=True)
-    """ 
-#   in this source file, GMTIntervalEnd does not have a timezone.  Add it: 
-    from datetime import timezone
-    dfnew['GMTIntervalEnd'] = dfnew['GMTIntervalEnd'].dt.tz_localize(timezone.utc)
+    dfnew=read_feed('rtbm_lmp', fpath, lambda f: spp_schema.parse('rtbm_lmp', f), immutable=True)
+    if dfnew is None:
+        return None
 
+    # spp_schema has made GMTIntervalEnd UTC, dropped the redundant interval and renamed the columns
     standardize_columns(dfnew)
-    
-# interval is now redundant 
-    dfnew.drop(axis='columns', columns=['interval'], inplace=True)
 
-#    return dfnew
+    dfnew.attrs['source_url']=fpath
+    return dfnew
 
+
+def pg_insertnew_lmp(table_name, df, con):
+    # the LMP tables may be compact (see spp_compact.py): then table_name is a view, and the
+    # rows go to its _id table with settlement locations as ids (Postgres only)
+    if not spp_storage.is_store(con) and \
+            (table_name in pg_tables_compact or spp_compact.physical(con, table_name) != table_name):
+        pg_tables_compact.add(table_name)
+        return pg_insertnew(spp_compact.COMPACT[table_name], ['gmtinterval_end', 'location_id'],
+                            spp_compact.to_compact(con, df, commit=not unit_of_work), con)
+    return pg_insertnew(table_name, ['gmtinterval_end', 'settlement_location'], df, con)
+
+
+def load_rtbm_lmp(con, dfnew):
     # insert rows that don't already exist
     
-    pg_insertnew('rtbm_lmp_by_location', ['gmtinterval_end', 'settlement_location'], dfnew, con)
+    pg_insertnew_lmp('rtbm_lmp_by_location', dfnew, con)
+    # a settlement location the maps can't place (see spp_locations.py) is worth knowing about
+    spp_locations.check(con, dfnew, 'rtbm_lmp')
         
-    con.commit()    
+    pg_commit(con)    
+
+    # and the zoomed-out map's grids of its intervals (see spp_grid.py)
+    spp_grid.update(con, 'rtbm_lmp', dfnew, commit=not unit_of_work)
     
     rtbm_db_df=pgsqldf(f"""
        SELECT * 
        from rtbm_lmp_by_location 
        order by gmtinterval_end desc, random() limit 5
-    """)
+    """, con)
     return rtbm_db_df   
 
+
+def update_rtbm_lmp(con):
+    return update_feed('rtbm_lmp', con)
+
 #con.rollback()
 #update_rtbm_lmp(con)
 
@@ -437,72 +643,68 @@ def update_rtbm_lmp(con):
 # In[ ]:
 
 
-def update_da_lmp(con):
-    # Pull out of generation_mix the most recent interval, in a format needed to get other information: 
-    ci = get_current_interval()
-    
-    da_yyyy=ci.da_yyyy.values[0]
-    da_mm  =ci.da_mm.values[0]
-    da_dd  =ci.da_dd.values[0]
-    da_hh24  =ci.da_hh24.values[0]
-
-        # if this interval exists already in da_lmp_by_location, skip the rest
+def da_lmp_loaded(ci):
+    # True if this hour exists already in da_lmp_by_location
+    # (a UTC range on gmtinterval_end, which its primary key answers; see spp_indexes.py)
     try: 
-        da_db_df=pgsqldf(f"""
+        with savepoint(con):
+            da_db_df=pgsqldf(f"""
         select *
         from da_lmp_by_location
-        where (gmtinterval_end at time zone 'America/Chicago') = '{da_yyyy}-{da_mm}-{da_dd} {da_hh24}:00:00'
+        where gmtinterval_end >= '{ci.hour_end.isoformat()}'
+          and gmtinterval_end <  '{(ci.hour_end + pd.Timedelta(hours=1)).isoformat()}'
         limit 5
         """)
-
-        assert len(da_db_df.index) > 0
-
-        return da_db_df
+        return len(da_db_df.index) > 0
     except: 
-        get_da=True
+        return False
+
 
-    print ("updating DA data from current interval:", get_da)
+def fetch_da_lmp(ci):
+    da_yyyy=ci.da_yyyy
+    da_mm  =ci.da_mm
+    da_dd  =ci.da_dd
 
-    fpath=f"https://marketplace.spp.org/file-browser-api/download/da-lmp-by-location?" + \
+    fpath=f"{spp_fetch.MARKETPLACE_URL}/da-lmp-by-location?" + \
           f"path=%2F{da_yyyy}%2F{da_mm}%2FBy_Day%2FDA-LMP-SL-{da_yyyy}{da_mm}{da_dd}0100.csv"
         
     print (f"reading {fpath}")
 
-    try: 
-        # these are big; if I've already run once today it is cached
-        dfnew=pd.read_pickle(f"DA-LMP-SL-{da_yyyy}{da_mm}{da_dd}0100.pickle")
-        print (f"read local cached version DA-LMP-SL-{da_yyyy}{da_mm}{da_dd}0100.pickle")
-    except: 
-        dfnew=pd.read_csv(fpath, parse_dates=['GMTIntervalEnd'], 
-                   infer_datetime_format = True)
-        dfnew.to_pickle(f"DA-LMP-SL-{da_yyyy}{da_mm}{da_dd}0100.pickle")
-        print (f"saved local cached version DA-LMP-SL-{da_yyyy}{da_mm}{da_dd}0100.pickle")
-    """
-    dfnew.rename(columns={'Interval':'interval', 'GMTIntervalEnd':'gmt_interval_end', 'Settlement Location':'settlement_location',
-                   'Pnode':'pnode', 'LMP':'lmp', 'MLC':'mlc', 'MCC':'mcc', 'MEC':'mec'}, inplace=True)
-    """
-    
-    #   in this source file, GMTIntervalEnd does not have a timezone.  Add it: 
-    from datetime import timezone
-    dfnew['GMTIntervalEnd'] = dfnew['GMTIntervalEnd'].dt.tz_localize(timezone.utc)
+    # these are big; if I've already run once today it is cached (see spp_cache.py)
+    dfnew=read_feed('da_lmp', fpath, lambda f: spp_schema.parse('da_lmp', f), immutable=True)
+    if dfnew is None:
+        return None
 
+    # spp_schema has made GMTIntervalEnd UTC, dropped the redundant interval and renamed the columns;
+    # the file is read in blocks
     standardize_columns(dfnew)
-# interval is now redundant 
-    dfnew.drop(axis='columns', columns=['interval'], inplace=True)
 
-    
+    dfnew.attrs['source_url']=fpath
+    return dfnew
+
+
+def load_da_lmp(con, dfnew):
     # insert rows that don't already exist
-    pg_insertnew('da_lmp_by_location', ['gmtinterval_end', 'settlement_location'], dfnew, con)
+    pg_insertnew_lmp('da_lmp_by_location', dfnew, con)
+    # a settlement location the maps can't place (see spp_locations.py) is worth knowing about
+    spp_locations.check(con, dfnew, 'da_lmp')
         
-    con.commit()    
+    pg_commit(con)    
+
+    # and the zoomed-out map's grids of its intervals (see spp_grid.py)
+    spp_grid.update(con, 'da_lmp', dfnew, commit=not unit_of_work)
     
     da_db_df=pgsqldf(f"""
        SELECT * 
        from da_lmp_by_location 
        order by gmtinterval_end desc, random() limit 5
-       """)
+       """, con)
     return da_db_df   
 
+
+def update_da_lmp(con):
+    return update_feed('da_lmp', con)
+
 #con.rollback()
 #update_da_lmp(con)
 
@@ -513,27 +715,32 @@ def update_da_lmp(con):
 # In[ ]:
 
 
-def update_ace(con):
-    table_name="area_control_error"
-    source_url="ftp://pubftp.spp.org/Operational_Data/ACE/ACE.csv"
-    primary_keys=['gmttime']
-    
-    df=pd.read_csv(source_url, 
-                   parse_dates=['GMTTime'], 
-                   infer_datetime_format = True
-                  )
-    
-    print (df.columns.values)
+def fetch_ace(ci=None):
+    source_url=f"{spp_fetch.PUBFTP_URL}/Operational_Data/ACE/ACE.csv"
+
+    df=read_feed('ace', source_url, lambda f: spp_schema.parse('ace', f))
+    if df is None:
+        return None
     
-    # df.rename(columns={'GMTTime':'gmt_time', 'Value':'value'}, inplace=True)
     standardize_columns(df)  
-    print(df.columns)
     
+    df.attrs['source_url']=source_url
+    return df
+
+
+def load_ace(con, df):
+    table_name="area_control_error"
+    primary_keys=['gmttime']
+
     pg_insertnew(table_name=table_name, primary_keys=primary_keys, df=df, con=con)
     
-    con.commit()
+    pg_commit(con)
     
-    return pgsqldf(f"select * from {table_name} order by gmttime desc limit 5")
+    return pgsqldf(f"select * from {table_name} order by gmttime desc limit 5", con)
+
+
+def update_ace(con):
+    return update_feed('ace', con)
 
 #update_ace(con)
 
@@ -546,7 +753,8 @@ def update_ace(con):
 # 
 # DONE - maybe delete rows with NULLs in Actual column before inserting new values?  If done in one transaction 
 #     * already done in Tie Flows; just do that
-# - need to remove commits from the pg_insertnew to keep client from seeing missing data between delete and insert
+# DONE - need to remove commits from the pg_insertnew to keep client from seeing missing data between delete and insert
+#     * run_all loads every feed in one transaction (see pg_commit)
 # 
 # - at 23:30, tried to read
 # https://marketplace.spp.org/file-browser-api/download/stlf-vs-actual?path=/2023/03/01/23/OP-STLF-202303012330.csv
@@ -563,62 +771,48 @@ def update_ace(con):
 # In[ ]:
 
 
-def update_stlf(con):
-    
-    # Pull out of generation_mix the most recent interval, in a format needed to get other information: 
-    ci = get_current_interval()
-    
-    rt_yyyy=ci.rt_yyyy.values[0]
-    da_yyyy=ci.da_yyyy.values[0]
-    rt_mm  =ci.rt_mm.values[0]
-    da_mm  =ci.da_mm.values[0]
-    rt_dd  =ci.rt_dd.values[0]
-    da_dd  =ci.da_dd.values[0]
-    rt_hh24  =ci.rt_hh24.values[0]
-    da_hh24  =ci.da_hh24.values[0]
-    pathda_hh24  =ci.pathda_hh24.values[0]
-    rt_mi  =ci.rt_mi.values[0]
+def fetch_stlf(ci):
+    rt_yyyy=ci.rt_yyyy
+    rt_mm  =ci.rt_mm
+    rt_dd  =ci.rt_dd
+    rt_hh24  =ci.rt_hh24
+    pathda_hh24  =ci.pathda_hh24
+    rt_mi  =ci.rt_mi
     
-    table_name="stlf_vs_actual"
-    
-    source_url=f"https://marketplace.spp.org/file-browser-api/download/stlf-vs-actual?" + \
+    source_url=f"{spp_fetch.MARKETPLACE_URL}/stlf-vs-actual?" + \
                f"path=%2F{rt_yyyy}%2F{rt_mm}%2F{rt_dd}%2F{pathda_hh24}%2FOP-STLF-{rt_yyyy}{rt_mm}{rt_dd}{rt_hh24}{rt_mi}.csv"
-    primary_keys=['gmtinterval_end']
     
     print ("reading", source_url)
-    
-    df=pd.read_csv(source_url, 
-                   parse_dates=['GMTInterval'], 
-                   infer_datetime_format = True
-                  )
 
-    # fix this one error - end was left off of this table's timestamp
-    df.rename(columns={'GMTInterval':'GMTIntervalEnd'}, inplace=True)
+    df=read_feed('stlf', source_url, lambda f: spp_schema.parse('stlf', f), immutable=True)
+    if df is None:
+        return None
 
-    print (df.columns.values)
+    # spp_schema renames GMTInterval to gmtinterval_end (end was left off of this table's timestamp),
+    # makes it UTC and drops the redundant interval
     print (df)
         
-#   in this source file, GMTIntervalEnd does not have a timezone.  Add it: 
-    from datetime import timezone
-    df['GMTIntervalEnd'] = df['GMTIntervalEnd'].dt.tz_localize(timezone.utc)
-        
     standardize_columns(df)  
-# interval is now redundant 
-    df.drop(axis='columns', columns=['interval'], inplace=True)
 
-    con.commit();
-    
-    try:
-        con.execute(text("""delete from stlf_vs_actual where actual is null""")); 
-        con.commit(); 
-    except: 
-        con.rollback();
+    df.attrs['source_url']=source_url
+    return df
 
-    pg_insertnew(table_name=table_name, primary_keys=primary_keys, df=df, con=con)
+
+def load_stlf(con, df):
+    table_name="stlf_vs_actual"
+    primary_keys=['gmtinterval_end']
+
+    # forecasts are revised, and actuals filled in, in place: only rows that changed are rewritten
+    pg_upsert(table_name=table_name, primary_keys=primary_keys, df=df, con=con, store_delete='actual is null',
+              keep=['actual'])
     
-    con.commit()
+    pg_commit(con)
         
-    return pgsqldf(f"select * from {table_name} order by gmtinterval_end desc limit 5")
+    return pgsqldf(f"select * from {table_name} order by gmtinterval_end desc limit 5", con)
+
+
+def update_stlf(con):
+    return update_feed('stlf', con)
 
 
 #update_stlf(con)
@@ -629,39 +823,26 @@ def update_stlf(con):
 #     
 # ## Todo:  
 # DONE same thing as STLF re null values
-# - this is kind of big and doesn't update but once an hour; maybe cache the file?
+# DONE this is kind of big and doesn't update but once an hour; it is cached by spp_cache, and skipped once loaded
 #     
 
 # In[ ]:
 
 
-def update_mtlf(con):
-    
-    # Pull out of generation_mix the most recent interval, in a format needed to get other information: 
-    ci = get_current_interval()
-    
-    rt_yyyy=ci.rt_yyyy.values[0]
-    da_yyyy=ci.da_yyyy.values[0]
-    rt_mm  =ci.rt_mm.values[0]
-    da_mm  =ci.da_mm.values[0]
-    rt_dd  =ci.rt_dd.values[0]
-    da_dd  =ci.da_dd.values[0]
-    rt_hh24  =ci.rt_hh24.values[0]
-    da_hh24  =ci.da_hh24.values[0]
-    rt_mi  =ci.rt_mi.values[0]
-    
-    table_name="mtlf_vs_actual"
-    source_url=f"https://marketplace.spp.org/file-browser-api/download/mtlf-vs-actual?" + \
-               f"path=%2F{rt_yyyy}%2F{rt_mm}%2F{rt_dd}%2FOP-MTLF-{rt_yyyy}{rt_mm}{rt_dd}{rt_hh24}00.csv"
-    primary_keys=['gmtinterval_end']
-    
-    
-    # if this interval exists already in the database, don't do this update
+def mtlf_loaded(ci):
+    # True if this hour exists already in the database with its actual
+    da_yyyy=ci.da_yyyy
+    da_mm  =ci.da_mm
+    da_dd  =ci.da_dd
+    da_hh24  =ci.da_hh24
+
     try: 
-        test_df=pgsqldf(f"""
+        with savepoint(con):
+            test_df=pgsqldf(f"""
         select *
         from mtlf_vs_actual
-        where gmtinterval_end = '{da_yyyy}-{da_mm}-{da_dd} {da_hh24}:00:00'
+        where gmtinterval_end >= '{ci.hour_end.isoformat()}'
+          and gmtinterval_end <  '{(ci.hour_end + pd.Timedelta(hours=1)).isoformat()}'
         and averaged_actual is NOT NULL
         limit 5
         """)
@@ -669,47 +850,50 @@ def update_mtlf(con):
         assert len(test_df.index) > 0
 
         print (f"update_mltf: found '{da_yyyy}-{da_mm}-{da_dd} {da_hh24}:00:00' already in database")
-        return test_df
+        return True
             
     except: 
         print (f"update_mltf: gmtinterval_end '{da_yyyy}-{da_mm}-{da_dd} {da_hh24}:00:00' not yet in database")
-        get_rtbm=True
+        return False
+
+
+def fetch_mtlf(ci):
+    rt_yyyy=ci.rt_yyyy
+    rt_mm  =ci.rt_mm
+    rt_dd  =ci.rt_dd
+    rt_hh24  =ci.rt_hh24
     
+    source_url=f"{spp_fetch.MARKETPLACE_URL}/mtlf-vs-actual?" + \
+               f"path=%2F{rt_yyyy}%2F{rt_mm}%2F{rt_dd}%2FOP-MTLF-{rt_yyyy}{rt_mm}{rt_dd}{rt_hh24}00.csv"
     
     print ("reading", source_url)
     
-    # this file is not huge but consider caching it locally instead of reading from remote 12 times an hour
-    # or, better, test the database to see if we need to update it.
-    
-    df=pd.read_csv(source_url, 
-                   parse_dates=['GMTIntervalEnd'], 
-                   infer_datetime_format = True
-                  )
+    # this file is not huge, and only changes once an hour; it is cached, and skipped once loaded
+    df=read_feed('mtlf', source_url, lambda f: spp_schema.parse('mtlf', f), immutable=True)
+    if df is None:
+        return None
         
-    # df.rename(columns={'Interval':'interval', 'GMTIntervalEnd':'gmt_interval_end', 'MTLF':'mtlf', 'Averaged Actual':'averaged_actual'}, inplace=True)
-    
-    #   in this source file, GMTIntervalEnd does not have a timezone.  Add it: 
-    from datetime import timezone
-    df['GMTIntervalEnd'] = df['GMTIntervalEnd'].dt.tz_localize(timezone.utc)
-    
     standardize_columns(df)  
 
-    # interval is now redundant 
-    df.drop(axis='columns', columns=['interval'], inplace=True)
+    df.attrs['source_url']=source_url
+    return df
 
-    
-    try:
-        con.execute(text("""delete from mtlf_vs_actual where averaged_actual is null""")); 
-        con.commit(); 
-    except: 
-        con.rollback();
-        
 
-    pg_insertnew(table_name=table_name, primary_keys=primary_keys, df=df, con=con)
+def load_mtlf(con, df):
+    table_name="mtlf_vs_actual"
+    primary_keys=['gmtinterval_end']
     
-    con.commit()
+    # forecasts are revised, and actuals filled in, in place: only rows that changed are rewritten
+    pg_upsert(table_name=table_name, primary_keys=primary_keys, df=df, con=con, store_delete='averaged_actual is null',
+              keep=['averaged_actual'])
+    
+    pg_commit(con)
         
-    return pgsqldf(f"select * from {table_name} where averaged_actual is not null order by gmtinterval_end desc limit 5")
+    return pgsqldf(f"select * from {table_name} where averaged_actual is not null order by gmtinterval_end desc limit 5", con)
+
+
+def update_mtlf(con):
+    return update_feed('mtlf', con)
 
 #update_mtlf(con)
 
@@ -728,39 +912,44 @@ def update_mtlf(con):
 # In[ ]:
 
 
-def update_tie_flows_long(con):
-    table_name="tie_flows_long"
-    source_url="ftp://pubftp.spp.org/Operational_Data/TIE_FLOW/TieFlows.csv"
-    primary_keys=['gmttime', 'area']
-    
-    df=pd.read_csv(source_url, 
-                   parse_dates=['GMTTime'], 
-                   infer_datetime_format = True
-                  )
+def fetch_tie_flows_long(ci=None):
+    source_url=f"{spp_fetch.PUBFTP_URL}/Operational_Data/TIE_FLOW/TieFlows.csv"
+
+    df=read_feed('tie_flows_long', source_url, lambda f: spp_schema.parse('tie_flows_long', f))
+    if df is None:
+        return None
     
-    df = pd.melt(df, id_vars=['GMTTime'], ignore_index=True).dropna()
+    # one column per area; the area names are kept as they are, not snake_cased
+    # (melt drops attrs: when the file was published, for spp_publication)
+    attrs = df.attrs
+    df = pd.melt(df, id_vars=['gmttime'], ignore_index=True).dropna()
+    df.attrs.update(attrs)
     
-    df.rename(columns={'GMTTime':'gmttime', 'variable':'area', 'value':'mw'}, inplace=True)
+    df.rename(columns={'variable':'area', 'value':'mw'}, inplace=True)
     
     standardize_columns(df)  # also adds inserted_time
+
+    df.attrs['source_url']=source_url
+    return df
+
+
+def load_tie_flows_long(con, df):
+    table_name="tie_flows_long"
+    primary_keys=['gmttime', 'area']
     
-    # remove future values that will be replaced
-    #try:
-    con.execute(text(f"""
-      delete from "{table_name}" where area = 'SPP NSI Future'
-      and gmttime > current_timestamp
-      """))
-    con.commit() 
-    #except: 
-    #    con.rollback()
-    
-    pg_insertnew(table_name=table_name, primary_keys=primary_keys, df=df, con=con)
+    # future values are replaced in place: only rows that changed are rewritten
+    pg_upsert(table_name=table_name, primary_keys=primary_keys, df=df, con=con,
+              store_delete="area = 'SPP NSI Future' and gmttime > current_timestamp")
     
-    con.commit()
+    pg_commit(con)
     
     return pgsqldf(f"""select * from {table_name} 
     where gmttime between current_timestamp - interval '2 minutes' and current_timestamp + interval '2 minutes'
-    order by random() limit 5""")
+    order by random() limit 5""", con)
+
+
+def update_tie_flows_long(con):
+    return update_feed('tie_flows_long', con)
 
 
 #df = update_tie_flows_long(con)
@@ -778,95 +967,532 @@ def update_tie_flows_long(con):
 # In[ ]:
 
 
-def update_rt_binding(con):
-    table_name="rtbm_binding_constraints"
-    source_url="https://marketplace.spp.org/file-browser-api/download/rtbm-binding-constraints?path=%2FRTBM-BC-latestInterval.csv"
-    primary_keys=['gmtinterval_end', 'constraint_name']
-    
-    df=pd.read_csv(source_url, 
-                   parse_dates=['GMTIntervalEnd'], 
-                   infer_datetime_format = True
-                  )
-    
-    #print (df[['GMTIntervalEnd','Constraint Name','Constraint Type','NERCID','Monitored Facility']])
-
-    #   in this source file, GMTIntervalEnd does not have a timezone.  Add it: 
-    from datetime import timezone
-    df['GMTIntervalEnd'] = df['GMTIntervalEnd'].dt.tz_localize(timezone.utc)
+def fetch_rt_binding(ci=None):
+    source_url=f"{spp_fetch.MARKETPLACE_URL}/rtbm-binding-constraints?path=%2FRTBM-BC-latestInterval.csv"
 
+    df=read_feed('rt_binding', source_url, lambda f: spp_schema.parse('rt_binding', f))
+    if df is None:
+        return None
+    
     # RT binding constraints file has dupes; fix it here
     df.drop_duplicates(subset=None, keep='first', inplace=True, ignore_index=False)
     
-    """ df.rename(columns={'Interval':'interval', 'GMTIntervalEnd':'gmt_interval_end', 
-                       'Constraint Name':'constraint_name', 'Constraint Type':'constraint_type',
-                       'NERCID':'nercid', 'TLR Level':'tlr_level', 'State':'state', 'Shadow Price':'shadow_price',
-                       'Monitored Facility':'monitored_facility', 'Contingent Facility':'contingent_facility'}, inplace=True)
-    """
     standardize_columns(df)
-    
-    # interval is now redundant 
-    df.drop(axis='columns', columns=['interval'], inplace=True)
+
+    df.attrs['source_url']=source_url
+    return df
+
+
+def load_rt_binding(con, df):
+    table_name="rtbm_binding_constraints"
+    primary_keys=['gmtinterval_end', 'constraint_name']
 
 #    con.execute(text("""delete from rtbm_binding_constraints where "SPP NSI" is null""")); 
 #    con.commit(); 
       
     pg_insertnew(table_name=table_name, primary_keys=primary_keys, df=df, con=con)
     
-    con.commit()
+    pg_commit(con)
     
-    return pgsqldf(f"""select * from {table_name} order by gmtinterval_end desc limit 5""")
+    return pgsqldf(f"""select * from {table_name} order by gmtinterval_end desc limit 5""", con)
+
+
+def update_rt_binding(con):
+    return update_feed('rt_binding', con)
 
 #update_rt_binding(con)
 
 
-# # DONE.  
-# ### Below here is just calling it again to make sure that works.
+# # Fetch all feeds concurrently
+# Each update_* used to run one after another, so a run took the sum of eight download latencies. 
+# Now generation_mix goes first, since it sets the current interval for the path-based feeds; 
+# the remaining downloads run on a thread pool, and the loads run on the main thread afterwards 
+# because they all share the one database connection. 
+# With "load_connections" in dbconn.json, the loads after generation_mix also run side by side, on 
+# that many pooled connections; feeds that write the same tables (LOAD_TOGETHER) still go one after 
+# the other, on one connection. 
 # 
+# ### Incremental loads
+# GenMix2Hour.csv, ACE.csv and TieFlows.csv are 2-hour rolling files, so almost every row in them is 
+# already in the database. The newest time key in each of those tables (the high-watermark) is read 
+# once per run, in one query, and only rows newer than it are passed to the loader. 
+#  * rows that SPP revises are always loaded: the 'SPP NSI Future' tie flow rows are replaced every run, 
+#    and they are left out of the tie_flows_long watermark since they are ahead of the present
+#  * STLF and MTLF rewrite their actuals, so they have no watermark and load the whole file
+#  * if the watermark query fails (a table doesn't exist yet, for one), every row is loaded
 
 # In[ ]:
 
 
-if True: 
-    update_generation_mix(con)
-    update_ace(con)
-    update_rtbm_lmp(con)
-    update_da_lmp(con)
-    update_stlf(con)
-    update_mtlf(con)
-    update_tie_flows_long(con)
-    update_rt_binding(con)
-    con.commit()
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# feed name -> (needs the current interval, check if already loaded or None, fetch function, load function)
+# in load order; generation_mix must be first since it sets the current interval
+FEEDS = {
+    'generation_mix':    (False, None,            fetch_generation_mix, load_generation_mix),
+    'ace':               (False, None,            fetch_ace,            load_ace),
+    'rtbm_lmp':          (True,  rtbm_lmp_loaded, fetch_rtbm_lmp,       load_rtbm_lmp),
+    'da_lmp':            (True,  da_lmp_loaded,   fetch_da_lmp,         load_da_lmp),
+    'stlf':              (True,  None,            fetch_stlf,           load_stlf),
+    'mtlf':              (True,  mtlf_loaded,     fetch_mtlf,           load_mtlf),
+    'tie_flows_long':    (False, None,            fetch_tie_flows_long, load_tie_flows_long),
+    'rt_binding':        (False, None,            fetch_rt_binding,     load_rt_binding),
+}
+
+
+# feed name -> (table, time key, (column, value) of rows that are revised and always loaded, or None)
+WATERMARKS = {
+    'generation_mix':    ('generation_mix',     'gmt_mkt_interval', None),
+    'ace':               ('area_control_error', 'gmttime',          None),
+    'tie_flows_long':    ('tie_flows_long',     'gmttime',          ('area', 'SPP NSI Future')),
+}
+
+
+def get_watermarks(con, feeds=WATERMARKS.keys()):
+    # newest time key in the database for each feed, in one query
+    if not any(name in feeds for name in WATERMARKS):
+        return {}
+    query = ' union all '.join(
+        f"""select '{name}' as feed, max({key}) 
+        {f"filter (where {revised[0]} is distinct from '{revised[1]}')" if revised else ''} as watermark
+        from {table}"""
+        for name, (table, key, revised) in WATERMARKS.items() if name in feeds)
+    try:
+        df = pgsqldf(query)
+    except Exception as e:
+        con.rollback()
+        print(f"get_watermarks failed, loading all rows: {e!r}")
+        return {}
+    return {name: wm for name, wm in zip(df.feed, df.watermark) if not pd.isnull(wm)}
+
+
+def new_rows(name, df, watermarks):
+    # rows of df newer than the feed's watermark, plus any rows that get revised
+    if name not in watermarks:
+        return df
+    table, key, revised = WATERMARKS[name]
+    keep = df[key] > watermarks[name]
+    if revised:
+        keep |= df[revised[0]] == revised[1]
+    print(f"{name}: {keep.sum()} of {len(df.index)} rows are newer than {watermarks[name]}")
+    return df[keep]
+
+
+def timed(f, *args):
+    # run f, returning (result, elapsed seconds)
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def update_feed(name, con, ci=None):
+    # fetch and load one feed on its own
+    needs_ci, skip, fetch, load = FEEDS[name]
+    if needs_ci:
+        ci = ci or get_current_interval()
+        if skip is not None and skip(ci):
+            print(f"{name}: already loaded for {ci}")
+            return None
+    df = fetch(ci) if needs_ci else fetch()
+    if df is None:
+        print(f"{name}: source unchanged since it was last loaded")
+        return None
+    if name in WATERMARKS:
+        df = new_rows(name, df, get_watermarks(con, [name]))
+    result = load(con, df) if len(df.index) > 0 else None
+    spp_fetch.mark_loaded(df.attrs.get('source_url'))
+    spp_fetch.save_state()
+    return result
+
+
+# feeds that write the same tables besides their own, so they never load on two connections at once:
+# lmp_location (spp_compact.py) and the DA map (spp_dashboard.py)
+LOAD_TOGETHER = [['rtbm_lmp', 'da_lmp']]
+
+
+def load_lanes(names):
+    # names split into lanes of feeds that load one after another, in feed order
+    lanes = [[name for name in group if name in names] for group in LOAD_TOGETHER]
+    together = {name for lane in lanes for name in lane}
+    lanes += [[name] for name in names if name not in together]
+    return sorted([lane for lane in lanes if lane], key=lambda lane: list(FEEDS).index(lane[0]))
+
+
+def run_all(con, feeds=None, max_workers=8, load_connections=None):
+    # fetch and load feeds (default all of them); returns {feed: report row}
+    # The loads are one unit of work: each feed in a savepoint (a feed that fails is undone on its
+    # own, and the rest still load), and one commit at the end. Files are only marked as loaded
+    # (spp_fetch) once that commit has succeeded.
+    # With load_connections > 1 (default LOAD_CONNECTIONS), the feeds after generation_mix load at
+    # the same time, each lane (load_lanes) on a pooled connection of its own as soon as its
+    # download is in, and each lane commits on its own: one transaction per connection.
+    global unit_of_work
+    load_connections = load_connections or LOAD_CONNECTIONS
+    feeds = [name for name in FEEDS if feeds is None or name in feeds]
+    run_start = time.perf_counter()
+    report = {}
+    loaded_urls = []
+    transactions = 1
+    spp_metrics.reset()
+    watermarks = get_watermarks(con, feeds)
+    unit_of_work = True
+
+    def load_feed(name, future, con=con, urls=loaded_urls):
+        # wait for a download, then load it; record timings, and keep going if one feed fails
+        load = FEEDS[name][3]
+        row = report[name] = {'status': 'loaded'}
+        try:
+            df, row['fetch_s'] = future.result()
+            if df is None:
+                row['status'] = 'unchanged'
+                return
+            row['rows'] = len(df.index)
+            row['published'], row['seen'] = df.attrs.get('published'), df.attrs.get('seen')
+            df = new_rows(name, df, watermarks)
+            row['new_rows'] = len(df.index)
+            if len(df.index) > 0:
+                with spp_metrics.feed(name), savepoint(con):
+                    _, row['load_s'] = timed(load, con, df)
+                    # rebuild the dashboard tables that show this feed, and notify the API (see spp_dashboard.py)
+                    _, row['refresh_s'] = timed(spp_dashboard.refresh, con, name, False)
+            else:
+                row['status'] = 'no new rows'
+            urls.append(df.attrs.get('source_url'))
+        except Exception as e:
+            if spp_fetch.not_found(e):
+                # a file that is named by its interval, and isn't there yet (or at all)
+                row['status'] = 'not published'
+                return
+            # the savepoint has undone this feed, with any table, partition or lmp_location id it added
+            forget_tables()
+            row['status'] = f"failed: {e!r}"
+            traceback.print_exc()
+        finally:
+            # download, parse and insert detail (see spp_metrics.py)
+            row.update(spp_metrics.get(name))
+
+    def load_lane(lane, futures):
+        # the feeds of one lane on a pooled connection, in one transaction
+        urls = []
+        with alchemyEngine.connect() as lane_con:
+            for name in lane:
+                load_feed(name, futures[name], lane_con, urls)
+            try:
+                lane_con.commit()
+            except Exception as e:
+                lane_con.rollback()
+                forget_tables()
+                for name in lane:
+                    report[name]['status'] = f"failed: {e!r}"
+                traceback.print_exc()
+                return
+        loaded_urls.extend(urls)
 
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # feeds that don't need the current interval can start downloading right away
+            futures = {name: pool.submit(timed, fetch)
+                       for name, (needs_ci, skip, fetch, load) in FEEDS.items() if name in feeds and not needs_ci}
+
+            # generation_mix sets the current interval, so load it before starting the path-based feeds
+            if 'generation_mix' in futures:
+                load_feed('generation_mix', futures['generation_mix'])
+            ci = get_current_interval()
+
+            for name, (needs_ci, skip, fetch, load) in FEEDS.items():
+                if name not in feeds or not needs_ci:
+                    continue
+                if skip is not None and skip(ci):
+                    report[name] = {'status': 'already loaded', **spp_metrics.get(name)}
+                    continue
+                futures[name] = pool.submit(timed, fetch, ci)
+
+            names = [name for name in FEEDS if name in futures and name != 'generation_mix']
+            if load_connections > 1 and not spp_storage.is_store(con):
+                # lanes load side by side; generation_mix stays in the shared connection's transaction
+                lanes = load_lanes(names)
+                with ThreadPoolExecutor(max_workers=min(load_connections, len(lanes) or 1)) as loaders:
+                    for done in [loaders.submit(load_lane, lane, futures) for lane in lanes]:
+                        done.result()
+                transactions += len(lanes)
+            else:
+                # loads share the one connection, so they run here one at a time, in feed order
+                for name in names:
+                    load_feed(name, futures[name])
+
+        # the run's one commit (the shared connection's, with parallel loads)
+        _, commit_s = timed(con.commit)
+    except Exception:
+        con.rollback()
+        forget_tables()
+        raise
+    finally:
+        unit_of_work = False
+    if not spp_storage.is_store(con):
+        print(f"run_all: committed {sum(1 for row in report.values() if row['status'] == 'loaded')} feeds "
+              f"in {'one transaction' if transactions == 1 else f'{transactions} transactions'} ({commit_s:.3f}s)")
+    for url in loaded_urls:
+        spp_fetch.mark_loaded(url)
+    spp_fetch.save_state()
+    spp_fetch.log_counters()
+
+    print(pd.DataFrame.from_dict(report, orient='index').reindex(feeds).to_string())
+    total = time.perf_counter() - run_start
+    print(f"run_all: {total:.1f} seconds total")
+    # one JSON line per run, and the Prometheus file if configured; flags a run over the 5 minutes
+    spp_metrics.write_run('fetch', report, total, budget_s=spp_metrics.BUDGET_S)
+    return report
+
+
+# # RTBM latest interval poller
+# 
+# update_rtbm_lmp gets the interval's file by name, from generation_mix's latest interval, at a fixed 
+# time (3 minutes 17 seconds past, under cron and in the daemon), so the LMP map could be a whole 
+# interval behind. In --daemon mode RTBM is polled for instead: RTBM-LMP-SL-latestInterval.csv is 
+# asked for every POLL_EVERY with a conditional GET (see spp_fetch.py; an unchanged file is a 304), 
+# from POLL_START after each interval ends (or, once spp_publication has learned it, just after the 
+# earliest that RTBM has been published) until that interval is in the table, or POLL_END. Each new 
+# interval the file shows is loaded, and the dashboard refreshed, as soon as it is seen. 
+# 
+# The daemon's jobs run one at a time on one connection, so a poller still waiting for a late interval 
+# would hold up the 5-minute feeds (at 3 minutes 17 seconds past) and the learned retries until POLL_END. 
+# Instead it stops polling when the scheduler's next job is due, and carries on, for the rest of its 
+# window, once that job has run (status "yielded"). It doesn't get a thread and a connection of its own: 
+# the loaders, the dashboard refresh and spp_metrics all assume one job at a time. 
+# 
+# Each interval loaded adds a line to metrics.jsonl (job rtbm_latest; see spp_metrics.py), with: 
+#  * publish_lag_s: from the end of the interval to when SPP published the file (its Last-Modified) 
+#  * detect_s: from then to the poll that saw it 
+#  * latency_s: from then to the commit, when the dashboard shows it 
+#  * interval_to_db_s: from the end of the interval to the commit 
+#  * polls: requests for the file until it was seen, and the usual download, parse and insert detail 
+# and a window that ends without the interval is a line with status "not published". 
 
 # In[ ]:
 
 
-from time import sleep
-while False:
-    sleep(300)
-    try: 
-        update_generation_mix(con)
-        update_ace(con)
-        update_rtbm_lmp(con)
-        update_da_lmp(con)
-        update_stlf(con)
-        update_mtlf(con)
-        update_tie_flows(con)
-        update_rt_binding(con)
-        con.commit()    
-    except: 
-        con.rollback()
-        
+from datetime import timedelta
+import spp_publication
 
+RTBM_LATEST_URL = f"{spp_fetch.MARKETPLACE_URL}/rtbm-lmp-by-location?path=%2FRTBM-LMP-SL-latestInterval.csv"
+POLL_START = timedelta(minutes=1)
+POLL_END = timedelta(minutes=4, seconds=30)
+POLL_EVERY = timedelta(seconds=5)
 
-# In[ ]:
 
+def rtbm_poll_window(now, start=POLL_START):
+    # (end of the interval to wait for, when to stop waiting for it): the one whose window now is in,
+    # or, between windows, the next one
+    interval_end = pd.Timestamp(now - start).floor('5min')
+    end = max(POLL_END, start + POLL_EVERY)
+    if now > interval_end + end:
+        interval_end += timedelta(minutes=5)
+    return interval_end, interval_end + end
 
-con.commit()
 
+def rtbm_latest_loaded():
+    # the latest interval in rtbm_lmp_by_location, or None
+    try:
+        with savepoint(con):
+            latest = pgsqldf("select max(gmtinterval_end) as latest from rtbm_lmp_by_location").latest.iloc[0]
+    except Exception:
+        return None     # no table yet
+    return None if pd.isnull(latest) else pd.Timestamp(latest)
+
+
+def load_rtbm_latest(df, fetched, seen, polls, start):
+    # load an interval the poller has just seen, and record how long it took to get here
+    interval_end = df.gmtinterval_end.max()
+    row = {'status': 'loaded', 'interval_end': interval_end.isoformat(), 'polls': polls}
+    with spp_metrics.feed('rtbm_lmp'):
+        _, row['load_s'] = timed(load_rtbm_lmp, con, df)
+        _, row['refresh_s'] = timed(spp_dashboard.refresh, con, 'rtbm_lmp')
+        con.commit()
+    committed = datetime.now(timezone.utc)
+    spp_fetch.mark_loaded(RTBM_LATEST_URL)
+    spp_fetch.save_state()
+    spp_publication.record(con, 'rtbm_lmp', interval_end, fetched.modified, seen)
+
+    published = fetched.modified
+    if published is not None:
+        row['publish_lag_s'] = (published - interval_end).total_seconds()
+        row['detect_s'] = (seen - published).total_seconds()
+        row['latency_s'] = (committed - published).total_seconds()
+    row['interval_to_db_s'] = (committed - interval_end).total_seconds()
+    row.update(spp_metrics.get('rtbm_lmp'))
+    print(f"rtbm_lmp latest: {interval_end} loaded after {polls} polls, "
+          + (f"{row['latency_s']:.1f}s after it was published" if published is not None else
+             f"{row['interval_to_db_s']:.1f}s after the interval ended"))
+    spp_metrics.write_run('rtbm_latest', {'rtbm_lmp': row}, time.perf_counter() - start)
+    return row
+
+
+def poll_rtbm_lmp(wait=None, start=POLL_START, next_job=None):
+    # one poller run: wait for the interval that has just ended, loading each new interval seen on
+    # the way; wait(seconds) sleeps between polls, and returns True to stop early, and next_job() is
+    # the scheduler's next job, which polling stops for (status 'yielded'). Returns the last row
+    wait = wait or time.sleep
+    interval_end, deadline = rtbm_poll_window(datetime.now(timezone.utc), start)
+    latest = rtbm_latest_loaded()
+    row = {'status': 'already loaded', 'interval_end': interval_end.isoformat()}
+    polls = 0
+    while latest is None or latest < interval_end:
+        polls += 1
+        start = time.perf_counter()
+        spp_metrics.reset()
+        with spp_metrics.timer('download_s', 'rtbm_lmp'):
+            fetched = spp_fetch.fetch(RTBM_LATEST_URL, 'rtbm_lmp', quiet=True)
+        seen = datetime.now(timezone.utc)
+        if not fetched.unchanged:
+            spp_metrics.add('rtbm_lmp', download_bytes=fetched.size)
+            with spp_metrics.timer('parse_s', 'rtbm_lmp'):
+                df = spp_schema.parse('rtbm_lmp', io.BytesIO(fetched.content))
+            standardize_columns(df)
+            if latest is None or df.gmtinterval_end.max() > latest:
+                row = load_rtbm_latest(df, fetched, seen, polls, start)
+                latest, polls = df.gmtinterval_end.max(), 0
+                continue
+            # an interval that is already loaded: a 304 from now on
+            spp_fetch.mark_loaded(RTBM_LATEST_URL)
+        if datetime.now(timezone.utc) + POLL_EVERY > deadline:
+            row = {'status': 'not published', 'interval_end': interval_end.isoformat(), 'polls': polls}
+            print(f"rtbm_lmp latest: {interval_end} not published after {polls} polls")
+            spp_metrics.write_run('rtbm_latest', {'rtbm_lmp': row}, time.perf_counter() - start)
+            break
+        other = next_job() if next_job is not None else None
+        if other is not None and datetime.now(timezone.utc) + POLL_EVERY > other.next_run:
+            row = {'status': 'yielded', 'interval_end': interval_end.isoformat(), 'polls': polls,
+                   'to': other.name, 'until': other.next_run}
+            break
+        if wait(POLL_EVERY.total_seconds()):
+            row = {'status': 'stopped', 'interval_end': interval_end.isoformat(), 'polls': polls}
+            break
+    spp_fetch.save_state()
+    return row
+
+
+# # Run
+# By default, fetch and load everything once and exit; this is what cron runs every 5 minutes. 
+# 
+# With --daemon, keep running, with a warm connection and caches, and fetch each feed on its own 
+# publication cadence: 
+#  * the 5-minute feeds at 3 minutes 17 seconds past each 5 minutes (the old cron schedule)
+#  * RTBM by the latest interval poller, from POLL_START after each 5 minutes until it is published 
+#    (making way for the other jobs when they are due, see above)
+#  * MTLF hourly, DA once a day (and retried with backoff until the day's file shows up)
+# Those are the times until spp_publication.py has seen enough files of a job's feeds published; from 
+# then on each job runs just after its feeds are usually published, and again, a few times, if they 
+# weren't yet (a 404, or a rolling file that hasn't changed since the last cadence). 
+# 
+# Stop it with SIGTERM or Ctrl-C; the feed being loaded finishes first. 
+# 
+# With --poll-rtbm, run the RTBM poller once (wait for the interval that has just ended, and load it) and exit. 
 
 # In[ ]:
 
 
+import argparse
+import sys
+from sqlalchemy.exc import DBAPIError
+from spp_scheduler import Scheduler, NotYet, cycle_start
+
+# rtbm_lmp has a job of its own, the latest interval poller
+FIVE_MINUTE_FEEDS = ['generation_mix', 'ace', 'stlf', 'tie_flows_long', 'rt_binding']
+
+# feed -> when it last loaded a new file, so that a retry doesn't wait again for a feed that has one
+last_loaded = {}
 
 
+def run_feeds(feeds, job=None):
+    # one scheduled daemon run; raise if anything failed, so the scheduler backs off and retries, and
+    # NotYet if a feed has no new file yet in the job's current cadence (see spp_publication.py)
+    try:
+        report = run_all(con, feeds)
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            reconnect()
+        raise
+    failed = [name for name, row in report.items() if row['status'].startswith('failed')]
+    if failed:
+        if con.invalidated or con.closed:
+            reconnect()
+        raise RuntimeError(f"feeds failed: {failed}")
+
+    for name, row in report.items():
+        if row['status'] in ('loaded', 'no new rows') and row.get('seen') is not None:
+            last_loaded[name] = row['seen']
+            if job is not None:
+                published = row.get('published')
+                spp_publication.record(con, name, cycle_start(published or row['seen'], job.every),
+                                       published, row['seen'])
+    if job is not None and job.cycle is not None:
+        waiting = [name for name, row in report.items() if row['status'] in ('not published', 'unchanged')
+                   and (name not in last_loaded or last_loaded[name] < job.cycle)]
+        if waiting:
+            raise NotYet(', '.join(waiting),
+                         missing=any(report[name]['status'] == 'not published' for name in waiting))
+    return report
+
+
+def run_rtbm_poll(scheduler, start=POLL_START):
+    # one scheduled run of the RTBM poller; it stops polling when the scheduler is stopping, and
+    # when another job is due, to carry on once that has run
+    try:
+        row = poll_rtbm_lmp(scheduler.wait, start, scheduler.next_other)
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            reconnect()
+        raise
+    if row['status'] == 'yielded':
+        raise NotYet(f"{row['interval_end']} yet, polling again after {row['to']}", again=row['until'])
+    return row
+
+
+def learned(feeds, every, offset, quantiles=spp_publication.QUANTILES):
+    # a job's plan: when its feeds have been published (see spp_publication.py), or offset for now
+    return lambda: spp_publication.plan(con, feeds, every, offset, quantiles)
+
+
+def daemon():
+    five_minutes = timedelta(minutes=5)
+    scheduler = Scheduler()
+    # the poller polls on its own; it only needs to start just after the earliest RTBM has been published
+    rtbm = scheduler.add('rtbm_lmp latest', lambda: run_rtbm_poll(scheduler, rtbm.current_offset), five_minutes,
+                         offset=POLL_START, plan=learned(['rtbm_lmp'], five_minutes, POLL_START, [0.0]))
+    five = scheduler.add('5-minute feeds', lambda: run_feeds(FIVE_MINUTE_FEEDS, five), five_minutes,
+                         offset=timedelta(minutes=3, seconds=17), jitter=timedelta(seconds=5),
+                         plan=learned(FIVE_MINUTE_FEEDS, five_minutes, timedelta(minutes=3, seconds=17)))
+    mtlf = scheduler.add('mtlf', lambda: run_feeds(['mtlf'], mtlf), timedelta(hours=1),
+                         offset=timedelta(minutes=4), jitter=timedelta(seconds=30),
+                         plan=learned(['mtlf'], timedelta(hours=1), timedelta(minutes=4)))
+    da = scheduler.add('da_lmp', lambda: run_feeds(['da_lmp'], da), timedelta(days=1),
+                       offset=timedelta(minutes=6), jitter=timedelta(seconds=30),
+                       plan=learned(['da_lmp'], timedelta(days=1), timedelta(minutes=6)))
+    scheduler.install_signal_handlers()
+    scheduler.run()
+    con.commit()
+    con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fetch SPP data for the current interval into the sppdata schema")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and fetch each feed on its own schedule, instead of once")
+    parser.add_argument('--poll-rtbm', action='store_true',
+                        help="wait for the latest RTBM interval to be published, load it, and exit")
+    parser.add_argument('--check-upsert', action='store_true',
+                        help="check that loading an older STLF file after a newer one keeps its actuals, and exit")
+    args = parser.parse_args()
+
+    if args.check_upsert:
+        sys.exit(0 if check_upsert() else 1)
+    elif args.daemon:
+        daemon()
+    elif args.poll_rtbm:
+        poll_rtbm_lmp()
+        con.commit()
+    else:
+        run_all(con)
+        con.commit()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_api.py - read-only HTTP API over the display views in views.sql.
+#
+#     python3 spp_api.py [--host 127.0.0.1] [--port 8080]
+#
+#     GET /                          list of views
+#     GET /rtbm_lmp_map_vw           rows as JSON (an array of objects)
+#     GET /rtbm_lmp_map_vw?format=arrow
+#                                    rows as an Arrow IPC stream (also with
+#                                    Accept: application/vnd.apache.arrow.stream); needs pyarrow
+#     GET /locations                 every settlement location, with its location_id, type,
+#                                    latitude and longitude (spp_locations.index); also ?format=arrow
+#     GET /grids/rtbm_lmp/lmp        the latest interval's LMP interpolated over a lat/lon grid, as
+#                                    a PNG (spp_grid.py); also da_lmp, mcc, and
+#                                    ?format=npz (the float16 grid and its bounds), ?format=json
+#                                    (the same, and the PNG's colour range), ?at=<interval end>,
+#                                    ?range=<low>,<high> (the PNG's colour range; default 2nd-98th
+#                                    percentile)
+#
+# Every *_vw view in the sppdata schema is served. Requests share a small SQLAlchemy connection
+# pool. /locations is answered from the in-process index, which is only read again from the
+# database when the table has changed.
+#
+# Responses are cached in memory until the next 5-minute interval boundary, or until the fetch job
+# sends NOTIFY spp_loaded after a feed loads (spp_dashboard.refresh), whichever comes first; a
+# background thread LISTENs for it. Each cached response has an ETag, and a request with a matching
+# If-None-Match gets 304 Not Modified. When several requests miss the cache at once, one of them
+# queries the database and the others wait for its result.
+#
+# A response that isn't cached yet is streamed as it is read from the database: rows are fetched
+# with a server-side cursor in chunks of CHUNK_ROWS and written with chunked transfer encoding, so
+# the LMP map starts arriving before the whole result has been read.
+#
+# To measure it against a local Postgres:
+#     python3 spp_api.py --bench [--requests 2000] [--concurrency 16] [--no-cache]
+# starts the server on a free port and reports requests per second and latency for each view.
+
+import hashlib
+import io
+import json
+import select
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import spp_grid
+import spp_locations
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+INTERVAL_SECONDS = 300
+CHUNK_ROWS = 5000
+POOL_SIZE = 8
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+LOCATIONS = 'locations'
+GRIDS = 'grids'
+GRID_FEEDS = ['rtbm_lmp', 'da_lmp']
+GRID_FORMATS = {'png': 'image/png', 'npz': 'application/octet-stream', 'json': 'application/json'}
+
+engine = None
+views = set()
+use_cache = True
+
+_cache = {}             # (view, format), or (grid path, format, range) -> (generation, etag, body)
+_building = {}          # the same keys -> lock held while the response is being built
+_lock = threading.Lock()
+_notifies = 0           # spp_loaded notifications seen; part of the cache generation
+_started = int(time.time())
+
+
+def connect(pool_size=POOL_SIZE):
+    global engine
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+    engine = create_engine(f'postgresql+psycopg2:{pg_uri}', pool_size=pool_size, pool_pre_ping=True,
+                           connect_args={'options': '-c search_path=sppdata'})
+    load_views()
+
+
+def load_views():
+    global views
+    with engine.connect() as con:
+        views = set(con.execute(text("""
+            select table_name from information_schema.views
+            where table_schema = 'sppdata' and table_name like '%\\_vw'
+            and table_name not like '%\\_live\\_vw'""")).scalars())
+    print(f"spp_api: serving {', '.join(sorted(views))}")
+
+
+def generation():
+    # responses cached under an older generation are stale
+    return (int(time.time()) // INTERVAL_SECONDS, _notifies)
+
+
+def seconds_to_boundary():
+    return INTERVAL_SECONDS - int(time.time()) % INTERVAL_SECONDS
+
+
+def listen():
+    # drop cached responses whenever a feed has loaded; reconnect if the connection is lost
+    global _notifies
+    while True:
+        raw = None
+        try:
+            raw = engine.raw_connection()
+            raw.dbapi_connection.autocommit = True
+            cursor = raw.cursor()
+            cursor.execute("listen spp_loaded")
+            print("spp_api: listening for spp_loaded")
+            while True:
+                if select.select([raw.dbapi_connection], [], [], 60) == ([], [], []):
+                    cursor.execute("select 1")
+                    continue
+                raw.dbapi_connection.poll()
+                feeds = [n.payload for n in raw.dbapi_connection.notifies]
+                raw.dbapi_connection.notifies.clear()
+                if feeds:
+                    with _lock:
+                        _notifies += 1
+                        _cache.clear()
+                    print(f"{datetime.now()} spp_api: {', '.join(feeds)} loaded; cache cleared")
+        except Exception as e:
+            print(f"spp_api: listen failed, retrying in 10s: {e!r}")
+        finally:
+            # close it, rather than leave a listening, autocommit connection to the pool (or leak
+            # it, if it is broken); a new one is opened for the retry
+            if raw is not None:
+                raw.invalidate()
+        time.sleep(10)
+
+
+def read_chunks(view):
+    # the view's rows as DataFrames of up to CHUNK_ROWS, read through a server-side cursor
+    with engine.connect().execution_options(stream_results=True) as con:
+        yield from pd.read_sql(text(f"select * from {view}"), con, chunksize=CHUNK_ROWS)
+
+
+def json_chunks(view):
+    yield b'['
+    first = True
+    for df in read_chunks(view):
+        if len(df.index) == 0:
+            continue
+        records = df.to_json(orient='records', date_format='iso')[1:-1]
+        yield (b'' if first else b',') + records.encode()
+        first = False
+    yield b']'
+
+
+def arrow_chunks(view):
+    sink = io.BytesIO()
+    schema = None
+    for df in read_chunks(view):
+        # later chunks can infer different types (a column that is all null, say); use the first one's
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        if schema is None:
+            schema = table.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(table)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if schema is None:
+        # no rows; the stream still needs the schema
+        with engine.connect() as con:
+            df = pd.read_sql(text(f"select * from {view} limit 0"), con)
+        writer = pa.ipc.new_stream(sink, pa.Table.from_pandas(df, preserve_index=False).schema)
+    writer.close()
+    yield sink.getvalue()
+
+
+def locations_frame():
+    with engine.connect() as con:
+        return spp_locations.index(con).reset_index()
+
+
+def location_chunks(format):
+    # /locations in format, as one chunk
+    df = locations_frame()
+    if format == 'json':
+        yield df.to_json(orient='records').encode()
+        return
+    sink = io.BytesIO()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    yield sink.getvalue()
+
+
+def grid_body(feed, price, format, at=None, span=None):
+    # a grid from lmp_grid as format; None if there isn't one
+    with engine.connect() as con:
+        found = spp_grid.read(con, feed, price, at)
+    if found is None:
+        return None
+    interval_end, cells, bounds = found
+    low, high = span or spp_grid.scale(cells)
+    if format == 'png':
+        return spp_grid.png(cells, low, high)
+    if format == 'npz':
+        return spp_grid.encode(cells)
+    south, north, west, east, step = bounds
+    return json.dumps({'feed': feed, 'price': price, 'gmtinterval_end': pd.Timestamp(interval_end).isoformat(),
+                       'south': south, 'north': north, 'west': west, 'east': east, 'step': step,
+                       'low': round(low, 2), 'high': round(high, 2),
+                       'rows': [[None if np.isnan(v) else round(float(v), 2) for v in row] for row in cells]}).encode()
+
+
+FORMATS = {
+    'json': ('application/json', json_chunks),
+    'arrow': (ARROW_TYPE, arrow_chunks),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes; without this, small responses wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, content_type, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', f'max-age={seconds_to_boundary()}')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, 'application/json', json.dumps({'error': message}).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        view = url.path.strip('/')
+        if view == '':
+            return self.send_body(200, 'application/json', json.dumps(sorted(views) + [LOCATIONS, GRIDS]).encode())
+        if view.split('/')[0] == GRIDS:
+            return self.send_grid(view, parse_qs(url.query))
+        if view not in views and view != LOCATIONS:
+            return self.send_error_json(404, f"no view {view}")
+
+        format = parse_qs(url.query).get('format', [None])[0]
+        if format is None:
+            format = 'arrow' if ARROW_TYPE in self.headers.get('Accept', '') else 'json'
+        if format not in FORMATS:
+            return self.send_error_json(400, f"format must be one of {', '.join(FORMATS)}")
+        if format == 'arrow' and pa is None:
+            return self.send_error_json(406, "pyarrow is not installed")
+        content_type, chunks = FORMATS[format]
+        if view == LOCATIONS:
+            chunks = lambda _: location_chunks(format)
+
+        if not use_cache:
+            return self.stream(content_type, chunks(view))
+
+        key = (view, format)
+        with _lock:
+            build_lock = _building.setdefault(key, threading.Lock())
+        with build_lock:
+            gen = generation()
+            cached = _cache.get(key)
+            if cached is None or cached[0] != gen:
+                # the first request since the data changed streams the response as it is read, and caches it
+                etag = f'"{view}-{format}-{_started}-{gen[0]}-{gen[1]}"'
+                parts = []
+                def keep(chunks):
+                    for chunk in chunks:
+                        parts.append(chunk)
+                        yield chunk
+                ok = self.stream(content_type, keep(chunks(view)), etag)
+                with _lock:
+                    if ok and generation() == gen:
+                        _cache[key] = (gen, etag, b''.join(parts))
+                return
+
+        self.send_cached(content_type, cached)
+
+    def send_cached(self, content_type, cached):
+        _, etag, body = cached
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'max-age={seconds_to_boundary()}')
+            self.end_headers()
+            return
+        self.send_body(200, content_type, body, etag)
+
+    def send_grid(self, path, query):
+        # /grids/<feed>/<price>; only the latest interval's are cached, an ?at= grid is read each time
+        parts = path.split('/')
+        if len(parts) != 3 or parts[1] not in GRID_FEEDS or parts[2] not in spp_grid.PRICES:
+            return self.send_error_json(404, f"no grid {path}; they are /grids/<{'|'.join(GRID_FEEDS)}>/<{'|'.join(spp_grid.PRICES)}>")
+        feed, price = parts[1:]
+        format = query.get('format', ['png'])[0]
+        if format not in GRID_FORMATS:
+            return self.send_error_json(400, f"format must be one of {', '.join(GRID_FORMATS)}")
+        at = query.get('at', [None])[0]
+        span = query.get('range', [None])[0]
+        try:
+            span = tuple(float(v) for v in span.split(',')) if span else None
+            if span is not None and len(span) != 2:
+                raise ValueError
+        except ValueError:
+            return self.send_error_json(400, "range must be <low>,<high>")
+
+        key = (path, format, span)
+        with _lock:
+            build_lock = _building.setdefault(key, threading.Lock())
+        with build_lock:
+            gen = generation()
+            cached = None if at else _cache.get(key)
+            if cached is None or cached[0] != gen:
+                try:
+                    body = grid_body(feed, price, format, at, span)
+                except Exception as e:
+                    return self.send_error_json(500, repr(e))
+                if body is None:
+                    return self.send_error_json(404, f"no {feed} {price} grid {'at ' + at if at else 'yet'}")
+                etag = f'"{feed}-{price}-{format}-{hashlib.sha1(body).hexdigest()[:16]}"'
+                cached = (gen, etag, body)
+                if not at:
+                    with _lock:
+                        if generation() == gen:
+                            _cache[key] = cached
+        self.send_cached(GRID_FORMATS[format], cached)
+
+    def stream(self, content_type, chunks, etag=None):
+        # send chunks with chunked transfer encoding; returns True if the whole response was sent
+        try:
+            first = next(chunks)
+        except Exception as e:
+            self.send_error_json(500, repr(e))
+            return False
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', f'max-age={seconds_to_boundary()}')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        try:
+            for chunk in _prepend(first, chunks):
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # too late for an error status; end the connection so the client sees a truncated response
+            print(f"spp_api: {self.path} failed while streaming: {e!r}")
+            self.close_connection = True
+            return False
+        return True
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def serve(host, port, pool_size=POOL_SIZE):
+    connect(pool_size)
+    threading.Thread(target=listen, daemon=True).start()
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"spp_api: listening on http://{host}:{server.server_address[1]}/")
+    return server
+
+
+def bench(n_requests, concurrency):
+    # start the server on a free port and hammer each view; prints requests/second and latency
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = serve('127.0.0.1', 0, pool_size=concurrency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    local = threading.local()
+
+    def get(path):
+        if not hasattr(local, 'http'):
+            local.http = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        local.http.request('GET', path)
+        response = local.http.getresponse()
+        size = len(response.read())
+        return time.perf_counter() - start, response.status, size
+
+    rows = []
+    for view in sorted(views) + [LOCATIONS]:
+        for format in (['json', 'arrow'] if pa is not None else ['json']):
+            path = f"/{view}?format={format}"
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(get, [path] * n_requests))
+                elapsed = time.perf_counter() - start
+            latency = pd.Series([r[0] for r in results]) * 1000
+            rows.append({'view': view, 'format': format, 'bytes': results[-1][2],
+                         'errors': sum(1 for r in results if r[1] != 200),
+                         'req_per_s': round(n_requests / elapsed),
+                         'p50_ms': round(latency.quantile(0.5), 2), 'p99_ms': round(latency.quantile(0.99), 2)})
+    server.shutdown()
+    print(f"{n_requests} requests per view, {concurrency} at a time, cache {'on' if use_cache else 'off'}")
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="read-only HTTP API over the sppdata display views")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--no-cache', action='store_true', help="query the database for every request")
+    parser.add_argument('--bench', action='store_true', help="benchmark every view on a local server, then exit")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per view for --bench")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients for --bench")
+    args = parser.parse_args()
+
+    use_cache = not args.no_cache
+    if args.bench:
+        bench(args.requests, args.concurrency)
+    else:
+        serve(args.host, args.port).serve_forever()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_cache.py - local cache of parsed SPP source files, keyed by source URL.
+#
+# Replaces the DA-LMP-SL-YYYYMMDD0100.pickle files that update_da_lmp left in the working
+# directory. Frames are stored as Parquet, so column types (including the UTC timestamps)
+# come back as they went in, and reading them does not depend on which pandas version
+# wrote them. Writes go to a temporary file that is renamed into place, so a crash never
+# leaves a half-written entry; an entry that can't be read anyway is removed and treated
+# as a miss.
+#
+# Entries older than MAX_AGE are evicted, and then the least recently used ones until the
+# cache is under MAX_BYTES.
+#
+# Only files whose content never changes under the same name belong here: the per-interval
+# RTBM and STLF files, the hourly MTLF file and the daily DA file. The rolling files
+# (GenMix2Hour.csv, ACE.csv, ...) are handled by spp_fetch's ETag/hash checks instead.
+#
+# Parquet needs pyarrow; without it the cache is disabled and every file is downloaded.
+
+import os
+import hashlib
+import time
+import threading
+from datetime import timedelta
+
+import pandas as pd
+
+CACHE_DIR = 'cache'
+# part of every key; bump it when the parsed form of the frames changes (2: spp_schema frames)
+VERSION = 2
+MAX_AGE = timedelta(days=2)
+MAX_BYTES = 500 * 1024 * 1024
+
+# feeds are fetched on several threads; one eviction pass at a time
+_evict_lock = threading.Lock()
+
+try:
+    import pyarrow  # noqa: F401
+    enabled = True
+except ImportError:
+    print("spp_cache: pyarrow is not installed; local cache disabled")
+    enabled = False
+
+
+def _path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha1(f"{VERSION} {url}".encode()).hexdigest() + '.parquet')
+
+
+def get(url):
+    # the cached frame for url, or None
+    if not enabled:
+        return None
+    path = _path(url)
+    try:
+        if time.time() - os.path.getmtime(path) > MAX_AGE.total_seconds():
+            return None
+        df = pd.read_parquet(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"spp_cache: removing unreadable {path}: {e!r}")
+        os.remove(path)
+        return None
+    # record the use for least-recently-used eviction; mtime stays the age of the entry
+    os.utime(path, (time.time(), os.path.getmtime(path)))
+    print(f"spp_cache: read {url} from {path}")
+    return df
+
+
+def put(url, df):
+    if not enabled:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _path(url)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print(f"spp_cache: saved {url} as {path}")
+    evict()
+
+
+def evict():
+    # drop entries past MAX_AGE, then least recently used ones until under MAX_BYTES
+    if not os.path.isdir(CACHE_DIR):
+        return
+    with _evict_lock:
+        now = time.time()
+        entries = []
+        for name in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                st = os.stat(path)
+                # leftover .tmp files are from writes that died; give them an hour
+                if now - st.st_mtime > (MAX_AGE.total_seconds() if name.endswith('.parquet') else 3600):
+                    os.remove(path)
+                elif name.endswith('.parquet'):
+                    entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+            except FileNotFoundError:
+                # renamed into place by a write on another thread
+                pass
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= MAX_BYTES:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_compact.py - an optional, compact layout for the LMP tables.
+#
+# rtbm_lmp_by_location and da_lmp_by_location are loaded as pandas wrote them: every row repeats
+# the settlement location and pnode as text, the four prices are float8, and inserted_time is
+# another 8 bytes. That is about 1,100 rows every 5 minutes and 26k rows per DA day. The compact
+# layout keeps, for each of them, a table <table>_id with
+#     gmtinterval_end timestamptz, location_id smallint, lmp real, mlc real, mcc real, mec real
+# where location_id is a key into lmp_location (location_id, settlement_location, pnode); a
+# settlement location's pnode is stored there once instead of on every row. real (float32, about
+# 7 significant digits) is not exact for prices published to 4 places: below $1,024/MWh a price
+# rounded back to 4 places is the published one, but above that it can be off in the 4th place,
+# by up to half a float32 step (0.0005 at $9,000, 0.004 at $100,000; 12345.6789 comes back as
+# 12345.6787). The map doesn't need more; measure() and migrate() report real_error, the largest
+# change real would make to any price in the wide table, so the loss can be checked on the data
+# before migrating. inserted_time is left out.
+#
+# <table> itself becomes a view that joins the names back, with the same columns as before
+# (inserted_time is always null), so views.sql, the backfill gap query and the *_loaded checks
+# don't change. The join is a left join on lmp_location's primary key, which Postgres drops from
+# queries that don't use the names, such as select max(gmtinterval_end).
+#
+# The loader (load_rtbm_lmp / load_da_lmp in fetch_spp_data_batch.py) uses the compact table
+# when it exists: location_ids() maps names to ids with a dictionary read once per session, and
+# only goes to the database for a name it hasn't seen (or a pnode that has changed). The compact
+# tables are partitioned by day like the others (spp_partitions.py).
+#
+# To switch, with the fetch daemon stopped (also works on a new, empty database):
+#     python3 spp_compact.py --migrate
+# which, for each table, in one transaction: fills lmp_location, creates <table>_id and copies the
+# rows across, drops <table> and creates the view in its place, and recreates the views from
+# views.sql that used it, keeping comments and grants (as spp_partitions.py does, and also
+# stopping at anything else built on them). It prints the size of each table and the time the map views take to
+# read, before and after. Run without --migrate to just measure.
+
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+import spp_partitions
+
+# LMP table -> its compact table
+COMPACT = {
+    'rtbm_lmp_by_location': 'rtbm_lmp_by_location_id',
+    'da_lmp_by_location': 'da_lmp_by_location_id',
+}
+PRICES = ['lmp', 'mlc', 'mcc', 'mec']
+
+# map views (views.sql) timed by measure()
+MAP_VIEWS = ['rtbm_lmp_map_live_vw', 'da_lmp_map_live_vw']
+
+# settlement_location -> (location_id, pnode), read once per session
+_ids = {}
+
+
+def physical(con, table):
+    # the table the rows of table are stored in: its compact table if it has one, else itself
+    name = table.split('.')[-1]
+    if name in COMPACT and spp_partitions.relkind(con, table + '_id') is not None:
+        return table + '_id'
+    return table
+
+
+def create_lmp_location(con):
+    con.execute(text("""
+        create table if not exists lmp_location (
+            location_id smallint generated by default as identity primary key,
+            settlement_location text not null unique,
+            pnode text)"""))
+
+
+def forget_ids():
+    # drop the cached ids; after a rollback, they may name rows that are gone
+    _ids.clear()
+
+
+def location_ids(con, df, commit=True):
+    # location_id for each row of df, adding settlement locations not yet in lmp_location;
+    # with commit=False the caller commits, and calls forget_ids() if it rolls back instead
+    if not _ids:
+        for location_id, name, pnode in con.execute(text("select location_id, settlement_location, pnode from lmp_location")):
+            _ids[name] = (location_id, pnode)
+
+    names = df[['settlement_location', 'pnode']].drop_duplicates('settlement_location', keep='last')
+    new = [(name, pnode) for name, pnode in names.itertuples(index=False)
+           if name not in _ids or _ids[name][1] != pnode]
+    if new:
+        # committed right away (unless the caller commits), so the cache never holds an id that a
+        # rolled back load took with it
+        for location_id, name, pnode in con.execute(text("""
+                insert into lmp_location (settlement_location, pnode)
+                select * from unnest(cast(:names as text[]), cast(:pnodes as text[]))
+                on conflict (settlement_location) do update set pnode = excluded.pnode
+                returning location_id, settlement_location, pnode"""),
+                {'names': [n for n, _ in new], 'pnodes': [p for _, p in new]}):
+            _ids[name] = (location_id, pnode)
+        if commit:
+            con.commit()
+        print(f"spp_compact: {len(new)} settlement locations added or changed")
+
+    return df['settlement_location'].map({name: ids[0] for name, ids in _ids.items()}).astype('int16')
+
+
+def to_compact(con, df, commit=True):
+    # a frame of LMP rows in the compact table's columns
+    compact = pd.DataFrame({'gmtinterval_end': df['gmtinterval_end'], 'location_id': location_ids(con, df, commit)})
+    for column in PRICES:
+        compact[column] = df[column].astype('float32')
+    return compact
+
+
+def _create_view(con, table):
+    con.execute(text(f"""
+        create view {table} as
+        select x.gmtinterval_end, l.settlement_location, l.pnode, x.lmp, x.mlc, x.mcc, x.mec,
+               cast(null as timestamptz) as inserted_time
+        from {COMPACT[table]} x
+        left join lmp_location l on l.location_id = x.location_id"""))
+
+
+def migrate(con, table):
+    # convert table to the compact layout; returns False if it already is
+    compact = COMPACT[table]
+    if spp_partitions.relkind(con, compact) is not None:
+        return False
+    kind = spp_partitions.relkind(con, table)
+    # their definitions have to be read before the table is dropped; the view that replaces it
+    # gets its comment and grants
+    views = spp_partitions.dependent_views(con, table) if kind else []
+    saved = spp_partitions.settings(con, table) if kind else (None, [])
+
+    print(f"spp_compact {table}: migrating to {compact}")
+    create_lmp_location(con)
+    con.execute(text(f"""
+        create table {compact} (
+            gmtinterval_end timestamptz not null,
+            location_id smallint not null,
+            {', '.join(f'{column} real' for column in PRICES)},
+            constraint {compact}_pk primary key (gmtinterval_end, location_id)
+        ) partition by range (gmtinterval_end)"""))
+
+    copied = 0
+    first = last = None
+    if kind in ('r', 'p'):
+        con.execute(text(f"""
+            insert into lmp_location (settlement_location, pnode)
+            select distinct on (settlement_location) settlement_location, pnode from {table}
+            order by settlement_location, gmtinterval_end desc
+            on conflict (settlement_location) do nothing"""))
+        first, last = con.execute(text(f"select min(gmtinterval_end), max(gmtinterval_end) from {table}")).first()
+        largest, error = real_error(con, table)
+        print(f"spp_compact {table}: prices up to {largest} $/MWh; as real, off by at most {error}")
+    if first is not None:
+        spp_partitions.ensure_partitions(con, compact, pd.date_range(pd.Timestamp(first).floor('D'), last, freq='D'), commit=False)
+    else:
+        spp_partitions.ensure_partitions(con, compact, commit=False)
+    if kind in ('r', 'p'):
+        copied = con.execute(text(f"""
+            insert into {compact}
+            select x.gmtinterval_end, l.location_id, {', '.join(f'x.{column}' for column in PRICES)}
+            from {table} x join lmp_location l using (settlement_location)""")).rowcount
+        # without cascade: anything but the views saved above stops the migration
+        spp_partitions.drop_views(con, views)
+        con.execute(text(f"drop table {table}"))
+
+    _create_view(con, table)
+    spp_partitions.restore_settings(con, table, saved)
+    spp_partitions.recreate_views(con, views)
+    con.execute(text(f"analyze {compact}"))
+    con.execute(text("analyze lmp_location"))
+    con.commit()
+    _ids.clear()
+    print(f"spp_compact {table}: copied {copied} rows; recreated views {', '.join(v[1] for v in views) or '(none)'}")
+    return True
+
+
+def real_error(con, table):
+    # (largest price, largest change storing the prices as real makes to any of them, rounded to
+    # the 4 places they are published at) over the wide table's rows; in $/MWh
+    return con.execute(text(f"""
+        select max(greatest({', '.join(f'abs({c})' for c in PRICES)})),
+               max(greatest({', '.join(f'abs(round(cast(cast(cast({c} as real) as float8) as numeric), 4) - round(cast({c} as numeric), 4))' for c in PRICES)}))
+        from {table}""")).first()
+
+
+def table_bytes(con, table):
+    # on-disk size of table with its indexes and toast, and of its partitions if it has any;
+    # for a compact table's view, the compact table and lmp_location
+    if spp_partitions.relkind(con, table) == 'v':
+        return table_bytes(con, physical(con, table)) + table_bytes(con, 'lmp_location')
+    return con.execute(text("""
+        select coalesce(sum(pg_total_relation_size(relid)), 0) from pg_partition_tree(to_regclass(:t))"""),
+        {'t': table}).scalar()
+
+
+def measure(con, repeat=5):
+    # size of each LMP table and the median time to read each map view
+    rows = []
+    for table in COMPACT:
+        if spp_partitions.relkind(con, table) is None:
+            continue
+        count = con.execute(text(f"select count(*) from {table}")).scalar()
+        size = table_bytes(con, table)
+        wide = physical(con, table) == table
+        row = {'relation': table, 'layout': 'wide' if wide else 'compact',
+               'rows': count, 'mb': round(size / 2**20, 2),
+               'bytes_per_row': round(size / count, 1) if count else None}
+        if wide:
+            # what the compact layout's real columns would lose
+            row['max_price'], row['real_error'] = real_error(con, table)
+        rows.append(row)
+    for view in MAP_VIEWS:
+        if spp_partitions.relkind(con, view) is None:
+            continue
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = len(pd.read_sql(text(f"select * from {view}"), con).index)
+            times.append(time.perf_counter() - start)
+        rows.append({'relation': view, 'rows': count, 'ms': round(sorted(times)[repeat // 2] * 1000, 1)})
+    con.commit()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from sqlalchemy import create_engine
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+    con = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                        connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    print(measure(con).to_string(index=False))
+    if '--migrate' in sys.argv[1:]:
+        for table in COMPACT:
+            try:
+                migrate(con, table)
+            except Exception:
+                con.rollback()
+                raise
+        print(measure(con).to_string(index=False))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_dashboard.py - keep the dashboard tables from views.sql up to date.
+#
+# Each <name>_mat table holds the current result of the <name>_live_vw view: the most recent
+# interval of one feed, joined to settlement_location, or the week of emissions. The dashboard
+# reads them through the plain <name>_vw views. After a feed loads, refresh() rebuilds the tables
+# that depend on it, in one transaction: readers keep seeing the previous interval until the
+# commit, and then the new one. In run_all that is the run's one transaction, shared by every
+# feed (see unit_of_work in fetch_spp_data_batch.py). The _live_vw views only read the latest
+# interval (by the primary key index), so a refresh costs about what a single dashboard read used to.
+#
+# The same transaction sends NOTIFY spp_loaded, '<feed>' for every feed that loads, whether or
+# not it has tables here; spp_api.py listens for it to drop its cached responses.
+#
+# If views.sql hasn't been rerun since the tables were added, refresh() says so and carries on;
+# the loads themselves don't depend on it.
+
+import time
+
+from sqlalchemy import text
+
+import spp_storage
+
+# feed -> dashboard tables to rebuild after it loads
+REFRESH = {
+    # emissions_trend is rebuilt in full, not just for the new interval: every row carries the
+    # weekly_average over the last 7 days, which changes with each interval added (and each one
+    # that drops out of the week), so every row changes anyway. It is at most 2016 rows
+    'generation_mix': ['generation_mix_piechart', 'emissions_trend'],
+    # the DA map shows the hour the latest RT interval falls in, so it moves with RTBM too
+    'rtbm_lmp': ['rtbm_lmp_map', 'da_lmp_map'],
+    'da_lmp': ['da_lmp_map'],
+    'rt_binding': ['rtbm_binding_constraints'],
+}
+
+
+def refresh(con, feed, commit=True):
+    # rebuild the dashboard tables that depend on feed, and tell listeners feed has loaded;
+    # returns the names of the tables rebuilt. With commit=False this joins the caller's
+    # transaction (run_all's unit of work), and a failure undoes only the refresh
+    if spp_storage.is_store(con):
+        # the Parquet store's views are computed when read, and nothing listens (see spp_storage.py)
+        return []
+    names = REFRESH.get(feed, [])
+    start = time.perf_counter()
+    transaction = con if commit else con.begin_nested()
+    try:
+        for name in names:
+            con.execute(text(f"delete from {name}_mat"))
+            con.execute(text(f"insert into {name}_mat select * from {name}_live_vw"))
+        con.execute(text("select pg_notify('spp_loaded', :feed)"), {'feed': feed})
+        transaction.commit()
+    except Exception as e:
+        transaction.rollback()
+        print(f"spp_dashboard {feed}: refresh failed (has views.sql been run?): {e!r}")
+        return []
+    if names:
+        print(f"spp_dashboard {feed}: refreshed {', '.join(names)} in {time.perf_counter() - start:.3f}s")
+    return names
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_fetch.py - conditional downloads of SPP source files.
+#
+# Most runs find that SPP has not published anything new in the rolling files (GenMix2Hour.csv,
+# ACE.csv, TieFlows.csv, RTBM-BC-latestInterval.csv), or are asking again for a file (MTLF) that
+# was already loaded. For every source URL this remembers:
+#   * the ETag and Last-Modified headers (HTTP), or the MDTM modification time (FTP)
+#   * a sha256 of the content
+# and on the next fetch:
+#   * sends If-None-Match / If-Modified-Since; a 304 means no download at all
+#   * for FTP, asks for MDTM first and skips the download if it has not changed
+#   * otherwise downloads, and if the content hash matches, it is still unchanged
+# An unchanged source returns content None, and callers skip the parse and the database load.
+#
+# Validators are only saved (to fetch_state.json in the working directory) once the caller
+# says the content was loaded, with mark_loaded(); a download whose load fails is retried
+# in full next time. Content that didn't come from fetch() this run (spp_cache's parsed copy of
+# a file that never changes) is remembered as loaded too, with whatever validators were known.
+#
+# The source hosts can be pointed at a local stand-in server for testing:
+#     export SPP_MARKETPLACE_URL=http://localhost:8000/file-browser-api/download
+#     export SPP_PUBFTP_URL=ftp://localhost:2121
+
+import os
+import json
+import email.utils
+import hashlib
+import threading
+import ftplib
+import urllib.request
+import urllib.error
+import urllib.parse
+from datetime import datetime, timezone, timedelta
+
+MARKETPLACE_URL = os.environ.get('SPP_MARKETPLACE_URL', 'https://marketplace.spp.org/file-browser-api/download')
+PUBFTP_URL = os.environ.get('SPP_PUBFTP_URL', 'ftp://pubftp.spp.org')
+
+STATE_FILE = 'fetch_state.json'
+# forget validators for URLs not fetched in this long (the per-interval file names never repeat)
+STATE_KEEP = timedelta(days=2)
+TIMEOUT = 60
+
+_lock = threading.Lock()
+_state = None      # url -> {'etag', 'last_modified', 'sha256', 'seen'} as last loaded
+_pending = {}      # url -> validators of content fetched this run, not yet loaded
+counters = {}      # feed -> {'hit': n, 'miss': n}
+
+
+class FetchResult:
+    def __init__(self, url, content, etag=None, last_modified=None, sha256=None, how=None):
+        self.url = url
+        self.content = content              # bytes, or None if the source is unchanged
+        self.size = len(content) if content is not None else 0     # bytes downloaded
+        self.etag = etag
+        self.last_modified = last_modified
+        self.sha256 = sha256
+        self.how = how                      # how "unchanged" was detected, or 'downloaded'
+
+    @property
+    def unchanged(self):
+        return self.content is None
+
+    @property
+    def modified(self):
+        # when the source says it last changed (Last-Modified, or MDTM on FTP), as UTC, or None
+        if not self.last_modified:
+            return None
+        try:
+            if self.last_modified.isdigit():
+                return datetime.strptime(self.last_modified[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+            return email.utils.parsedate_to_datetime(self.last_modified).astimezone(timezone.utc)
+        except (TypeError, ValueError):
+            return None
+
+
+def _load_state():
+    global _state
+    if _state is None:
+        try:
+            with open(STATE_FILE, 'r') as f:
+                _state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            _state = {}
+    return _state
+
+
+def save_state():
+    # write validators of loaded content; prune URLs that haven't been seen in a while
+    with _lock:
+        state = _load_state()
+        cutoff = (datetime.now(timezone.utc) - STATE_KEEP).isoformat()
+        for url in [u for u, v in state.items() if v.get('seen', '') < cutoff]:
+            del state[url]
+        tmp = STATE_FILE + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp, STATE_FILE)
+
+
+def _count(feed, outcome):
+    with _lock:
+        counters.setdefault(feed, {'hit': 0, 'miss': 0})[outcome] += 1
+
+
+def _fetch_http(url, known):
+    request = urllib.request.Request(url)
+    if known.get('etag'):
+        request.add_header('If-None-Match', known['etag'])
+    if known.get('last_modified'):
+        request.add_header('If-Modified-Since', known['last_modified'])
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            return FetchResult(url, response.read(),
+                               etag=response.headers.get('ETag'),
+                               last_modified=response.headers.get('Last-Modified'))
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return FetchResult(url, None, etag=known.get('etag'), last_modified=known.get('last_modified'),
+                               sha256=known.get('sha256'), how='not modified')
+        raise
+
+
+def _fetch_ftp(url, known):
+    parts = urllib.parse.urlparse(url)
+    with ftplib.FTP(timeout=TIMEOUT) as ftp:
+        ftp.connect(parts.hostname, parts.port or 21)
+        ftp.login(parts.username or 'anonymous', parts.password or 'anonymous@')
+        try:
+            # "213 20230301123456"
+            mdtm = ftp.sendcmd(f"MDTM {parts.path}").split()[-1]
+        except ftplib.error_perm:
+            mdtm = None
+        if mdtm is not None and mdtm == known.get('last_modified'):
+            return FetchResult(url, None, last_modified=mdtm, sha256=known.get('sha256'), how='not modified')
+        chunks = []
+        ftp.retrbinary(f"RETR {parts.path}", chunks.append)
+        return FetchResult(url, b''.join(chunks), last_modified=mdtm)
+
+
+def fetch(url, feed=None, quiet=False):
+    # download url unless it is unchanged since it was last loaded; see FetchResult.unchanged
+    # (quiet: print only downloads, for a source polled every few seconds)
+    feed = feed or url
+    with _lock:
+        known = dict(_load_state().get(url, {}))
+
+    if url.startswith('ftp://'):
+        result = _fetch_ftp(url, known)
+    else:
+        result = _fetch_http(url, known)
+
+    if result.content is not None:
+        result.sha256 = hashlib.sha256(result.content).hexdigest()
+        if result.sha256 == known.get('sha256'):
+            result.content = None
+            result.how = 'same content'
+        else:
+            result.how = 'downloaded'
+
+    _count(feed, 'hit' if result.unchanged else 'miss')
+    with _lock:
+        if result.unchanged:
+            _load_state()[url]['seen'] = datetime.now(timezone.utc).isoformat()
+        else:
+            _pending[url] = {'etag': result.etag, 'last_modified': result.last_modified, 'sha256': result.sha256}
+    if not quiet or not result.unchanged:
+        print(f"spp_fetch {feed}: {result.how} {url}")
+    return result
+
+
+def not_found(e):
+    # True if exception e from fetch means the file isn't there (yet): HTTP 404, or FTP 550
+    return (isinstance(e, urllib.error.HTTPError) and e.code == 404) or \
+        (isinstance(e, ftplib.error_perm) and str(e).startswith('550'))
+
+
+def loaded(url):
+    # True if content from url has been loaded (and not yet forgotten)
+    with _lock:
+        return url in _load_state()
+
+
+def mark_loaded(url):
+    # the content last fetched from url (or read from spp_cache) is in the database; remember it
+    if url is None:
+        return
+    with _lock:
+        validators = _pending.pop(url, None)
+        if validators is None:
+            validators = dict(_load_state().get(url, {'etag': None, 'last_modified': None, 'sha256': None}))
+        validators['seen'] = datetime.now(timezone.utc).isoformat()
+        _load_state()[url] = validators
+
+
+def log_counters():
+    # per-feed unchanged (hit) and downloaded (miss) counts, for the run log
+    with _lock:
+        for feed, c in sorted(counters.items()):
+            print(f"spp_fetch {feed}: {c['hit']} unchanged, {c['miss']} downloaded")
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_grid.py - LMP and MCC interpolated over a fixed latitude/longitude grid, for zoomed-out maps.
+#
+# The map views return every settlement location (about 1,100) with its estimated latitude and
+# longitude, and the client draws them all as points. For a map of the whole footprint, a grid of
+# ROWS x COLS cells (STEP degrees, from SOUTH/WEST to NORTH/EAST) is enough: each cell gets the
+# inverse distance weighted (IDW, 1/d**POWER) mean of its K nearest settlement locations' prices,
+# and cells with no settlement location within MAX_DISTANCE degrees are left empty (NaN), so the
+# grid doesn't reach far past the footprint. Distances are in degrees, with longitude scaled by
+# the cosine of the grid's middle latitude.
+#
+# Which K locations each cell uses, and their weights, depend only on where the locations are, so
+# they are worked out once, when spp_locations.index() changes (with scipy's cKDTree if it is
+# installed, or a brute-force search in NumPy, a fraction of a second either way). A grid is then
+# a gather and a weighted sum over the interval's prices, about a millisecond.
+#
+# After rtbm_lmp or da_lmp loads, update() makes a grid of each of PRICES for every interval in
+# the file and keeps it in the lmp_grid table:
+#     gmtinterval_end, feed, price, grid
+# where grid is a compressed .npz (numpy.savez_compressed) holding the float16 grid (row 0 is the
+# south edge; NaN where it is empty) and its bounds (south, north, west, east, step), about
+# 10 KB. The cleanup job keeps two weeks of them, as for the LMP tables. spp_api.py serves them as
+#     GET /grids/<feed>/<price>[?at=<interval end>]   ?format=png (default), npz or json
+# png() draws one as an 8-bit palette PNG, blue (low) to white to red (high), transparent where
+# the grid is empty, a few KB; it covers the grid's bounds in plain latitude/longitude, for an
+# image overlay rather than a tile layer.
+#
+# To see what a grid costs and how big it is, against the latest interval in the database:
+#     python3 spp_grid.py [--feed rtbm_lmp] [--png latest.png]
+
+import io
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import spp_locations
+import spp_metrics
+import spp_storage
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+TABLE = 'lmp_grid'
+KEYS = ['gmtinterval_end', 'feed', 'price']
+PRICES = ['lmp', 'mcc']
+
+# the grid: cell centres from SOUTH + STEP/2 to NORTH - STEP/2, and the same across
+SOUTH, NORTH, WEST, EAST, STEP = 30.4, 49.6, -106.8, -89.8, 0.2
+ROWS = round((NORTH - SOUTH) / STEP)
+COLS = round((EAST - WEST) / STEP)
+K = 8
+POWER = 2
+MAX_DISTANCE = 1.0
+CHUNK_CELLS = 1000      # cells at a time in the brute-force search
+
+_lock = threading.Lock()
+_neighbours = None      # (the index they were found for, names, neighbours, weights, empty cells)
+
+
+def centres():
+    # (latitude, longitude) of every cell, row by row from the south
+    lat = SOUTH + STEP / 2 + STEP * np.arange(ROWS)
+    lon = WEST + STEP / 2 + STEP * np.arange(COLS)
+    lat, lon = np.meshgrid(lat, lon, indexing='ij')
+    return lat.ravel(), lon.ravel()
+
+
+def nearest(points, cells, k=K):
+    # (distances, positions in points) of each cell's k nearest points, nearest first
+    if cKDTree is not None:
+        return cKDTree(points).query(cells, k=k)
+    distances, positions = [], []
+    for start in range(0, len(cells), CHUNK_CELLS):
+        d2 = ((cells[start:start + CHUNK_CELLS, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        near = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        d2 = np.take_along_axis(d2, near, axis=1)
+        order = np.argsort(d2, axis=1)
+        distances.append(np.sqrt(np.take_along_axis(d2, order, axis=1)))
+        positions.append(np.take_along_axis(near, order, axis=1))
+    return np.vstack(distances), np.vstack(positions)
+
+
+def neighbours(index):
+    # (names, each cell's K nearest of them, their IDW weights, cells with none near) for the
+    # settlement locations in index; found again only when index changes
+    global _neighbours
+    with _lock:
+        if _neighbours is None or _neighbours[0] is not index:
+            placed = index[index.est_latitude.notna() & index.est_longitude.notna()]
+            scale = np.cos(np.radians((SOUTH + NORTH) / 2))
+            points = np.column_stack([placed.est_latitude.to_numpy(float), placed.est_longitude.to_numpy(float) * scale])
+            lat, lon = centres()
+            distances, positions = nearest(points, np.column_stack([lat, lon * scale]), min(K, len(points)))
+            distances, positions = distances.reshape(len(lat), -1), positions.reshape(len(lat), -1)
+            weights = 1 / np.maximum(distances, 1e-6) ** POWER
+            _neighbours = (index, placed.index, positions, weights, distances[:, 0] > MAX_DISTANCE)
+        return _neighbours[1:]
+
+
+def grid(index, prices):
+    # the ROWS x COLS grid of prices (a Series by settlement_location), NaN where it is empty
+    names, positions, weights, empty = neighbours(index)
+    values = prices.reindex(names).to_numpy(float)[positions]
+    # a location without a price in this interval is left out of its cells' means
+    weights = np.where(np.isnan(values), 0, weights)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cells = (np.nan_to_num(values) * weights).sum(axis=1) / total
+    cells[empty | (total == 0)] = np.nan
+    return cells.reshape(ROWS, COLS)
+
+
+def encode(cells):
+    buf = io.BytesIO()
+    np.savez_compressed(buf, grid=cells.astype(np.float16), bounds=np.array([SOUTH, NORTH, WEST, EAST, STEP]))
+    return buf.getvalue()
+
+
+def decode(blob):
+    # (grid as float32, bounds (south, north, west, east, step))
+    with np.load(io.BytesIO(bytes(blob))) as npz:
+        return npz['grid'].astype(np.float32), tuple(float(b) for b in npz['bounds'])
+
+
+def grids(con, feed, df):
+    # a row (gmtinterval_end, feed, price, grid) for each interval in df and each of PRICES
+    index = spp_locations.index(con)
+    if len(index.index) == 0:
+        return pd.DataFrame(columns=KEYS + ['grid'])
+    rows = []
+    for interval_end, group in df.groupby('gmtinterval_end'):
+        group = group.drop_duplicates('settlement_location', keep='last').set_index('settlement_location')
+        for price in PRICES:
+            rows.append({'gmtinterval_end': interval_end, 'feed': feed, 'price': price,
+                         'grid': encode(grid(index, group[price]))})
+    return pd.DataFrame(rows)
+
+
+def create_table(con):
+    con.execute(text(f"""
+        create table if not exists {TABLE} (
+            gmtinterval_end timestamptz not null, feed text not null, price text not null,
+            grid bytea not null,
+            constraint {TABLE}_pk primary key (gmtinterval_end, feed, price))"""))
+
+
+def update(con, feed, df, commit=True):
+    # make and keep the grids of the intervals in df, a file of feed just loaded; returns how many
+    # were made. With commit=False this joins the caller's transaction (run_all's unit of work),
+    # and a failure undoes only the grids; like the dashboard refresh, it never fails the load.
+    start = time.perf_counter()
+    if spp_storage.is_store(con):
+        try:
+            rows = grids(con, feed, df)
+            if len(rows.index):
+                con.insertnew(TABLE, KEYS, rows)
+        except Exception as e:
+            print(f"spp_grid {feed}: failed: {e!r}")
+            return 0
+        spp_metrics.add(grid_s=time.perf_counter() - start)
+        return len(rows.index)
+    transaction = con if commit else con.begin_nested()
+    try:
+        rows = grids(con, feed, df)
+        if len(rows.index):
+            create_table(con)
+            con.execute(text(f"""
+                insert into {TABLE} (gmtinterval_end, feed, price, grid)
+                values (:gmtinterval_end, :feed, :price, :grid)
+                on conflict do nothing"""), rows.to_dict('records'))
+        transaction.commit()
+    except Exception as e:
+        transaction.rollback()
+        print(f"spp_grid {feed}: failed: {e!r}")
+        return 0
+    spp_metrics.add(grid_s=time.perf_counter() - start)
+    print(f"spp_grid {feed}: {len(rows.index)} grids in {time.perf_counter() - start:.3f}s")
+    return len(rows.index)
+
+
+def read(con, feed, price, at=None):
+    # (interval end, grid, bounds) of feed's price at the interval ending at, or the latest; None
+    # if there isn't one
+    row = con.execute(text(f"""
+        select gmtinterval_end, grid from {TABLE}
+        where feed = :feed and price = :price
+        and (cast(:at as timestamptz) is null or gmtinterval_end = cast(:at as timestamptz))
+        order by gmtinterval_end desc limit 1"""), {'feed': feed, 'price': price, 'at': at}).first()
+    if row is None:
+        return None
+    return (row[0], *decode(row[1]))
+
+
+def palette():
+    # 256 RGB colours: 0 is for empty cells (transparent), 1-255 blue to white to red
+    v = np.linspace(-1, 1, 255)
+    red = np.where(v < 0, 1 + v, 1)
+    green = 1 - np.abs(v)
+    blue = np.where(v > 0, 1 - v, 1)
+    colours = np.column_stack([red, green, blue]) * 255
+    return np.vstack([[0, 0, 0], colours]).round().astype(np.uint8)
+
+
+PALETTE = palette()
+
+
+def scale(cells):
+    # the range png() spreads its colours over: the 2nd to the 98th percentile, so that a few
+    # outlying prices don't wash the rest out
+    values = cells[~np.isnan(cells)]
+    if len(values) == 0:
+        return 0.0, 1.0
+    return float(np.percentile(values, 2)), float(np.percentile(values, 98))
+
+
+def png(cells, low=None, high=None):
+    # cells as an 8-bit palette PNG, north up; prices outside (low, high) get the end colours
+    if low is None or high is None:
+        low, high = scale(cells)
+    fraction = np.clip((cells - low) / ((high - low) or 1), 0, 1)
+    pixels = np.where(np.isnan(cells), 0, 1 + np.round(np.nan_to_num(fraction) * 254)).astype(np.uint8)[::-1]
+    raw = b''.join(b'\x00' + row.tobytes() for row in pixels)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    height, width = pixels.shape
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+            + chunk(b'PLTE', PALETTE.tobytes())
+            + chunk(b'tRNS', b'\x00')
+            + chunk(b'IDAT', zlib.compress(raw, 9))
+            + chunk(b'IEND', b''))
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="time and size the LMP grids for the latest interval")
+    parser.add_argument('--feed', default='rtbm_lmp', choices=['rtbm_lmp', 'da_lmp'])
+    parser.add_argument('--png', help="also write the LMP grid as a PNG to this file")
+    args = parser.parse_args()
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+    con = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                        connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    table = {'rtbm_lmp': 'rtbm_lmp_by_location', 'da_lmp': 'da_lmp_by_location'}[args.feed]
+    df = pd.read_sql(text(f"""
+        select gmtinterval_end, settlement_location, {', '.join(PRICES)} from {table}
+        where gmtinterval_end = (select max(gmtinterval_end) from {table})"""), con)
+    index = spp_locations.index(con)
+    print(f"{args.feed} {df.gmtinterval_end.max()}: {len(df.index)} settlement locations, "
+          f"{len(index.index)} in settlement_location, scipy {'yes' if cKDTree else 'no'}")
+
+    start = time.perf_counter()
+    neighbours(index)
+    print(f"neighbours of {ROWS} x {COLS} cells: {time.perf_counter() - start:.3f}s (once per set of locations)")
+    start = time.perf_counter()
+    rows = grids(con, args.feed, df)
+    print(f"{len(rows.index)} grids: {(time.perf_counter() - start) * 1000:.1f} ms")
+    points = len(df.to_json(orient='records'))
+    for row in rows.itertuples():
+        cells = decode(row.grid)[0]
+        print(f"  {row.price}: {np.isnan(cells).mean():.0%} empty, npz {len(row.grid)} bytes, png {len(png(cells))} bytes "
+              f"(the points as JSON: {points} bytes)")
+    if args.png:
+        with open(args.png, 'wb') as f:
+            f.write(png(decode(rows.grid.iloc[0])[0]))
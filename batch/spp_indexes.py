@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_indexes.py - the indexes each sppdata table should have, kept by the loader.
+#
+# Every table's primary key starts with its time key (pg_insertnew adds it with the columns in
+# the order the load_* function gives them), and that index is what answers the queries that
+# matter: max(time key) in the views and get_current_interval, the "last 2 hours" / "last 7 days"
+# ranges in views.sql, the *_loaded existence checks and the cleanup's batched deletes. On top of
+# that, INDEXES declares per table:
+#     a BRIN index on the time key of the big append-only tables, when they are not partitioned
+#         (a few pages, which lets a range on the time key skip most of the table; partitioned
+#         tables get the same from partition pruning)
+# (The STLF and MTLF rows still waiting for their actuals used to be deleted before every load, and
+# had partial indexes for it; they are upserted now, by primary key.)
+# pg_prepare_table calls ensure_indexes() the first time it sees a table in a session, which
+# creates what is missing (create index if not exists, so it costs a catalog lookup after that)
+# and warns about a primary key that doesn't start with the time key.
+#
+# The existence checks in fetch_spp_data_batch.py used to compare
+#     (gmtinterval_end at time zone 'America/Chicago') = '<local time>'
+# which no index on gmtinterval_end can answer. They are UTC ranges now, as in CHECKS.
+#
+# To check, with EXPLAIN, that each query in CHECKS is answered from the time key's index (sequential
+# scans are switched off for the check, so the answer doesn't depend on how big the tables are yet).
+# That alone isn't enough: with them off, a query that can't use the index gets a full Index Scan with
+# a Filter instead. So a query passes only if every scan of a table (or one of its partitions) has an
+# Index Cond, or a bitmap scan's Recheck Cond, on that table's time key:
+#     python3 spp_indexes.py            # exits with status 1 if any query fails, or couldn't be
+#                                       # checked
+#     python3 spp_indexes.py --create   # create the missing indexes first
+
+import json
+import re
+
+from sqlalchemy import text
+
+import spp_partitions
+
+# table -> (time key, [(index name suffix, definition, also on a partitioned table)])
+INDEXES = {
+    'generation_mix': ('gmt_mkt_interval', []),
+    'area_control_error': ('gmttime', []),
+    'rtbm_lmp_by_location': ('gmtinterval_end', [('time_brin', 'using brin (gmtinterval_end)', False)]),
+    'da_lmp_by_location': ('gmtinterval_end', [('time_brin', 'using brin (gmtinterval_end)', False)]),
+    'stlf_vs_actual': ('gmtinterval_end', []),
+    'mtlf_vs_actual': ('gmtinterval_end', []),
+    'tie_flows_long': ('gmttime', [('time_brin', 'using brin (gmttime)', False)]),
+    'rtbm_binding_constraints': ('gmtinterval_end', [('time_brin', 'using brin (gmtinterval_end)', False)]),
+    # the compact LMP tables (spp_compact.py) are always partitioned
+    'rtbm_lmp_by_location_id': ('gmtinterval_end', []),
+    'da_lmp_by_location_id': ('gmtinterval_end', []),
+    # when each feed was published (spp_publication.py)
+    'feed_publication': ('cycle_start', []),
+    # the LMP map grids (spp_grid.py)
+    'lmp_grid': ('gmtinterval_end', []),
+}
+
+# (what, query) answered from an index; :t is a UTC interval end. Keep these in step with the
+# queries they copy.
+CHECKS = [
+    ('rtbm_lmp_loaded', """select 1 from rtbm_lmp_by_location
+        where gmtinterval_end >= cast(:t as timestamptz) and gmtinterval_end < cast(:t as timestamptz) + interval '5 minutes' limit 1"""),
+    ('da_lmp_loaded', """select 1 from da_lmp_by_location
+        where gmtinterval_end >= cast(:t as timestamptz) and gmtinterval_end < cast(:t as timestamptz) + interval '1 hour' limit 1"""),
+    ('mtlf_loaded', """select 1 from mtlf_vs_actual
+        where gmtinterval_end >= cast(:t as timestamptz) and gmtinterval_end < cast(:t as timestamptz) + interval '1 hour'
+        and averaged_actual is not null limit 1"""),
+    ('get_current_interval', "select max(gmt_mkt_interval) from generation_mix"),
+    ('rtbm_lmp_map: latest interval', "select max(gmtinterval_end) from rtbm_lmp_by_location"),
+    ('rtbm_binding_constraints: latest interval', "select max(gmtinterval_end) from rtbm_binding_constraints"),
+    ('emissions_trend: last 7 days', "select * from generation_mix where gmt_mkt_interval > current_timestamp - interval '7 days'"),
+    ('tie_flows_long_vw: last 2 hours', """select * from tie_flows_long
+        where gmttime > current_timestamp - interval '2 hours' and gmttime < current_timestamp + interval '30 minutes'"""),
+    ('area_control_error_vw: last 2 hours', "select * from area_control_error where gmttime > current_timestamp - interval '2 hours'"),
+] + [
+    (f"cleanup batch: {table}", f"""select ctid from {table} where {key} < current_timestamp - interval '2 weeks'
+        order by {key} limit 10000""")
+    for table, key in [('generation_mix', 'gmt_mkt_interval'), ('area_control_error', 'gmttime'),
+                       ('stlf_vs_actual', 'gmtinterval_end'), ('mtlf_vs_actual', 'gmtinterval_end')]
+]
+
+
+def primary_key(con, table):
+    # the columns of table's primary key, in order
+    return list(con.execute(text("""
+        select a.attname from pg_index i
+        cross join lateral unnest(i.indkey) with ordinality as k(attnum, n)
+        join pg_attribute a on a.attrelid = i.indrelid and a.attnum = k.attnum
+        where i.indrelid = to_regclass(:t) and i.indisprimary
+        order by k.n"""), {'t': table}).scalars())
+
+
+def ensure_indexes(con, table, commit=True):
+    # create the indexes INDEXES declares for table that it doesn't have yet; returns their names
+    if table not in INDEXES:
+        return []
+    key, indexes = INDEXES[table]
+    kind = spp_partitions.relkind(con, table)
+    if kind not in ('r', 'p'):
+        return []
+
+    pk = primary_key(con, table)
+    if pk and pk[0] != key:
+        print(f"spp_indexes {table}: primary key ({', '.join(pk)}) doesn't start with {key}")
+
+    created = []
+    for suffix, definition, partitioned_too in indexes:
+        if kind == 'p' and not partitioned_too:
+            continue
+        name = f"{table}_{suffix}"
+        if spp_partitions.relkind(con, name) is None:
+            con.execute(text(f"create index if not exists {name} on {table} {definition}"))
+            created.append(name)
+    if created:
+        if commit:
+            con.commit()
+        print(f"spp_indexes {table}: created {', '.join(created)}")
+    return created
+
+
+def plan_nodes(plan):
+    # every node of an EXPLAIN (format json) plan
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def time_key(relation):
+    # the time key of a table in INDEXES, or of one of its daily partitions (spp_partitions.py)
+    table = relation if relation in INDEXES else re.sub(r'_p\d{8}$', '', relation)
+    return INDEXES[table][0] if table in INDEXES else None
+
+
+def uses_time_key(node):
+    # whether a scan node finds its rows by its table's time key, rather than reading them all
+    key = time_key(node['Relation Name'])
+    condition = node.get('Index Cond') or node.get('Recheck Cond') or ''
+    return key is not None and re.search(rf'\b{key}\b', condition) is not None
+
+
+def describe(node):
+    # 'Index Scan on generation_mix', and why that fails the check, if it does
+    scan = f"{node['Node Type']} on {node['Relation Name']}"
+    return scan if uses_time_key(node) else f"{scan} without a condition on {time_key(node['Relation Name']) or 'a time key'}"
+
+
+def check(con, t=None):
+    # [(what, passed, scans)] for CHECKS, with sequential scans switched off; passed is None if
+    # the query couldn't be explained (a table that doesn't exist yet, say)
+    if t is None:
+        t = con.execute(text("select date_trunc('hour', current_timestamp)")).scalar()
+    results = []
+    con.execute(text("set local enable_seqscan = off"))
+    for what, query in CHECKS:
+        # a failed EXPLAIN undoes only its savepoint, not the setting above
+        nested = con.begin_nested()
+        try:
+            plan = con.execute(text(f"explain (format json) {query}"), {'t': t}).scalar()
+            nested.commit()
+        except Exception as e:
+            nested.rollback()
+            results.append((what, None, f"not checked: {type(e).__name__}"))
+            continue
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        # the scans of tables; none at all if partition pruning has left nothing to read
+        scans = [node for node in plan_nodes(plan[0]['Plan']) if 'Relation Name' in node]
+        failed = [node for node in scans if not uses_time_key(node)]
+        results.append((what, not failed, ', '.join(sorted({describe(node) for node in scans})) or 'no scans (pruned)'))
+    con.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from sqlalchemy import create_engine
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+    con = create_engine(f'postgresql+psycopg2:{pg_uri}', connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    if '--create' in sys.argv[1:]:
+        for table in INDEXES:
+            ensure_indexes(con, table)
+        con.commit()
+
+    failed = 0
+    for what, passed, nodes in check(con):
+        print(f"{'ok  ' if passed else '-   ' if passed is None else 'FAIL'} {what}: {nodes}")
+        # a query that couldn't be checked fails the run too
+        failed += passed is not True
+    sys.exit(1 if failed else 0)
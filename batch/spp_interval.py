@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_interval.py - work out the current SPP market interval, and the pieces of it that go into
+# SPP file paths and names, in Python instead of with a database query per feed.
+#
+# The time basis is still the most recent gmt_mkt_interval in generation_mix (or any other
+# UTC timestamp, such as one read straight from a feed file).
+#
+# This replaces the old get_current_interval() query, which did the arithmetic on local
+# (America/Chicago) wall-clock time:
+#     interval_end_cpt = 5-minute floor of interval_cpt, plus 5 minutes
+#     hour_end_cpt     = hour floor of interval_cpt, plus 1 hour
+#     pathhour_end_cpt = hour floor of (interval_cpt + 5 minutes), plus 1 hour
+# Central time is a whole number of hours off UTC, so 5-minute and hour boundaries are the
+# same in both; here the floor math is done in UTC and only then converted to local time for
+# the path components. That keeps the DST changes right: in the spring the interval after
+# 01:55 CST is 03:00 CDT (not a 02:00 that never happened), and in the fall the repeated
+# 01:00-02:00 hour is walked through twice, once in CDT and once in CST, instead of jumping
+# from 01:55 CDT to 02:00 CST.
+#
+# Run this file directly to check the DST transitions and the STLF path quirk:
+#     python3 spp_interval.py
+
+import pandas as pd
+
+SPP_TIMEZONE = 'America/Chicago'
+
+
+class SppInterval:
+    # path components are zero-padded strings, ready to drop into a file path:
+    #   rt_yyyy, rt_mm, rt_dd, rt_hh24, rt_mi  - the 5-minute interval ending, local time
+    #   da_yyyy, da_mm, da_dd, da_hh24         - the hour ending, local time
+    #   pathda_hh24                            - the STLF folder hour (see below)
+
+    def __init__(self, gmt_mkt_interval):
+        t = pd.Timestamp(gmt_mkt_interval)
+        # naive timestamps from the database or a feed file are UTC
+        t = t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+
+        self.gmt_mkt_interval = t
+        self.interval_end = t.floor('5min') + pd.Timedelta(minutes=5)
+        self.hour_end = t.floor('h') + pd.Timedelta(hours=1)
+        # STLF files move to the next hour's folder 5 minutes early: at about 11:03,
+        #   /2023/03/02/11/OP-STLF-202303021100.csv was 404, but it was found at
+        #   /2023/03/02/12/OP-STLF-202303021100.csv
+        # and the 23:30 file is in the 00 folder of the same day:
+        #   /2023/03/01/00/OP-STLF-202303012330.csv
+        self.pathhour_end = (t + pd.Timedelta(minutes=5)).floor('h') + pd.Timedelta(hours=1)
+
+        self.interval_end_cpt = self.interval_end.tz_convert(SPP_TIMEZONE)
+        self.hour_end_cpt = self.hour_end.tz_convert(SPP_TIMEZONE)
+        pathhour_end_cpt = self.pathhour_end.tz_convert(SPP_TIMEZONE)
+
+        (self.rt_yyyy, self.rt_mm, self.rt_dd, self.rt_hh24, self.rt_mi) = \
+            self.interval_end_cpt.strftime('%Y %m %d %H %M').split()
+        (self.da_yyyy, self.da_mm, self.da_dd, self.da_hh24) = \
+            self.hour_end_cpt.strftime('%Y %m %d %H').split()
+        self.pathda_hh24 = pathhour_end_cpt.strftime('%H')
+
+    @property
+    def ambiguous(self):
+        # True in the hour repeated when DST ends: both passes through it have the same local
+        # path components, and only interval_end (UTC) tells them apart
+        wall = lambda t: t.tz_convert(SPP_TIMEZONE).strftime('%Y%m%d%H%M')
+        return wall(self.interval_end) in (wall(self.interval_end - pd.Timedelta(hours=1)),
+                                           wall(self.interval_end + pd.Timedelta(hours=1)))
+
+    @classmethod
+    def from_db(cls, con):
+        # one query per run: the most recent interval in generation_mix
+        from sqlalchemy import text
+        gmt_mkt_interval = con.execute(text("select max(gmt_mkt_interval) from generation_mix")).scalar()
+        return cls(gmt_mkt_interval)
+
+    def __repr__(self):
+        return (f"SppInterval(rt={self.rt_yyyy}-{self.rt_mm}-{self.rt_dd} {self.rt_hh24}:{self.rt_mi}, "
+                f"da={self.da_yyyy}-{self.da_mm}-{self.da_dd} {self.da_hh24}:00, pathda_hh24={self.pathda_hh24}, "
+                f"interval_end={self.interval_end.isoformat()})")
+
+
+if __name__ == "__main__":
+    # (gmt_mkt_interval, expected rt yyyymmddhh24mi, da yyyymmddhh24, pathda_hh24)
+    checks = [
+        # ordinary interval
+        ('2023-03-02 16:50Z', '202303021055', '2023030211', '11'),
+        # start-of-hour STLF quirk: 11:00 file is in the 12 folder
+        ('2023-03-02 16:55Z', '202303021100', '2023030211', '12'),
+        ('2023-03-02 17:00Z', '202303021105', '2023030212', '12'),
+        # end of day: the 23:30 STLF file is in the 00 folder of the same day
+        ('2023-03-02 05:25Z', '202303012330', '2023030200', '00'),
+        ('2023-03-02 05:55Z', '202303020000', '2023030200', '01'),
+        # DST starts 2023-03-12 02:00 CST -> 03:00 CDT
+        ('2023-03-12 07:50Z', '202303120155', '2023031203', '03'),
+        ('2023-03-12 07:55Z', '202303120300', '2023031203', '04'),
+        ('2023-03-12 08:00Z', '202303120305', '2023031204', '04'),
+        # DST ends 2023-11-05 02:00 CDT -> 01:00 CST; the 01:00 hour happens twice
+        ('2023-11-05 06:50Z', '202311050155', '2023110501', '01'),
+        ('2023-11-05 06:55Z', '202311050100', '2023110501', '02'),
+        ('2023-11-05 07:00Z', '202311050105', '2023110502', '02'),
+        ('2023-11-05 07:55Z', '202311050200', '2023110502', '03'),
+    ]
+    for gmt, rt, da, pathda in checks:
+        ci = SppInterval(gmt)
+        got = (ci.rt_yyyy + ci.rt_mm + ci.rt_dd + ci.rt_hh24 + ci.rt_mi,
+               ci.da_yyyy + ci.da_mm + ci.da_dd + ci.da_hh24,
+               ci.pathda_hh24)
+        print(('ok  ' if got == (rt, da, pathda) else 'FAIL'), gmt, ci)
+        assert got == (rt, da, pathda), (gmt, got, (rt, da, pathda))
+
+    # both passes through the repeated hour share path components
+    assert SppInterval('2023-11-05 06:05Z').ambiguous and SppInterval('2023-11-05 07:05Z').ambiguous
+    assert not SppInterval('2023-11-05 08:05Z').ambiguous and not SppInterval('2023-03-12 08:05Z').ambiguous
+    print('ok   repeated hour')
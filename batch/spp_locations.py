@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_locations.py - the settlement_location table, from settlement_node_location.csv, and an
+# in-process index of it.
+#
+# settlement_location holds, for every settlement location, an estimated latitude and longitude
+# and whether that was inferred from a resource, a load or something else; the map views join it
+# to the LMPs. It used to be loaded from the CSV by hand, with to_sql(if_exists='replace'), which
+# drops the table and so can't be done once views.sql has made the map views depend on it.
+#
+# sync() loads the CSV into the table without dropping it, in one transaction: the file is COPYed
+# into a temp table, and compared with the table by settlement location:
+#     new locations are inserted;
+#     locations whose values differ (IS DISTINCT FROM) are updated;
+#     locations no longer in the file are deleted (unless keep=True).
+# Unchanged rows aren't touched. The table's comment is set to a hash of the file, which index()
+# uses to tell that it has changed, and NOTIFY spp_loaded, 'settlement_location' tells spp_api.py
+# to drop its cached responses. In the Parquet store (spp_storage.py) the table's file is replaced
+# instead.
+#
+# index() is the table as a DataFrame indexed by settlement_location, with location_id (the
+# compact LMP tables' key, spp_compact.py; null if they aren't used), inferred_location_type,
+# est_latitude and est_longitude. It is read once per process, and again only when sync() has
+# changed the table or lmp_location has new ids (checking costs a catalog lookup). The loaders use
+# it to warn about LMP settlement locations the maps can't place; spp_api.py serves it as /locations.
+#
+# To load the CSV (after the notebook that makes it has been rerun):
+#     python3 spp_locations.py [--csv ../notebooks/settlement_node_location.csv] [--dry-run] [--keep]
+
+import hashlib
+import io
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+import spp_schema
+import spp_storage
+
+TABLE = 'settlement_location'
+CSV = '../notebooks/settlement_node_location.csv'
+COLUMNS = ['settlement_location', 'inferred_location_type', 'est_latitude', 'est_longitude']
+
+_lock = threading.Lock()
+_index = None       # the last index() read, for _version
+_version = None
+_warned = set()     # settlement locations check() has warned about in this process
+
+
+def read_csv(path=CSV):
+    # the CSV, with the table's column names, one row per settlement location
+    df = pd.read_csv(path)
+    df.columns = [spp_schema.snake(c) for c in df.columns]
+    df = df[COLUMNS]
+    duplicated = df.settlement_location.duplicated(keep='last')
+    if duplicated.any():
+        print(f"spp_locations: {path} has {duplicated.sum()} duplicated settlement locations; using the last of each")
+        df = df[~duplicated]
+    return df.reset_index(drop=True)
+
+
+def file_hash(df):
+    return hashlib.sha1(df.sort_values('settlement_location').to_csv(index=False).encode()).hexdigest()[:16]
+
+
+def create_table(con):
+    # as to_sql made it, with the primary key the notebook added
+    con.execute(text(f"""
+        create table if not exists {TABLE} (
+            settlement_location text not null,
+            inferred_location_type text,
+            est_latitude double precision,
+            est_longitude double precision,
+            constraint {TABLE}_pk primary key (settlement_location))"""))
+
+
+def sync(con, path=CSV, keep=False, dry_run=False):
+    # make the table match the CSV; returns {'rows', 'inserted', 'updated', 'deleted', 'unchanged'}.
+    # With dry_run, the changes are counted and rolled back.
+    df = read_csv(path)
+    if spp_storage.is_store(con):
+        return _sync_store(con, df, keep, dry_run)
+
+    create_table(con)
+    con.execute(text(f"create temp table {TABLE}_sync (like {TABLE}) on commit drop"))
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    con.connection.cursor().copy_expert(
+        f"copy pg_temp.{TABLE}_sync ({', '.join(COLUMNS)}) from stdin with (format csv)", buf)
+
+    values = COLUMNS[1:]
+    deleted = 0
+    if not keep:
+        deleted = con.execute(text(f"""
+            delete from {TABLE} t
+            where not exists (select 1 from pg_temp.{TABLE}_sync s where s.settlement_location = t.settlement_location)
+            """)).rowcount
+    updated = con.execute(text(f"""
+        update {TABLE} t
+        set {', '.join(f'{c} = s.{c}' for c in values)}
+        from pg_temp.{TABLE}_sync s
+        where s.settlement_location = t.settlement_location
+        and ({', '.join(f't.{c}' for c in values)}) is distinct from ({', '.join(f's.{c}' for c in values)})
+        """)).rowcount
+    inserted = con.execute(text(f"""
+        insert into {TABLE} select * from pg_temp.{TABLE}_sync
+        on conflict (settlement_location) do nothing""")).rowcount
+
+    result = {'rows': len(df.index), 'inserted': inserted, 'updated': updated, 'deleted': deleted,
+              'unchanged': len(df.index) - inserted - updated}
+    if dry_run:
+        con.rollback()
+    else:
+        con.execute(text(f"comment on table {TABLE} is '{file_hash(df)}'"))
+        con.execute(text("select pg_notify('spp_loaded', :table)"), {'table': TABLE})
+        con.commit()
+    print(f"spp_locations {path}: {result}{' (dry run, nothing changed)' if dry_run else ''}")
+    return result
+
+
+def _sync_store(con, df, keep, dry_run):
+    # the same, for the Parquet store: the table's one file is replaced
+    old = con.read_sql(f"select * from {TABLE}") if TABLE in con.tables else pd.DataFrame(columns=COLUMNS)
+    merged = old[COLUMNS].merge(df, on='settlement_location', how='outer', suffixes=('_old', ''), indicator=True)
+    both = merged[merged._merge == 'both']
+    changed = pd.Series(False, index=both.index)
+    for column in COLUMNS[1:]:
+        a, b = both[f'{column}_old'], both[column]
+        changed |= ~((a == b) | (a.isna() & b.isna()))
+    result = {'rows': len(df.index), 'inserted': int((merged._merge == 'right_only').sum()),
+              'updated': int(changed.sum()), 'deleted': 0 if keep else int((merged._merge == 'left_only').sum())}
+    result['unchanged'] = len(df.index) - result['inserted'] - result['updated']
+    if not dry_run and (result['inserted'] or result['updated'] or result['deleted']):
+        if keep:
+            df = pd.concat([old[~old.settlement_location.isin(df.settlement_location)][COLUMNS], df])
+        con.replace(TABLE, df)
+    print(f"spp_locations: {result}{' (dry run, nothing changed)' if dry_run else ''}")
+    return result
+
+
+def version(con):
+    # changes whenever the table, or the location ids, do; None if there is no table
+    if spp_storage.is_store(con):
+        return con.version(TABLE) if TABLE in con.tables else None
+    exists, comment, ids = con.execute(text(f"""
+        select to_regclass('{TABLE}') is not null, obj_description(to_regclass('{TABLE}'), 'pg_class'),
+               to_regclass('lmp_location') is not null""")).first()
+    if not exists:
+        return None
+    if ids:
+        # lmp_location only grows; a new settlement location there has a new, higher id
+        ids = con.execute(text("select max(location_id) from lmp_location")).scalar()
+    return (comment, ids)
+
+
+def _has_lmp_location(con):
+    return con.execute(text("select to_regclass('lmp_location') is not null")).scalar()
+
+
+def index(con):
+    # settlement_location -> location_id, inferred_location_type, est_latitude, est_longitude;
+    # read again only when version() changes
+    with _lock:
+        return _read_index(con)
+
+
+def _read_index(con):
+    global _index, _version
+    current = version(con)
+    if _index is not None and current == _version:
+        return _index
+    if current is None:
+        df = pd.DataFrame(columns=COLUMNS)
+    elif spp_storage.is_store(con):
+        df = con.read_sql(f"select {', '.join(COLUMNS)} from {TABLE}")
+    elif _has_lmp_location(con):
+        df = pd.read_sql(text(f"""
+            select s.*, l.location_id from {TABLE} s
+            left join lmp_location l using (settlement_location)"""), con)
+    else:
+        df = pd.read_sql(text(f"select * from {TABLE}"), con)
+    if 'location_id' not in df.columns:
+        df['location_id'] = pd.NA
+    df['location_id'] = df['location_id'].astype('Int16')
+    _index = df.set_index('settlement_location')[['location_id'] + COLUMNS[1:]]
+    _version = current
+    return _index
+
+
+def forget():
+    # read the index again next time
+    global _index
+    _index = None
+
+
+def check(con, df, feed):
+    # warn, once per process, about settlement locations in df that the map views can't place;
+    # returns their names
+    known = index(con)
+    missing = sorted(set(df['settlement_location'].unique()) - set(known.index) - _warned)
+    if missing and len(known.index):
+        _warned.update(missing)
+        print(f"spp_locations {feed}: {len(missing)} settlement locations aren't in {TABLE} and are left off the map: "
+              f"{', '.join(missing[:10])}{', ...' if len(missing) > 10 else ''}")
+    return missing
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="load settlement_node_location.csv into the settlement_location table")
+    parser.add_argument('--csv', default=CSV, help=f"the file to load (default {CSV})")
+    parser.add_argument('--keep', action='store_true', help="keep locations that are no longer in the file")
+    parser.add_argument('--dry-run', action='store_true', help="count the changes, but don't make them")
+    args = parser.parse_args()
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    if spp_storage.uses_duckdb(di):
+        con = spp_storage.ParquetStore(di.get('path', spp_storage.DEFAULT_PATH))
+    else:
+        pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+        con = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                            connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    sync(con, args.csv, keep=args.keep, dry_run=args.dry_run)
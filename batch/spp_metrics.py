@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_metrics.py - per-feed, per-stage timings and counts for the fetch and cleanup runs.
+#
+# The cron logs have a date line before and after each run and whatever the scripts print in
+# between. This keeps, for each feed in a run:
+#     source          how the file was got: downloaded, cache, not modified, same content,
+#                     already loaded
+#     download_bytes  bytes downloaded (including a download that turned out the same)
+#     download_s      time in spp_fetch.fetch (the request, and the download if there was one)
+#     cache_s         time reading spp_cache
+#     parse_s         time in spp_schema.parse
+#     rows, new_rows  rows in the file, and newer than the table's watermark
+#     inserted, skipped   rows pg_insertnew inserted, and skipped as already there
+#     updated         rows pg_upsert rewrote because their values changed (its skipped are unchanged)
+#     insert_s        time in pg_insertnew; load_s and refresh_s, the whole load and the
+#                     dashboard refresh, are the feed's database time
+#     grid_s          time making and keeping the LMP feeds' map grids (spp_grid.py)
+# and for cleanup, the rows deleted or partitions dropped and the time for each table. The RTBM
+# poller (--daemon mode) adds a line, as job rtbm_latest, for each interval it loads, with how long
+# after SPP published it the interval was in the database (see fetch_spp_data_batch.py).
+#
+# After each run, write_run() appends one JSON object to METRICS_FILE (metrics.jsonl in the
+# working directory, or $SPP_METRICS_FILE):
+#     {"time": "...", "job": "fetch", "total_s": 12.3, "budget_s": 300, "over_budget": false,
+#      "feeds": {"rtbm_lmp": {"status": "loaded", "download_bytes": 123456, ...}, ...}}
+# A fetch run that takes longer than BUDGET_S (the 5 minutes until the next one) is flagged
+# there, and in the log.
+#
+# If $SPP_METRICS_PROM_DIR is set (node_exporter's --collector.textfile.directory), it also
+# writes spp_<job>.prom there, in the Prometheus text format, with the latest value for every
+# feed the process has run: spp_seconds{job,name,stage}, spp_rows{job,name,kind}, spp_ok,
+# spp_run_seconds, spp_run_over_budget and so on.
+#
+# Values are recorded for the feed being loaded on the current thread (feed(), in run_all), or
+# for a feed named explicitly (read_feed, which runs on the download threads).
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_FILE = os.environ.get('SPP_METRICS_FILE', 'metrics.jsonl')
+PROM_DIR = os.environ.get('SPP_METRICS_PROM_DIR')
+BUDGET_S = 300
+
+# keys counted in rows; other numbers are seconds (ending _s) or their own metric
+ROW_KINDS = {'rows': 'in', 'new_rows': 'new', 'inserted': 'inserted', 'updated': 'updated', 'skipped': 'skipped',
+             'deleted': 'deleted'}
+
+_lock = threading.Lock()
+_local = threading.local()
+_feeds = {}         # feed -> {key: value} for the current run
+_prom = {}          # job -> {name: row}, the latest row for each name, for the .prom file
+
+
+def reset():
+    # start a new run
+    with _lock:
+        _feeds.clear()
+
+
+@contextmanager
+def feed(name):
+    # record values without a feed name, on this thread, for feed name
+    previous = getattr(_local, 'feed', None)
+    _local.feed = name
+    try:
+        yield
+    finally:
+        _local.feed = previous
+
+
+def add(feed=None, **values):
+    # add numbers to the feed's values
+    feed = feed or getattr(_local, 'feed', None)
+    if feed is None:
+        return
+    with _lock:
+        row = _feeds.setdefault(feed, {})
+        for key, value in values.items():
+            row[key] = row.get(key, 0) + value
+
+
+def note(feed=None, **values):
+    # set the feed's values
+    feed = feed or getattr(_local, 'feed', None)
+    if feed is None:
+        return
+    with _lock:
+        _feeds.setdefault(feed, {}).update(values)
+
+
+def get(feed):
+    with _lock:
+        return dict(_feeds.get(feed, {}))
+
+
+@contextmanager
+def timer(key, feed=None):
+    # add the time the block takes to the feed's key
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(feed, **{key: time.perf_counter() - start})
+
+
+def _clean(value):
+    # numpy numbers and the like as plain JSON values; times to the millisecond
+    if isinstance(value, float):
+        return round(value, 4)
+    if hasattr(value, 'item'):
+        return _clean(value.item())
+    return value
+
+
+def write_run(job, report, total_s, budget_s=None):
+    # record a finished run: report is {name: {key: value}}; returns the record written
+    over_budget = budget_s is not None and total_s > budget_s
+    record = {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'job': job,
+              'total_s': round(total_s, 3), 'budget_s': budget_s, 'over_budget': over_budget,
+              'feeds': {name: {k: _clean(v) for k, v in row.items()} for name, row in report.items()}}
+    if over_budget:
+        print(f"spp_metrics {job}: took {total_s:.1f}s, over the {budget_s}s budget")
+    try:
+        with open(METRICS_FILE, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+        if PROM_DIR:
+            write_prom(job, record)
+    except OSError as e:
+        # metrics are never a reason for a run to fail
+        print(f"spp_metrics {job}: could not write metrics: {e!r}")
+    return record
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_prom(job, record):
+    # write PROM_DIR/spp_<job>.prom for node_exporter's textfile collector, atomically
+    with _lock:
+        rows = _prom.setdefault(job, {})
+        rows.update(record['feeds'])
+        rows = dict(rows)
+
+    metrics = {}        # name -> [(labels, value)]
+
+    def put(metric, labels, value):
+        labels = ','.join(f'{k}="{_label(v)}"' for k, v in {'job': job, **labels}.items())
+        metrics.setdefault(metric, []).append((labels, value))
+
+    put('spp_run_seconds', {}, record['total_s'])
+    put('spp_run_over_budget', {}, int(record['over_budget']))
+    put('spp_run_timestamp_seconds', {}, int(time.time()))
+    for name, row in sorted(rows.items()):
+        status = str(row.get('status', ''))
+        put('spp_ok', {'name': name}, int(not status.startswith('failed')))
+        for key, value in sorted(row.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in ROW_KINDS:
+                put('spp_rows', {'name': name, 'kind': ROW_KINDS[key]}, value)
+            elif key.endswith('_s'):
+                put('spp_seconds', {'name': name, 'stage': key[:-2]}, value)
+            else:
+                put(f'spp_{key}', {'name': name}, value)
+
+    lines = []
+    for metric, samples in metrics.items():
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{{{labels}}} {value}" for labels, value in samples)
+    path = os.path.join(PROM_DIR, f"spp_{job}.prom")
+    with open(path + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
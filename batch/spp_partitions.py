@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_partitions.py - daily range partitions for the biggest tables, so old data can be
+# dropped a day at a time instead of deleted a row at a time.
+#
+# cleanup_old_data_batch.py used to run, every hour,
+#     delete from <table> where <timekey> < current_timestamp - interval '2 weeks'
+#     vacuum (analyze) <table>
+# which on the LMP tables means tens of thousands of dead tuples and a pass over the whole
+# table to clean them up. With one partition per UTC day, retention is
+#     alter table <table> detach partition <table>_pYYYYMMDD; drop table <table>_pYYYYMMDD
+# which removes a whole day's file without touching any other row.
+#
+# The loader (pg_insertnew in fetch_spp_data_batch.py) calls ensure_partitions() before each
+# load; it creates the partitions for the days in the data, and for today and the next AHEAD
+# days, the first time each one is needed in a session. Partitions are named after the UTC day
+# they hold: rtbm_lmp_by_location_p20230302 holds gmtinterval_end from 2023-03-02 00:00 UTC up
+# to (not including) 2023-03-03 00:00 UTC. There is no default partition, so a row for a day
+# with no partition is an error rather than something that quietly lands outside retention.
+#
+# New tables are created partitioned. Tables created before this change are converted with
+#     python3 spp_partitions.py --migrate
+# which, for each table below that is not yet partitioned, in one transaction:
+#   * renames the table to <table>_unpartitioned
+#   * creates <table> partitioned by day, with the same columns, defaults and primary key
+#   * creates the partitions and copies the rows across
+#   * drops <table>_unpartitioned and recreates the views (from views.sql) that used it, with
+#     the table's and the views' comments and grants. Nothing is dropped with cascade: anything
+#     else built on the table or those views (a view of a view, say) stops the migration, and
+#     has to be dropped first and recreated after
+# Run it with the fetch daemon stopped. Until a table is migrated the loader keeps loading
+# it as before, and cleanup keeps trimming it with delete.
+#
+# Run without --migrate to list the tables and their partitions.
+
+import re
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from sqlalchemy import text
+
+# table -> partition key; the key must be part of the table's primary key
+PARTITIONED = {
+    'rtbm_lmp_by_location': 'gmtinterval_end',
+    'da_lmp_by_location': 'gmtinterval_end',
+    'tie_flows_long': 'gmttime',
+    'rtbm_binding_constraints': 'gmtinterval_end',
+    # the compact LMP tables (spp_compact.py) are created partitioned
+    'rtbm_lmp_by_location_id': 'gmtinterval_end',
+    'da_lmp_by_location_id': 'gmtinterval_end',
+}
+
+# days after today to create partitions for; DA LMP is published for the next day
+AHEAD = 2
+
+# (table, day) partitions known to exist in this session
+_ready = set()
+
+
+def relkind(con, table):
+    # 'p' for a partitioned table, 'r' for a plain one, None if there is no such table
+    return con.execute(text("select relkind from pg_class where oid = to_regclass(:t)"),
+                       {'t': table}).scalar()
+
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def partitions(con, table):
+    # {day: partition name} for the partitions of table that follow our naming
+    names = con.execute(text("""
+        select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid
+        where i.inhparent = to_regclass(:t)"""), {'t': table}).scalars()
+    days = {}
+    for name in names:
+        m = re.fullmatch(re.escape(table) + r'_p(\d{8})', name)
+        if m:
+            days[datetime.strptime(m.group(1), '%Y%m%d').date()] = name
+    return days
+
+
+def _create_partition(con, table, day):
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    con.execute(text(f"""
+        create table if not exists {partition_name(table, day)} partition of {table}
+        for values from ('{start.isoformat()}') to ('{(start + timedelta(days=1)).isoformat()}')"""))
+    _ready.add((table, day))
+
+
+def forget():
+    # after a rollback: partitions created in the transaction are gone, so read the catalog again.
+    # (a new set, rather than clear(), for a loader in another lane that is iterating the old one)
+    global _ready
+    _ready = set()
+
+
+def ensure_partitions(con, table, times=(), commit=True):
+    # make sure table has partitions for every UTC day in times, and for today and AHEAD days after;
+    # only the first call for a table in a session reads the catalog
+    if not any(t == table for t, _ in _ready):
+        _ready.update((table, day) for day in partitions(con, table))
+
+    today = datetime.now(timezone.utc).date()
+    days = {today + timedelta(days=n) for n in range(AHEAD + 1)}
+    if len(times):
+        times = pd.to_datetime(pd.Series(times), utc=True).dropna()
+        days.update(times.dt.floor('D').dt.date.unique())
+
+    missing = sorted(day for day in days if (table, day) not in _ready)
+    for day in missing:
+        _create_partition(con, table, day)
+    if missing:
+        if commit:
+            con.commit()
+        print(f"spp_partitions {table}: created partitions for {', '.join(str(d) for d in missing)}")
+
+
+def drop_old_partitions(con, table, older_than):
+    # detach and drop the partitions whose whole day is older than older_than (a Postgres
+    # interval, as in '2 weeks'); returns the names dropped.
+    # Detach is CONCURRENTLY (no lock that blocks the loader) when the server is 14 or later
+    # and con is in autocommit mode, as the cleanup script's connection is.
+    cutoff = con.execute(text("select current_timestamp - cast(:i as interval)"), {'i': older_than}).scalar()
+    concurrently = (int(con.execute(text("show server_version_num")).scalar()) >= 140000
+                    and con.connection.dbapi_connection.autocommit)
+    dropped = []
+    for day, name in sorted(partitions(con, table).items()):
+        if datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1) > cutoff:
+            break
+        con.execute(text(f"alter table {table} detach partition {name}{' concurrently' if concurrently else ''}"))
+        con.execute(text(f"drop table {name}"))
+        con.commit()
+        _ready.discard((table, day))
+        dropped.append(name)
+    return dropped
+
+
+def dependent_views(con, table):
+    # [(oid, name, definition, settings)] of the views that read table, in creation order; raises
+    # ValueError if anything else is built on them or on table (a view of one of these views, a
+    # materialized view), which replacing table would otherwise lose
+    views = con.execute(text("""
+        select distinct v.oid, v.relname, pg_get_viewdef(v.oid) from pg_depend d
+        join pg_rewrite r on r.oid = d.objid
+        join pg_class v on v.oid = r.ev_class
+        where d.refobjid = to_regclass(:t) and v.relkind = 'v' and v.oid <> d.refobjid
+        order by v.oid"""), {'t': table}).fetchall()
+    others = con.execute(text("""
+        with recursive dependent (oid) as (
+            select to_regclass(:t)::oid
+            union
+            select r.ev_class from dependent
+            join pg_depend d on d.refobjid = dependent.oid
+            join pg_rewrite r on r.oid = d.objid
+            where r.ev_class <> d.refobjid)
+        select relname from pg_class
+        where oid in (select oid from dependent) and oid <> to_regclass(:t) and not (oid = any(:views))
+        order by oid"""), {'t': table, 'views': [v[0] for v in views]}).scalars().all()
+    if others:
+        raise ValueError(f"{table}: {', '.join(others)} depend on it (or on its views); drop them first, "
+                         f"and create them again afterwards")
+    return [(oid, name, definition, settings(con, name)) for oid, name, definition in views]
+
+
+def settings(con, name):
+    # (comment, [grants]) of a table or view, to give the relation that replaces it; the grants
+    # are 'select to reader'-style clauses (the owner's own privileges come with ownership)
+    comment = con.execute(text("""
+        select quote_literal(obj_description(to_regclass(:t), 'pg_class'))"""), {'t': name}).scalar()
+    grants = con.execute(text("""
+        select format('%s on %s to %s%s', a.privilege_type, c.oid::regclass,
+                      case a.grantee when 0 then 'public' else quote_ident(pg_get_userbyid(a.grantee)) end,
+                      case when a.is_grantable then ' with grant option' else '' end)
+        from pg_class c cross join lateral aclexplode(c.relacl) a
+        where c.oid = to_regclass(:t) and a.grantee <> c.relowner"""), {'t': name}).scalars().all()
+    return comment, grants
+
+
+def restore_settings(con, name, saved):
+    # give name the comment and grants settings() saved from the relation it replaces
+    comment, grants = saved
+    if comment is not None:
+        con.execute(text(f"comment on {'view' if relkind(con, name) == 'v' else 'table'} {name} is {comment}"))
+    for grant in grants:
+        con.execute(text(f"grant {grant}"))
+
+
+def drop_views(con, views):
+    # drop views saved by dependent_views(), newest first; without cascade, so that anything that
+    # has come to depend on them since stops the migration instead of being dropped with them
+    for _, name, _, _ in reversed(views):
+        con.execute(text(f"drop view {name}"))
+
+
+def recreate_views(con, views):
+    # put back views saved by dependent_views() after their table was dropped and replaced
+    for _, name, definition, saved in views:
+        con.execute(text(f"create view {name} as {definition}"))
+        restore_settings(con, name, saved)
+
+
+def migrate(con, table):
+    # convert plain table to one partitioned by day on PARTITIONED[table], keeping rows, primary
+    # key, comment, grants and dependent views; returns False if there was nothing to do
+    key = PARTITIONED[table]
+    if relkind(con, table) != 'r':
+        return False
+
+    pk = con.execute(text("""
+        select conname, pg_get_constraintdef(oid) from pg_constraint
+        where conrelid = to_regclass(:t) and contype = 'p'"""), {'t': table}).first()
+    if pk is None or not re.search(rf'\b{key}\b', pk[1]):
+        raise ValueError(f"{table}: primary key {pk and pk[1]} must include the partition key {key}")
+    pk_name, pk_def = pk
+
+    # their definitions have to be read before the rename, after which they would name the old table
+    views = dependent_views(con, table)
+    saved = settings(con, table)
+
+    old = f"{table}_unpartitioned"
+    print(f"spp_partitions {table}: migrating to daily partitions on {key}")
+    con.execute(text(f"alter table {table} rename to {old}"))
+    con.execute(text(f"alter table {old} rename constraint {pk_name} to {pk_name}_unpartitioned"))
+    con.execute(text(f"create table {table} (like {old} including defaults) partition by range ({key})"))
+    con.execute(text(f"alter table {table} add constraint {pk_name} {pk_def}"))
+
+    first, last = con.execute(text(f"select min({key}), max({key}) from {old}")).first()
+    if first is not None:
+        ensure_partitions(con, table, pd.date_range(pd.Timestamp(first).floor('D'), last, freq='D'), commit=False)
+    else:
+        ensure_partitions(con, table, commit=False)
+    copied = con.execute(text(f"insert into {table} select * from {old}")).rowcount
+
+    # without cascade: anything but the views saved above stops the migration (see dependent_views)
+    drop_views(con, views)
+    con.execute(text(f"drop table {old}"))
+    restore_settings(con, table, saved)
+    recreate_views(con, views)
+    con.execute(text(f"analyze {table}"))
+    con.commit()
+    print(f"spp_partitions {table}: copied {copied} rows; recreated views {', '.join(v[1] for v in views) or '(none)'}")
+    return True
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from sqlalchemy import create_engine
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+    con = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                        connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    for table in PARTITIONED:
+        if '--migrate' in sys.argv[1:]:
+            try:
+                migrate(con, table)
+            except Exception:
+                con.rollback()
+                raise
+        kind = {'p': 'partitioned', 'r': 'not partitioned', 'v': 'a view (see spp_compact.py)',
+                None: 'does not exist'}[relkind(con, table)]
+        days = sorted(partitions(con, table))
+        print(f"{table}: {kind}" + (f", {len(days)} partitions {days[0]} to {days[-1]}" if days else ''))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_publication.py - when each feed's files are published, and when to fetch them.
+#
+# The daemon used to fetch every feed at a fixed time: the 5-minute feeds at 3 minutes 17
+# seconds past (the old cron schedule), MTLF at 4 minutes past the hour, DA at 6 minutes past
+# midnight. A file that wasn't there yet was a 404 (STLF, which moves to the next hour's folder
+# early, RTBM when it doesn't solve), or an unchanged rolling file, and waited for a retry or the
+# next run; one published just after the fetch was most of an interval old when it was loaded.
+#
+# Instead, each time a feed loads a file the daemon records, in the feed_publication table:
+#     cycle_start     the start of the cadence (5 minutes, hour, day) the file was published in;
+#                     for RTBM, the end of the interval in it
+#     published       when SPP published it: Last-Modified (HTTP) or MDTM (FTP), if given
+#     first_seen      when the fetch that got it finished
+#     offset_s        from cycle_start to published, or to first_seen when published isn't known
+# plan() turns the last HISTORY of a feed's offsets into when to fetch it: the first attempt just
+# after the median offset, then a ladder of retries at the QUANTILES after it. A job whose files
+# aren't there yet raises spp_scheduler.NotYet, and is retried at the next step of the ladder, not
+# backed off. Until a feed has MIN_SAMPLES offsets, its job keeps its fixed time. (A source that
+# gives no modification time can only be timed by when it was fetched, so its plan can't get much
+# earlier than where it is fetched now.)
+#
+# To see the offsets, each job's plan, and what the plan would have done over the recorded
+# history compared with the fixed time (early fetches, such as 404s, per file, and how old the
+# data was when it was fetched):
+#     python3 spp_publication.py [--days 7]
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import spp_storage
+
+TABLE = 'feed_publication'
+HISTORY = timedelta(days=7)
+MIN_SAMPLES = 12
+# the first attempt, and then the retries, just after these quantiles of the publication offsets
+QUANTILES = [0.5, 0.8, 0.95, 1.0]
+MARGIN = timedelta(seconds=3)
+
+# feed -> (cadence, the fixed offset the daemon used before), for the comparison
+FIXED = {
+    'generation_mix': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'ace': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'rtbm_lmp': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'stlf': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'tie_flows_long': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'rt_binding': (timedelta(minutes=5), timedelta(minutes=3, seconds=17)),
+    'mtlf': (timedelta(hours=1), timedelta(minutes=4)),
+    'da_lmp': (timedelta(days=1), timedelta(minutes=6)),
+}
+# feeds fetched by a name that is only there once it is published; a 404 was retried with the
+# scheduler's backoff (from retry_first, doubling), where a rolling file waited for the next run
+BY_NAME = {'rtbm_lmp', 'stlf', 'mtlf', 'da_lmp'}
+
+
+def record(con, feed, cycle_start, published, first_seen):
+    # remember when a file of feed was published; returns the offset in seconds
+    offset = ((published or first_seen) - cycle_start).total_seconds()
+    row = {'cycle_start': cycle_start, 'feed': feed, 'published': published, 'first_seen': first_seen,
+           'offset_s': offset}
+    if spp_storage.is_store(con):
+        df = pd.DataFrame([row])
+        for column in ('cycle_start', 'published', 'first_seen'):
+            df[column] = pd.to_datetime(df[column], utc=True)
+        con.insertnew(TABLE, ['cycle_start', 'feed'], df)
+        return offset
+    con.execute(text(f"""
+        create table if not exists {TABLE} (
+            cycle_start timestamptz not null, feed text not null, published timestamptz,
+            first_seen timestamptz not null, offset_s double precision not null,
+            primary key (cycle_start, feed))"""))
+    con.execute(text(f"""
+        insert into {TABLE} (cycle_start, feed, published, first_seen, offset_s)
+        values (:cycle_start, :feed, :published, :first_seen, :offset_s)
+        on conflict do nothing"""), row)
+    con.commit()
+    return offset
+
+
+def offsets(con, feeds=None, history=HISTORY):
+    # {feed: array of offset seconds} over the last history, oldest first
+    try:
+        df = spp_storage.read_sql(con, text(f"""
+            select feed, offset_s from {TABLE}
+            where cycle_start > current_timestamp - cast(:history as interval)
+            order by cycle_start"""), {'history': f"{int(history.total_seconds())} seconds"})
+    except Exception:
+        if not spp_storage.is_store(con):
+            con.rollback()
+        return {}   # nothing recorded yet
+    return {feed: group.offset_s.to_numpy() for feed, group in df.groupby('feed')
+            if feeds is None or feed in feeds}
+
+
+def ladder(samples, every, quantiles=QUANTILES):
+    # the offset to fetch at for each quantile of a feed's publication offsets (in seconds)
+    cap = every.total_seconds() - 1
+    return [timedelta(seconds=round(min(np.quantile(samples, q) + MARGIN.total_seconds(), cap), 1))
+            for q in quantiles]
+
+
+def plan(con, feeds, every, default, quantiles=QUANTILES):
+    # (offset of the first attempt, [offsets of the retries]) for a job that fetches feeds every
+    # every; with several feeds, each step waits for the slowest of them. (default, []) until
+    # each feed has MIN_SAMPLES offsets.
+    recorded = offsets(con, feeds)
+    if any(len(recorded.get(feed, [])) < MIN_SAMPLES for feed in feeds):
+        return default, []
+    steps = sorted({max(step) for step in zip(*(ladder(recorded[feed], every, quantiles) for feed in feeds))})
+    return steps[0], steps[1:]
+
+
+def simulate(samples, every, attempts):
+    # (early fetches per file, mean age in seconds when fetched) if each cycle fetched at the
+    # attempts offsets, stopping at the first one after publication; a file published after the
+    # last attempt is fetched at the first attempt of the next cycle
+    every = every.total_seconds()
+    attempts = [a.total_seconds() for a in attempts]
+    early = ages = 0
+    for offset in samples:
+        later = [a for a in attempts if a >= offset]
+        if later:
+            early += len(attempts) - len(later)
+            ages += later[0] - offset
+        else:
+            early += len(attempts)
+            ages += every + attempts[0] - offset
+    return early / len(samples), ages / len(samples)
+
+
+def fixed_attempts(feed, every, fixed, retry_first=timedelta(seconds=30)):
+    # the offsets the daemon fetched feed at before, within a cadence
+    attempts, delay = [fixed], retry_first
+    while feed in BY_NAME and attempts[-1] + delay < fixed + every:
+        attempts.append(attempts[-1] + delay)
+        delay = min(delay * 2, every)
+    return attempts
+
+
+def compare(con, history=HISTORY):
+    # one row per feed: its offsets, its plan, and the fixed time and the plan over the history
+    rows = []
+    for feed, samples in sorted(offsets(con, history=history).items()):
+        every, fixed = FIXED.get(feed, (timedelta(minutes=5), timedelta(minutes=3, seconds=17)))
+        steps = sorted(set(ladder(samples, every))) if len(samples) >= MIN_SAMPLES else [fixed]
+        fixed_early, fixed_age = simulate(samples, every, fixed_attempts(feed, every, fixed))
+        learned_early, learned_age = simulate(samples, every, steps)
+        rows.append({'feed': feed, 'files': len(samples), 'p50_s': np.quantile(samples, 0.5),
+                     'p95_s': np.quantile(samples, 0.95), 'max_s': samples.max(),
+                     'plan': ', '.join(f"{step.total_seconds():.0f}s" for step in steps),
+                     'fixed_early': fixed_early, 'fixed_age_s': fixed_age,
+                     'learned_early': learned_early, 'learned_age_s': learned_age})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="show when each feed is published, and the fetch plan learned from it")
+    parser.add_argument('--days', type=float, default=HISTORY.days, help="days of history to use (default 7)")
+    args = parser.parse_args()
+
+    # read the database information from the json file
+    with open('../dbconn.json', 'r') as f:
+        di = json.load(f)
+    if spp_storage.uses_duckdb(di):
+        con = spp_storage.ParquetStore(di.get('path', spp_storage.DEFAULT_PATH))
+    else:
+        pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+        con = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                            connect_args={'options': '-c search_path=sppdata'}).connect()
+
+    df = compare(con, timedelta(days=args.days))
+    if len(df.index) == 0:
+        print(f"nothing in {TABLE} yet; the fetch daemon records it as it loads")
+    else:
+        print(df.round(2).to_string(index=False))
+        print("early: fetches before the file was there (a 404 or an unchanged file), per file; "
+              "age: from publication to the fetch that got it")
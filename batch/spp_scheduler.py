@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_scheduler.py - a small in-process scheduler for the long-running fetch daemon.
+#
+# Each job runs on its own cadence (every 5 minutes, every hour, every day), at a fixed
+# offset after each cadence boundary, plus a little random jitter so requests don't all
+# land on SPP on the same second. A job that raises is retried with exponential backoff,
+# never waiting longer than its cadence, and goes back to its normal schedule when it
+# succeeds.
+#
+# A job can have a plan instead of a fixed offset: a function returning (offset, [retry
+# offsets]), asked again at each cadence boundary (spp_publication.plan learns it from when the
+# files have been published). A job that raises NotYet, because what it fetches isn't published
+# yet, is run again at the next of those retry offsets; once they have all passed, or if there
+# are none, NotYet is a failure (backed off as above) if it says the files are missing, and
+# otherwise the job waits for its next boundary.
+#
+# Jobs run one at a time on the calling thread (they share the database connection, and
+# spp_metrics' counters), so a job that polls holds the others up. It should sleep with wait(),
+# which returns early when the scheduler is stopping, and stop polling when next_other() is due:
+# raising NotYet(again=when) runs it again then, after the job it made way for (of two jobs due
+# at the same time, the one that started longest ago runs first).
+# stop(), or SIGTERM/SIGINT once install_signal_handlers() has been called, lets the
+# running job finish and then returns from run().
+
+import random
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+
+class NotYet(Exception):
+    # raised by a job whose source isn't published yet; missing: a 404, rather than an
+    # unchanged file (see the top of this file); again: when to run it again, instead
+    def __init__(self, message, missing=False, again=None):
+        super().__init__(message)
+        self.missing = missing
+        self.again = again
+
+
+def cycle_start(t, every, tz=pytz.timezone('America/Chicago')):
+    # the cadence boundary at or before t: local midnight for daily cadences (the same local
+    # time on both sides of a DST change), otherwise a multiple of every since UTC midnight
+    # (5-minute and hourly boundaries are the same in UTC and Central time)
+    if every >= timedelta(days=1):
+        local = t.astimezone(tz).replace(tzinfo=None)
+        return tz.localize(datetime(local.year, local.month, local.day)).astimezone(timezone.utc)
+    midnight = datetime(t.year, t.month, t.day, tzinfo=timezone.utc)
+    return midnight + every * ((t - midnight) // every)
+
+
+class Job:
+    def __init__(self, name, func, every, offset=timedelta(0), jitter=timedelta(0),
+                 retry_first=timedelta(seconds=30), tz='America/Chicago', plan=None):
+        self.name = name
+        self.func = func
+        self.every = every
+        self.offset = offset
+        self.jitter = jitter
+        self.retry_first = retry_first
+        self.tz = pytz.timezone(tz)
+        self.plan = plan
+        self.failures = 0
+        self.next_run = None
+        self.last_result = None
+        self.cycle = None           # the boundary of the current cadence
+        self.current_offset = offset
+        self.retries = []           # retry offsets left in this cadence
+        self.started = 0.0          # time.perf_counter() when it last started
+
+    def schedule_next(self, now, not_yet=None):
+        if not_yet is not None and not_yet.again is not None:
+            self.next_run = not_yet.again
+            return
+        if not_yet is not None:
+            while self.retries and self.cycle + self.retries[0] <= now:
+                self.retries.pop(0)
+            if self.retries:
+                self.current_offset = self.retries.pop(0)
+                self.next_run = self.cycle + self.current_offset
+                return
+            self.failures = self.failures + 1 if not_yet.missing else 0
+        if self.failures:
+            delay = min(self.retry_first * 2 ** (self.failures - 1), self.every)
+            self.next_run = now + delay
+            return
+        offset, self.retries = self.offset, []
+        if self.plan is not None:
+            try:
+                offset, self.retries = self.plan()
+            except Exception as e:
+                print(f"{datetime.now()} scheduler: {self.name} plan failed, using {self.offset}: {e!r}")
+        self.cycle = cycle_start(now - offset, self.every, self.tz)
+        while self.cycle + offset <= now:
+            self.cycle = cycle_start(self.cycle + self.every + timedelta(hours=2), self.every, self.tz) \
+                if self.every >= timedelta(days=1) else self.cycle + self.every
+        self.current_offset = offset
+        jitter = timedelta(seconds=random.uniform(0, self.jitter.total_seconds()))
+        self.next_run = self.cycle + offset + jitter
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs = []
+        self.running = None
+        self._stop = threading.Event()
+
+    def add(self, name, func, every, **kwargs):
+        job = Job(name, func, every, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    def stop(self, *args):
+        print(f"{datetime.now()} scheduler: stopping after the current job")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    @property
+    def stopping(self):
+        return self._stop.is_set()
+
+    def wait(self, seconds):
+        # sleep, for a job that polls; True if the scheduler is stopping, and the job should return
+        return self._stop.wait(seconds)
+
+    def next_other(self):
+        # the job due to run next after the one that is running, or None
+        others = [job for job in self.jobs if job is not self.running]
+        return min(others, key=lambda j: (j.next_run, j.started)) if others else None
+
+    def run(self, run_now=True):
+        now = datetime.now(timezone.utc)
+        for job in self.jobs:
+            if run_now:
+                job.next_run = now
+            else:
+                job.schedule_next(now)
+
+        while not self._stop.is_set():
+            job = min(self.jobs, key=lambda j: (j.next_run, j.started))
+            wait = (job.next_run - datetime.now(timezone.utc)).total_seconds()
+            if wait > 0 and self._stop.wait(wait):
+                break
+
+            start = job.started = time.perf_counter()
+            self.running = job
+            not_yet = None
+            try:
+                job.last_result = job.func()
+                job.failures = 0
+                status = 'ok'
+            except NotYet as e:
+                not_yet = e
+                status = f"not published yet ({e})"
+            except Exception as e:
+                job.failures += 1
+                status = f"failed ({job.failures} in a row): {e!r}"
+                traceback.print_exc()
+            self.running = None
+            job.schedule_next(datetime.now(timezone.utc), not_yet)
+            print(f"{datetime.now()} scheduler: {job.name} {status} in {time.perf_counter() - start:.1f}s; "
+                  f"next at {job.next_run.astimezone(job.tz):%H:%M:%S}")
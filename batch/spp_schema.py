@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_schema.py - what each SPP source file looks like, and a parser that uses it.
+#
+# The fetch_* functions used to call pd.read_csv(parse_dates=[...], infer_datetime_format=True),
+# which guesses the timestamp format row by row (and is deprecated), reads everything else as
+# object or float64 by inference, and then ran regex renames over the columns on every run. Here
+# each feed declares, once:
+#   * its timestamp columns and their format; MDY ('03/02/2023 17:05:00') columns are UTC
+#     without a zone, ISO ('2023-03-02T17:05:00Z') columns may carry one
+#   * the dtypes of the columns whose type is known
+#   * columns to rename or drop (the local-time Interval column is redundant with the UTC one)
+# and parse(feed, file) returns a frame with snake_case column names and UTC timestamps, ready
+# to load. Columns that aren't declared (the generation mix fuels, the tie flow areas) are still
+# read, with inferred types, and renamed with snake(), whose results are cached.
+#
+# With pyarrow installed, files are read with its multithreaded CSV reader; the big DA LMP day
+# file is read in blocks and converted to pandas a block at a time, so the whole file never has
+# to be held both as text and as Python objects. Without pyarrow, pandas' C parser is used with
+# the declared dtypes (and chunksize for the DA file).
+#
+# To compare the old and new parsers on a saved sample file (parse time and peak memory):
+#     python3 spp_schema.py DA-LMP-SL-202303020100.csv [da_lmp]
+
+import re
+import io
+from functools import lru_cache
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+MDY = '%m/%d/%Y %H:%M:%S'
+ISO = 'ISO8601'
+
+# rows per chunk (pandas) and bytes per block (pyarrow) for chunked feeds
+CHUNK_ROWS = 100000
+BLOCK_BYTES = 8 * 1024 * 1024
+
+
+class FeedSchema:
+    def __init__(self, timestamps, dtypes=None, rename=None, drop=(), chunked=False, snake_case=True):
+        self.timestamps = timestamps        # source column -> MDY or ISO
+        self.dtypes = dtypes or {}          # source column -> pandas dtype
+        self.rename = rename or {}          # source column -> name, before snake()
+        self.drop = list(drop)
+        self.chunked = chunked
+        self.snake_case = snake_case        # False: only rename the columns in rename
+
+
+LMP = dict(
+    timestamps={'GMTIntervalEnd': MDY},
+    dtypes={'Settlement Location': 'str', 'Pnode': 'str',
+            'LMP': 'float64', 'MLC': 'float64', 'MCC': 'float64', 'MEC': 'float64'},
+    drop=['Interval'],
+)
+
+SCHEMAS = {
+    'generation_mix': FeedSchema(timestamps={'GMT MKT Interval': ISO}),
+    'ace': FeedSchema(timestamps={'GMTTime': ISO}, dtypes={'Value': 'float64'}),
+    'rtbm_lmp': FeedSchema(**LMP),
+    'da_lmp': FeedSchema(**LMP, chunked=True),
+    # the end was left off of this file's timestamp name
+    'stlf': FeedSchema(timestamps={'GMTInterval': MDY}, dtypes={'STLF': 'float64', 'Actual': 'float64'},
+                       rename={'GMTInterval': 'GMTIntervalEnd'}, drop=['Interval']),
+    'mtlf': FeedSchema(timestamps={'GMTIntervalEnd': MDY}, dtypes={'MTLF': 'float64', 'Averaged Actual': 'float64'},
+                       drop=['Interval']),
+    # the other columns are area names, which become values in tie_flows_long.area; keep them as they are
+    'tie_flows_long': FeedSchema(timestamps={'GMTTime': ISO}, rename={'GMTTime': 'gmttime'}, snake_case=False),
+    'rt_binding': FeedSchema(timestamps={'GMTIntervalEnd': MDY},
+                             dtypes={'Constraint Name': 'str', 'Constraint Type': 'str', 'Shadow Price': 'float64',
+                                     'Monitored Facility': 'str', 'Contingent Facility': 'str'},
+                             drop=['Interval']),
+}
+
+
+@lru_cache(maxsize=None)
+def snake(name):
+    # 'GMTIntervalEnd' -> 'gmtinterval_end', ' Coal Market' -> 'coal_market'; the renames
+    # standardize_columns() has always done, worked out once per name
+    name = re.sub('^ ', '', name)
+    name = re.sub('(?<=[a-z])(?=[A-Z])', '_', name)
+    name = re.sub('[_ ]+', '_', name)
+    return name.lower()
+
+
+def _read_arrow(schema, file):
+    column_types = {}
+    for column, fmt in schema.timestamps.items():
+        column_types[column] = pa.timestamp('s', tz='UTC') if fmt == ISO else pa.timestamp('s')
+    for column, dtype in schema.dtypes.items():
+        column_types[column] = pa.string() if dtype == 'str' else pa.from_numpy_dtype(dtype)
+    convert = pacsv.ConvertOptions(column_types=column_types,
+                                   timestamp_parsers=[MDY] if MDY in schema.timestamps.values() else None)
+    if not schema.chunked:
+        return pacsv.read_csv(file, convert_options=convert).to_pandas()
+    reader = pacsv.open_csv(file, read_options=pacsv.ReadOptions(block_size=BLOCK_BYTES),
+                            convert_options=convert)
+    return pd.concat([batch.to_pandas() for batch in reader], ignore_index=True)
+
+
+def _read_pandas(schema, file):
+    dtypes = {column: (object if dtype == 'str' else dtype) for column, dtype in schema.dtypes.items()}
+    if not schema.chunked:
+        return pd.read_csv(file, dtype=dtypes)
+    return pd.concat(pd.read_csv(file, dtype=dtypes, chunksize=CHUNK_ROWS), ignore_index=True)
+
+
+def parse(feed, file):
+    # read one of feed's source files (path or file object) into a frame ready to load
+    schema = SCHEMAS[feed]
+    if not hasattr(file, 'read'):
+        with open(file, 'rb') as f:
+            return parse(feed, io.BytesIO(f.read()))
+    df = None
+    if pa is not None:
+        try:
+            df = _read_arrow(schema, file)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            # a format change at SPP shouldn't stop the load; the pandas path is more forgiving
+            print(f"spp_schema {feed}: pyarrow could not parse the file ({e}); using pandas")
+            file.seek(0)
+    if df is None:
+        df = _read_pandas(schema, file)
+
+    for column, fmt in schema.timestamps.items():
+        if not isinstance(df[column].dtype, pd.DatetimeTZDtype) and not pd.api.types.is_datetime64_dtype(df[column]):
+            try:
+                df[column] = pd.to_datetime(df[column], format=fmt, utc=True)
+            except ValueError as e:
+                print(f"spp_schema {feed}: {column} is not in the declared format ({e}); inferring it")
+                df[column] = pd.to_datetime(df[column], format='mixed', utc=True)
+        elif df[column].dt.tz is None:
+            df[column] = df[column].dt.tz_localize('UTC')
+        df[column] = df[column].astype('datetime64[ns, UTC]')
+
+    df = df.drop(columns=[c for c in schema.drop if c in df.columns])
+    if schema.snake_case:
+        df.columns = [snake(schema.rename.get(c, c)) for c in df.columns]
+    else:
+        df.columns = [schema.rename.get(c, c) for c in df.columns]
+    return df
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    path = sys.argv[1]
+    feed = sys.argv[2] if len(sys.argv) > 2 else 'da_lmp'
+    schema = SCHEMAS[feed]
+
+    def old_parse(file):
+        # what the fetch_* functions did before
+        df = pd.read_csv(file, parse_dates=list(schema.timestamps))
+        for column in schema.timestamps:
+            if df[column].dt.tz is None:
+                df[column] = df[column].dt.tz_localize('UTC')
+        df.columns = (df.columns
+                        .str.replace('^ ', '', regex=True)
+                        .str.replace('(?<=[a-z])(?=[A-Z])', '_', regex=True)
+                        .str.replace('[_ ]+', '_', regex=True)
+                        .str.lower())
+        if not schema.snake_case:
+            df.columns = [schema.rename.get(c, c) for c in pd.read_csv(file, nrows=0).columns]
+        df = df.rename(columns={snake(k): snake(v) for k, v in schema.rename.items()})
+        return df.drop(columns=[snake(c) for c in schema.drop])
+
+    def measure(name, f):
+        # Python and numpy allocations are traced by tracemalloc; Arrow has its own memory pool,
+        # whose high-water mark covers the whole process (the old parser doesn't use it)
+        tracemalloc.start()
+        start = time.perf_counter()
+        df = f(path)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        arrow_peak = pa.default_memory_pool().max_memory() if pa is not None else 0
+        print(f"{name:4} {len(df.index):8} rows  {elapsed:7.3f}s  peak {peak / 2**20:7.1f} MiB python "
+              f"+ {arrow_peak / 2**20:6.1f} MiB arrow  ({df.memory_usage(deep=True).sum() / 2**20:.1f} MiB frame)")
+        return df
+
+    old = measure('old', old_parse)
+    new = measure('new', lambda p: parse(feed, p))
+    # same rows and values, whichever parser
+    pd.testing.assert_frame_equal(old.reset_index(drop=True), new.reset_index(drop=True), check_dtype=False)
+    print("old and new frames match")
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# spp_storage.py - keep the sppdata tables in local Parquet files, queried with DuckDB, instead of
+# in PostgreSQL.
+#
+# With
+#     {"backend": "duckdb", "path": "../spp_parquet"}
+# in dbconn.json, fetch_spp_data_batch.py and cleanup_old_data_batch.py run on one machine with no
+# database server: their shared con is a ParquetStore instead of a SQLAlchemy connection, and
+# pg_insertnew, pgsqldf, the deletes in the load_* functions and the cleanup job call into it.
+#
+# Layout: one directory per table, one directory per UTC day of its time key, and a Parquet file
+# per load:
+#     <path>/rtbm_lmp_by_location/2023-03-02/1677776700123456789.parquet
+# (tables without a time key, like settlement_location, keep their files in <path>/<table>/all).
+# Each table is a DuckDB view over its files, and views_duckdb.sql (views.sql, ported) defines
+# the display views over those; they are computed when read, so there are no _mat tables or
+# NOTIFY here, and spp_api.py still needs Postgres.
+#
+# insertnew() is pg_insertnew for Parquet: the frame goes to DuckDB as an Arrow table (no copy
+# for the numeric and timestamp columns), is anti-joined on the primary key against the files of
+# the days it covers, and what is new is written as one more file per day. Files are written
+# under a temporary name and renamed into place, so a reader never sees part of one. When a day
+# has more than COMPACT_FILES files (the 5-minute feeds write 288 a day) they are merged into one.
+# Deletes rewrite the files of the days that have matching rows; retention removes whole day
+# directories, like dropping a partition. There are no transactions: commit() and rollback() do
+# nothing, and a file, once renamed into place, is loaded.
+#
+# A new store has no tables; each is created by its first load. To start one from nothing:
+#     python3 spp_locations.py                  # settlement_location, for the map views
+#     python3 fetch_spp_data_batch.py           # generation_mix first, then the other feeds
+# (fetch_spp_data_batch.py also runs without settlement_location; the maps then place nothing.)
+#
+# To copy the tables from the Postgres database in dbconn.json into a store, and to compare the
+# two (load time, size on disk, and how long each display view takes to read):
+#     python3 spp_storage.py --copy-from-postgres [--path ../spp_parquet]
+#     python3 spp_storage.py --bench [--path ../spp_parquet]
+
+import glob
+import os
+import re
+import shutil
+import time
+
+import pandas as pd
+from sqlalchemy.sql.elements import TextClause
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    duckdb = None
+
+DEFAULT_PATH = '../spp_parquet'
+VIEWS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'views_duckdb.sql')
+
+# table -> (time key that files are split by day on, or None; primary key, the one its load_*
+# function in fetch_spp_data_batch.py gives it, so that copied and loaded rows dedupe the same way)
+TABLES = {
+    'generation_mix': ('gmt_mkt_interval', ['gmt_mkt_interval']),
+    'area_control_error': ('gmttime', ['gmttime']),
+    'rtbm_lmp_by_location': ('gmtinterval_end', ['gmtinterval_end', 'settlement_location']),
+    'da_lmp_by_location': ('gmtinterval_end', ['gmtinterval_end', 'settlement_location']),
+    'stlf_vs_actual': ('gmtinterval_end', ['gmtinterval_end']),
+    'mtlf_vs_actual': ('gmtinterval_end', ['gmtinterval_end']),
+    'tie_flows_long': ('gmttime', ['gmttime', 'area']),
+    'rtbm_binding_constraints': ('gmtinterval_end', ['gmtinterval_end', 'constraint_name']),
+    'settlement_location': (None, ['settlement_location']),
+    'feed_publication': ('cycle_start', ['cycle_start', 'feed']),
+    'lmp_grid': ('gmtinterval_end', ['gmtinterval_end', 'feed', 'price']),
+}
+
+# merge a day's files once there are more than this many
+COMPACT_FILES = 24
+
+
+def uses_duckdb(di):
+    # True if dbconn.json asks for the Parquet store
+    return di.get('backend') == 'duckdb'
+
+
+def is_store(con):
+    return isinstance(con, ParquetStore)
+
+
+def read_sql(con, query, params=None):
+    # pd.read_sql for either backend
+    if is_store(con):
+        return con.read_sql(query, params)
+    from sqlalchemy import text
+    return pd.read_sql(query if isinstance(query, TextClause) else text(query), con, params=params)
+
+
+def has_table(con, table):
+    # True if table exists, for either backend (a new store has no tables until they are loaded)
+    if is_store(con):
+        return table in con.tables
+    from sqlalchemy import text
+    return con.execute(text("select to_regclass(:t) is not null"), {'t': table}).scalar()
+
+
+def delete(con, table, where):
+    # delete from table where <where>, for either backend
+    if is_store(con):
+        return con.delete(table, where)
+    from sqlalchemy import text
+    return con.execute(text(f"delete from {table} where {where}")).rowcount
+
+
+class _Result:
+    # the parts of a SQLAlchemy result the scripts use
+    def __init__(self, cursor):
+        self.rows = cursor.fetchall() if cursor.description else []
+        self.rowcount = len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+    def scalars(self):
+        return [row[0] for row in self.rows]
+
+
+class ParquetStore:
+    invalidated = False
+    closed = False
+
+    def __init__(self, path=DEFAULT_PATH):
+        if duckdb is None:
+            raise ImportError("the duckdb backend needs the duckdb and pyarrow packages")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.duck = duckdb.connect()
+        # days are UTC days, as in spp_partitions.py
+        self.duck.execute("set TimeZone = 'UTC'")
+        self.tables = set()
+        for table in sorted(os.listdir(path)):
+            if glob.glob(os.path.join(path, table, '*', '*.parquet')):
+                self._attach(table)
+        self.load_views()
+
+    # SQLAlchemy connection stand-ins
+    def execute(self, query, params=None):
+        return _Result(self.duck.execute(*self._sql(query, params)))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.duck.close()
+        self.closed = True
+
+    def read_sql(self, query, params=None):
+        return self.duck.execute(*self._sql(query, params)).df()
+
+    def _sql(self, query, params):
+        # SQLAlchemy's :name parameters are $name in DuckDB
+        query = str(query) if isinstance(query, TextClause) else query
+        if not params:
+            return (query, )
+        return (re.sub(r'(?<!:):(\w+)', r'$\1', query), params)
+
+    def _attach(self, table):
+        self.duck.execute(f"""
+            create or replace view {table} as
+            select * from read_parquet('{os.path.join(self.path, table)}/*/*.parquet', union_by_name = true)""")
+        self.tables.add(table)
+
+    def load_views(self):
+        # (re)create the display views; a view whose tables haven't been loaded yet waits for them
+        with open(VIEWS_FILE) as f:
+            script = re.sub(r'--[^\n]*', '', f.read())
+        for statement in filter(str.strip, script.split(';')):
+            try:
+                self.duck.execute(statement)
+            except duckdb.CatalogException:
+                pass
+
+    # files
+    def _day_dirs(self, table):
+        return sorted(glob.glob(os.path.join(self.path, table, '*')))
+
+    @staticmethod
+    def _files(day_dir):
+        return sorted(glob.glob(os.path.join(day_dir, '*.parquet')))
+
+    @staticmethod
+    def _write(arrow, day_dir):
+        os.makedirs(day_dir, exist_ok=True)
+        name = os.path.join(day_dir, f"{time.time_ns()}.parquet")
+        pq.write_table(arrow, name + '.tmp')
+        os.replace(name + '.tmp', name)
+        return name
+
+    def _replace(self, day_dir, files, query):
+        # write the result of query over files as one file, in place of files
+        arrow = self.duck.execute(query.format(files=self._file_list(files))).to_arrow_table()
+        if arrow.num_rows:
+            self._write(arrow, day_dir)
+        for name in files:
+            os.remove(name)
+
+    @staticmethod
+    def _arrow(df):
+        # df as an Arrow table, without df.attrs: the loaders keep datetimes there (published,
+        # seen), which pandas can't serialize into the schema metadata, and warns about
+        df = df.copy(deep=False)
+        df.attrs = {}
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    @staticmethod
+    def _file_list(files):
+        return '[' + ', '.join(f"'{name}'" for name in files) + ']'
+
+    def insertnew(self, table, primary_keys, df):
+        # insert the rows of df whose primary key isn't in table yet; like pg_insertnew
+        key = TABLES.get(table, (None, None))[0]
+        arrow = self._arrow(df)
+        self.duck.register('_new', arrow)
+        try:
+            if key is None:
+                groups = [('all', "true")]
+            else:
+                days = self.duck.execute(f"select distinct cast({key} as date) from _new order by 1").fetchall()
+                groups = [(str(day), f"cast({key} as date) = '{day}'") for day, in days]
+
+            inserted = 0
+            new_table = table not in self.tables
+            keys = ', '.join(f'"{c}"' for c in primary_keys)
+            for day, where in groups:
+                day_dir = os.path.join(self.path, table, day)
+                files = self._files(day_dir)
+                query = f"select * from _new where {where} qualify row_number() over (partition by {keys}) = 1"
+                if files:
+                    query = f"""
+                        select * from ({query}) n
+                        anti join read_parquet({self._file_list(files)}, union_by_name = true) o using ({keys})"""
+                new = self.duck.execute(query).to_arrow_table()
+                if new.num_rows:
+                    self._write(new, day_dir)
+                    inserted += new.num_rows
+                    files = self._files(day_dir)
+                    if len(files) > COMPACT_FILES:
+                        self._replace(day_dir, files, "select * from read_parquet({files}, union_by_name = true)")
+        finally:
+            self.duck.unregister('_new')
+
+        if new_table and inserted:
+            self._attach(table)
+            self.load_views()
+        print(f"insertnew {table}: {len(df.index)} rows, {inserted} inserted, {len(df.index) - inserted} skipped")
+        return {'rows': len(df.index), 'inserted': inserted, 'skipped': len(df.index) - inserted}
+
+    def delete(self, table, where):
+        # delete from table where <where>, by rewriting the days that have such rows
+        if table not in self.tables:
+            return 0
+        deleted = 0
+        for day_dir in self._day_dirs(table):
+            files = self._files(day_dir)
+            found = self.duck.execute(f"""
+                select count(*) from read_parquet({self._file_list(files)}, union_by_name = true)
+                where {where}""").fetchone()[0]
+            if found:
+                self._replace(day_dir, files,
+                              f"select * from read_parquet({{files}}, union_by_name = true) where not coalesce({where}, false)")
+                deleted += found
+        return deleted
+
+    def replace(self, table, df):
+        # make df the whole of a table without a time key (like truncate and reload); the new file
+        # is in place before the old ones are removed, so a reader never finds the table empty
+        day_dir = os.path.join(self.path, table, 'all')
+        files = self._files(day_dir)
+        self._write(self._arrow(df), day_dir)
+        for name in files:
+            os.remove(name)
+        if table not in self.tables:
+            self._attach(table)
+            self.load_views()
+
+    def version(self, table):
+        # the names of table's files, which change whenever it is written
+        return tuple(os.path.basename(name) for day_dir in self._day_dirs(table) for name in self._files(day_dir))
+
+    def drop_old_days(self, table, older_than):
+        # remove the days whose whole day is older than older_than (a Postgres-style interval, as
+        # in '2 weeks'); returns the days removed
+        cutoff = self.duck.execute(f"select cast(current_timestamp - interval '{older_than}' as date)").fetchone()[0]
+        dropped = []
+        for day_dir in self._day_dirs(table):
+            day = os.path.basename(day_dir)
+            if day != 'all' and day < str(cutoff):
+                shutil.rmtree(day_dir)
+                dropped.append(day)
+        return dropped
+
+    def space(self):
+        # files and bytes on disk per table
+        rows = []
+        for table in sorted(self.tables):
+            files = glob.glob(os.path.join(self.path, table, '*', '*.parquet'))
+            rows.append({'relation': table, 'days': len(self._day_dirs(table)), 'files': len(files),
+                         'total_size': sum(os.path.getsize(name) for name in files)})
+        return pd.DataFrame(rows)
+
+
+def copy_from_postgres(pg, store, chunk_rows=200000):
+    # copy every table in TABLES from the Postgres connection pg into store; returns seconds per table
+    from sqlalchemy import text
+    seconds = {}
+    for table, (key, primary_keys) in TABLES.items():
+        start = time.perf_counter()
+        query = text(f"select * from {table}" + (f" order by {key}" if key else ''))
+        for df in pd.read_sql(query, pg.execution_options(stream_results=True), chunksize=chunk_rows):
+            store.insertnew(table, primary_keys, df)
+        seconds[table] = time.perf_counter() - start
+    return seconds
+
+
+def bench(pg, store, repeat=5):
+    # (size of each table, median time to read each display view) in Postgres and in the store
+    from sqlalchemy import text
+
+    def median_seconds(f):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        return sorted(times)[repeat // 2]
+
+    import spp_compact
+
+    sizes = []
+    parquet_bytes = store.space().set_index('relation')['total_size']
+    for table in TABLES:
+        sizes.append({'table': table, 'postgres_mb': round(spp_compact.table_bytes(pg, table) / 2**20, 2),
+                      'parquet_mb': round(parquet_bytes.get(table, 0) / 2**20, 2)})
+
+    rows = []
+
+    views = store.execute("""
+        select view_name from duckdb_views() where not internal and view_name like '%\\_vw' escape '\\'
+        order by 1""").scalars()
+    for view in views:
+        row = {'relation': view}
+        # the Postgres dashboard reads _mat tables; time the views that compute the answer, too
+        for name in [view.replace('_vw', '_live_vw'), view]:
+            if pg.execute(text("select to_regclass(:v)"), {'v': name}).scalar():
+                column = 'postgres_live_ms' if name != view else 'postgres_ms'
+                row[column] = round(median_seconds(lambda: pd.read_sql(text(f"select * from {name}"), pg)) * 1000, 1)
+                pg.commit()
+        row['parquet_ms'] = round(median_seconds(lambda: store.read_sql(f"select * from {view}")) * 1000, 1)
+        row['rows'] = len(store.read_sql(f"select * from {view}").index)
+        rows.append(row)
+    return pd.DataFrame(sizes), pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="the sppdata tables as local Parquet files")
+    parser.add_argument('--path', default=DEFAULT_PATH, help="where the Parquet files are kept")
+    parser.add_argument('--copy-from-postgres', action='store_true',
+                        help="copy the tables from the Postgres database in dbconn.json")
+    parser.add_argument('--bench', action='store_true', help="compare the store with the Postgres database")
+    args = parser.parse_args()
+
+    store = ParquetStore(args.path)
+    if args.copy_from_postgres or args.bench:
+        # read the database information from the json file
+        with open('../dbconn.json', 'r') as f:
+            di = json.load(f)
+        pg_uri = f"//{di['username']}:{di['password']}@{di['host']}:{di['port']}/{di['database']}"
+        pg = create_engine(f'postgresql+psycopg2:{pg_uri}',
+                           connect_args={'options': '-c search_path=sppdata'}).connect()
+        if args.copy_from_postgres:
+            seconds = copy_from_postgres(pg, store)
+            print(pd.Series(seconds, name='seconds').round(2).to_string())
+        if args.bench:
+            sizes, views = bench(pg, store)
+            print(sizes.to_string(index=False))
+            print(views.to_string(index=False))
+    print(store.space().to_string(index=False))
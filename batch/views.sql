@@ -12,13 +12,24 @@ drop view if exists generation_mix_piechart_vw;
 drop view if exists emissions_trend_vw;
 drop view if exists rtbm_lmp_map_vw;
 drop view if exists da_lmp_map_vw;
+drop view if exists rtbm_binding_constraints_vw;
+-- and the dashboard tables built from the _live_vw views (see the end of this file)
+drop table if exists generation_mix_piechart_mat;
+drop table if exists emissions_trend_mat;
+drop table if exists rtbm_lmp_map_mat;
+drop table if exists da_lmp_map_mat;
+drop table if exists rtbm_binding_constraints_mat;
+drop view if exists generation_mix_piechart_live_vw;
+drop view if exists emissions_trend_live_vw;
+drop view if exists rtbm_lmp_map_live_vw;
+drop view if exists da_lmp_map_live_vw;
+drop view if exists rtbm_binding_constraints_live_vw;
 drop view if exists demand_vs_forecast_vw;
 drop view if exists tie_flows_long_vw; 
 drop view if exists area_control_error_vw;
-drop view if exists rtbm_binding_constraints_vw;
 
 --  Feature:  current generation mix 
-create view generation_mix_piechart_vw as 
+create view generation_mix_piechart_live_vw as 
 with mostrecent as ( 
   select generation_mix.*, gmt_mkt_interval at time zone 'America/Chicago' as local_mkt_interval
    from sppdata.generation_mix where gmt_mkt_interval = 
@@ -37,7 +48,7 @@ union all select local_mkt_interval, 'Other' as label, waste_disposal_services_m
 
 
 --  Feature:  emissions trend 
-create view emissions_trend_vw as 
+create view emissions_trend_live_vw as 
 with mostrecent as ( 
   select * from sppdata.generation_mix 
   -- start by selecting the most recent 7 days of data; we'll need this to calculate the weekly average
@@ -79,11 +90,11 @@ as lbs_co2_per_kwh,
 calcsavg.weekly_average
 from calcs
 cross join calcsavg -- only one value the same for all timepoints, creating a horizontal line on the graph 
-order by local_mkt_interval
+-- (so every row changes when an interval loads, and spp_dashboard.py rebuilds all of emissions_trend_mat)
 ;
 
 -- Feature:  RTBM LMP map 
-create view rtbm_lmp_map_vw as 
+create view rtbm_lmp_map_live_vw as 
 with mostrecent as ( 
   select * from sppdata.rtbm_lmp_by_location
   where gmtinterval_end = 
@@ -108,7 +119,7 @@ join mostrecent on (mostrecent.settlement_location = sl.settlement_location)
 ;
 
 -- Feature:  DAMKT LMP map
-create view da_lmp_map_vw as
+create view da_lmp_map_live_vw as
 with mostrecent as (
   select * from sppdata.da_lmp_by_location
   where gmtinterval_end =
@@ -201,7 +212,7 @@ order by gmttime
 ;
 
 -- Feature: RTBM binding constraints display
-create or replace view rtbm_binding_constraints_vw as
+create or replace view rtbm_binding_constraints_live_vw as
 select gmtinterval_end at time zone 'America/Chicago' as interval_ending,
 constraint_name, 
 constraint_type, 
@@ -210,11 +221,39 @@ constraint_type,
 -- state as "State",
 shadow_price,
 monitored_facility, 
-contingent_facility 
+contingent_facility, 
+-- kept for the staleness check in rtbm_binding_constraints_vw
+gmtinterval_end
 from sppdata.rtbm_binding_constraints
 where gmtinterval_end = (select max(gmtinterval_end) from rtbm_binding_constraints)
+;
+
+-- Dashboard tables
+-- The _live_vw views above find the most recent interval with max() and join settlement_location
+-- (or average a week of generation mix) every time they are read. The dashboard reads the _vw views
+-- below instead, which are plain selects from small tables holding just the current answer.
+-- fetch_spp_data_batch.py rebuilds each table from its _live_vw view right after the feed it depends
+-- on loads (see spp_dashboard.py), so readers never touch the raw tables.
+-- The tables are created, and filled once, here; rerun this file after changing a _live_vw view.
+create table generation_mix_piechart_mat as select * from generation_mix_piechart_live_vw;
+create table emissions_trend_mat as select * from emissions_trend_live_vw;
+create table rtbm_lmp_map_mat as select * from rtbm_lmp_map_live_vw;
+create table da_lmp_map_mat as select * from da_lmp_map_live_vw;
+create table rtbm_binding_constraints_mat as select * from rtbm_binding_constraints_live_vw;
+
+create view generation_mix_piechart_vw as select * from generation_mix_piechart_mat;
+
+create view emissions_trend_vw as select * from emissions_trend_mat order by local_mkt_interval;
+
+create view rtbm_lmp_map_vw as select * from rtbm_lmp_map_mat;
+
+create view da_lmp_map_vw as select * from da_lmp_map_mat;
+
+create view rtbm_binding_constraints_vw as
+select interval_ending, constraint_name, constraint_type, shadow_price, monitored_facility, contingent_facility 
+from rtbm_binding_constraints_mat
 -- avoid returning stale data if ETL has failed 
-and gmtinterval_end > current_timestamp - interval '1 hours'
+where gmtinterval_end > current_timestamp - interval '1 hours'
 order by shadow_price , constraint_type desc, 
 monitored_facility, contingent_facility, constraint_name
 ;
@@ -223,12 +262,17 @@ monitored_facility, contingent_facility, constraint_name
 \timing
 
 -- time execution, look for slow queries
+select count(*) from generation_mix_piechart_live_vw limit 1;
 select count(*) from generation_mix_piechart_vw limit 1;
-select count(*) from emissions_trend_vw_orig limit 1;
+select count(*) from emissions_trend_live_vw limit 1;
 select count(*) from emissions_trend_vw limit 1;
+select count(*) from rtbm_lmp_map_live_vw limit 1;
 select count(*) from rtbm_lmp_map_vw limit 1;
+select count(*) from da_lmp_map_live_vw limit 1;
+select count(*) from da_lmp_map_vw limit 1;
 select count(*) from demand_vs_forecast_vw limit 1;
 select count(*) from tie_flows_long_vw limit 1; 
 select count(*) from area_control_error_vw limit 1;
+select count(*) from rtbm_binding_constraints_live_vw limit 1;
 select count(*) from rtbm_binding_constraints_vw limit 1;
 
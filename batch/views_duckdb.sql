@@ -0,0 +1,191 @@
+-- views_duckdb.sql - the display views from views.sql, for the DuckDB / Parquet store (spp_storage.py).
+
+--    spp_storage.ParquetStore creates these every time it opens the store, and again when a table
+--    is loaded for the first time; a view over tables that haven't been loaded yet is skipped until
+--    they have been. The tables themselves are views over their Parquet files.
+--    These compute their answer when read, like the _live_vw views in views.sql: there are no
+--    _mat tables here. Differences from the Postgres views:
+--      to_char(t, 'DD-Mon HH24:MI')                  -> strftime(t, '%d-%b %H:%M')
+--      date_trunc('day', t, 'America/Chicago')       -> timezone('America/Chicago', date_trunc('day', timezone('America/Chicago', t)))
+--    Keep them in step with views.sql.
+
+--  Feature:  current generation mix
+create or replace view generation_mix_piechart_vw as
+with mostrecent as (
+  select generation_mix.*, gmt_mkt_interval at time zone 'America/Chicago' as local_mkt_interval
+   from generation_mix where gmt_mkt_interval =
+    (select max(gmt_mkt_interval) from generation_mix)
+)
+select local_mkt_interval, 'Hydro' as label, hydro_market+hydro_self as value from  mostrecent
+union all select local_mkt_interval, 'Solar' as label, solar_market+solar_self as value from mostrecent
+union all select local_mkt_interval, 'Wind' as label, wind_market+wind_self as value from mostrecent
+union all select local_mkt_interval, 'Nuclear' as label, nuclear_market+nuclear_self as value from mostrecent
+union all select local_mkt_interval, 'Diesel' as label, diesel_fuel_oil_market+diesel_fuel_oil_self as value from mostrecent
+union all select local_mkt_interval, 'Coal' as label, coal_market+coal_self as value from mostrecent
+union all select local_mkt_interval, 'Natural Gas' as label, natural_gas_market+natural_gas_self as value from mostrecent
+union all select local_mkt_interval, 'Other' as label, waste_disposal_services_market+waste_disposal_services_self +
+  waste_heat_market+waste_heat_self+other_market+other_self as value from mostrecent
+;
+
+--  Feature:  emissions trend
+create or replace view emissions_trend_vw as
+with mostrecent as (
+  select * from generation_mix
+  where gmt_mkt_interval > current_timestamp - interval '7 days'
+)
+, calcs as (
+    select
+    gmt_mkt_interval,
+      (hydro_market+hydro_self)
+    + (solar_market+solar_self)
+    + (wind_market+wind_self)
+    + (nuclear_market+nuclear_self)
+    + (diesel_fuel_oil_market+diesel_fuel_oil_self)
+    + (coal_market+coal_self)
+    + (natural_gas_market+natural_gas_self)
+    + (waste_disposal_services_market+waste_disposal_services_self +
+       waste_heat_market+waste_heat_self+other_market+other_self)
+    as total_generation,
+    (coal_market+coal_self) * 1000 * 2.26 as coal_co2_lbs,
+    (natural_gas_market+natural_gas_self) * 1000 *  0.97 as natural_gas_co2_lbs,
+    (diesel_fuel_oil_market+diesel_fuel_oil_self) * 1000 * 2.44 as fuel_oil_co2_lbs
+    from mostrecent
+)
+, calcsavg as (
+    select
+      avg((calcs.coal_co2_lbs + calcs.natural_gas_co2_lbs + calcs.fuel_oil_co2_lbs) / calcs.total_generation) / 1000.0
+    as weekly_average
+    from calcs
+)
+select
+calcs.gmt_mkt_interval at time zone 'America/Chicago' as local_mkt_interval,
+round((calcs.coal_co2_lbs + calcs.natural_gas_co2_lbs + calcs.fuel_oil_co2_lbs) / calcs.total_generation) / 1000.0
+as lbs_co2_per_kwh,
+calcsavg.weekly_average
+from calcs
+cross join calcsavg
+order by local_mkt_interval
+;
+
+-- Feature:  RTBM LMP map
+create or replace view rtbm_lmp_map_vw as
+with mostrecent as (
+  select * from rtbm_lmp_by_location
+  where gmtinterval_end =
+    (select max(gmtinterval_end) from rtbm_lmp_by_location)
+)
+select
+strftime(mostrecent.gmtinterval_end at time zone 'America/Chicago', '%d-%b %H:%M') as rtbm_interval_ending,
+mostrecent.pnode,
+mostrecent.lmp,
+mostrecent.mcc,
+mostrecent.mlc,
+sl.settlement_location,
+sl.est_latitude,
+sl.est_longitude,
+sl.inferred_location_type,
+0.2 as size
+from settlement_location sl
+join mostrecent on (mostrecent.settlement_location = sl.settlement_location)
+;
+
+-- Feature:  DAMKT LMP map
+create or replace view da_lmp_map_vw as
+with mostrecent as (
+  select * from da_lmp_by_location
+  where gmtinterval_end =
+  -- the DA hour ending that the latest RT interval end falls in
+  date_trunc('hour', (select max(gmtinterval_end) from rtbm_lmp_by_location) + interval '55 minutes')
+)
+select
+strftime(mostrecent.gmtinterval_end at time zone 'America/Chicago', '%d-%b %H:%M') as da_hour_ending,
+mostrecent.pnode,
+mostrecent.lmp,
+mostrecent.mcc,
+mostrecent.mlc,
+sl.settlement_location,
+sl.est_latitude,
+sl.est_longitude,
+sl.inferred_location_type,
+0.2 as size
+from settlement_location sl
+join mostrecent on (mostrecent.settlement_location = sl.settlement_location)
+;
+
+-- Feature: Demand vs. Forecast display
+create or replace view demand_vs_forecast_vw as
+with report_times as (
+      select timezone('America/Chicago', date_trunc('day', timezone('America/Chicago', current_timestamp))) as report_begin,
+      timezone('America/Chicago', date_trunc('day', timezone('America/Chicago', current_timestamp + interval '1 day'))) as report_end
+)
+, mtlf as (
+    select gmtinterval_end,
+      mtlf
+    from mtlf_vs_actual where gmtinterval_end > (select report_begin from report_times)
+                          and gmtinterval_end <= (select report_end from report_times)
+)
+, stlf as (
+    select gmtinterval_end,
+      stlf,
+      actual
+    from stlf_vs_actual where gmtinterval_end > (select report_begin from report_times)
+                          and gmtinterval_end <= (select report_end from report_times)
+)
+
+select stlf.gmtinterval_end at time zone 'America/Chicago' as interval_ending,
+'Short-Term Load Forecast' as measure,
+stlf.stlf as mw
+from stlf
+
+union all
+
+select stlf.gmtinterval_end at time zone 'America/Chicago' as "Interval Ending",
+'Demand' as measure,
+stlf.actual as mw
+from stlf
+
+union all
+
+select mtlf.gmtinterval_end at time zone 'America/Chicago' as "Interval Ending",
+'Mid-Term Load Forecast' as measure,
+mtlf.mtlf as mw
+from mtlf
+
+order by interval_ending
+;
+
+-- Feature: Tie flows display
+create or replace view tie_flows_long_vw as
+select gmttime at time zone 'America/Chicago' as local_time,
+area,
+mw
+from tie_flows_long
+where gmttime > current_timestamp - interval '2 hours'
+and gmttime < current_timestamp + interval '30 minutes'
+order by area, gmttime
+;
+
+-- Feature: Area control error display
+create or replace view area_control_error_vw as
+select gmttime at time zone 'America/Chicago' as "local_time",
+value as mw
+from area_control_error
+where gmttime > current_timestamp - interval '2 hours'
+order by gmttime
+;
+
+-- Feature: RTBM binding constraints display
+create or replace view rtbm_binding_constraints_vw as
+select gmtinterval_end at time zone 'America/Chicago' as interval_ending,
+constraint_name,
+constraint_type,
+shadow_price,
+monitored_facility,
+contingent_facility
+from rtbm_binding_constraints
+where gmtinterval_end = (select max(gmtinterval_end) from rtbm_binding_constraints)
+-- avoid returning stale data if ETL has failed
+and gmtinterval_end > current_timestamp - interval '1 hours'
+order by shadow_price , constraint_type desc,
+monitored_facility, contingent_facility, constraint_name
+;